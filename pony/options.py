@@ -61,6 +61,7 @@ CONSOLE_ENCODING = None
 # db options
 PREFETCHING = True
 MAX_FETCH_COUNT = None
+QUERY_CACHE_SIZE = 1000  # maximum number of entries in each of query translation caches
 
 # used for select(...).show()
 CONSOLE_WIDTH = 80
@@ -4,7 +4,7 @@ from functools import update_wrapper
 
 from pony.thirdparty.compiler import ast
 
-from pony.utils import throw
+from pony.utils import throw, LRUCache
 
 class TranslationError(Exception): pass
 
@@ -217,6 +217,7 @@ class PreTranslator(ASTTranslator):
         if additional_internal_names:
             translator.contexts.append(additional_internal_names)
         translator.externals = externals = set()
+        translator.in_containers = set()
         translator.dispatch(tree)
         for node in externals.copy():
             if isinstance(node, nonexternalizable_types) \
@@ -267,6 +268,9 @@ class PreTranslator(ASTTranslator):
         node.external = True
     def postList(translator, node):
         node.external = True
+    def postCompare(translator, node):
+        for op, right in node.ops:
+            if op in ('in', 'not in'): translator.in_containers.add(right)
     def postKeyword(translator, node):
         node.constant = node.expr.constant
     def postCallFunc(translator, node):
@@ -297,8 +301,8 @@ class PreTranslator(ASTTranslator):
                 if node.dstar_args is not None and not node.dstar_args.constant: return
                 node.constant = True
 
-getattr_cache = {}
-extractors_cache = {}
+getattr_cache = LRUCache()
+extractors_cache = LRUCache()
 
 def create_extractors(code_key, tree, filter_num, globals, locals,
                       special_functions, const_functions, additional_internal_names=()):
@@ -317,11 +321,16 @@ def create_extractors(code_key, tree, filter_num, globals, locals,
             tree, globals, locals, special_functions, const_functions, additional_internal_names)
 
         extractors = {}
+        in_list_srcs = set()
+        other_srcs = set()
         for node in pretranslator.externals:
             src = node.src = ast2src(node)
             if src == '.0': code = None
             else: code = compile(src, src, 'eval')
             extractors[filter_num, src] = code
+            if node in pretranslator.in_containers: in_list_srcs.add(src)
+            else: other_srcs.add(src)
+        list_keys = frozenset((filter_num, src) for src in in_list_srcs - other_srcs)
 
         getattr_extractors = {}
         getattr_attrname_values = {}
@@ -342,5 +351,5 @@ def create_extractors(code_key, tree, filter_num, globals, locals,
         varnames = list(sorted(extractors))
         getattr_attrname_values = tuple(val for key, val in sorted(getattr_attrname_values.items()))
         extractors_key = (code_key, filter_num, getattr_attrname_values)
-        result = extractors_cache[extractors_key] = extractors, varnames, tree, extractors_key
+        result = extractors_cache[extractors_key] = extractors, varnames, tree, extractors_key, list_keys
     return result
@@ -2,32 +2,37 @@ from __future__ import absolute_import, print_function, division
 from pony.py23compat import PY2, izip, imap, iteritems, itervalues, items_list, values_list, xrange, cmp, \
                             basestring, unicode, buffer, int_types, builtins, pickle, with_metaclass
 
-import io, json, re, sys, types, datetime, logging, itertools
+import io, json, re, sys, types, base64, datetime, logging, itertools
 from operator import attrgetter, itemgetter
 from itertools import chain, starmap, repeat
 from time import time
 from decimal import Decimal
+from uuid import UUID, uuid4
 from random import shuffle, randint, random
 from threading import Lock, RLock, currentThread as current_thread, _MainThread
 from contextlib import contextmanager
 from collections import defaultdict
 from hashlib import md5
-from inspect import isgeneratorfunction
+from inspect import isgeneratorfunction, getcallargs, CO_VARARGS, CO_VARKEYWORDS
 
 from pony.thirdparty.compiler import ast, parse
 
 import pony
 from pony import options
-from pony.orm.decompiling import decompile
-from pony.orm.ormtypes import LongStr, LongUnicode, numeric_types, RawSQL, get_normalized_type_of, Json
-from pony.orm.asttranslation import ast2src, create_extractors, TranslationError
+from pony.orm.decompiling import decompile, get_code_key, ast_cache, InvalidQuery
+from pony.orm.ormtypes import LongStr, LongUnicode, numeric_types, RawSQL, get_normalized_type_of, Json, \
+     normalize_type, are_assignable_types
+from pony.orm.asttranslation import ast2src, create_extractors, TranslationError, getattr_cache, extractors_cache
 from pony.orm.dbapiprovider import (
     DBAPIProvider, DBException, Warning, Error, InterfaceError, DatabaseError, DataError,
-    OperationalError, IntegrityError, InternalError, ProgrammingError, NotSupportedError
+    OperationalError, IntegrityError, InternalError, ProgrammingError, NotSupportedError, PoolTimeoutError
     )
+from pony.orm.sharedcache import CacheBackend, LocalCache
+from pony.orm.sqlbuilding import get_sql_ast_tables, overrides
 from pony import utils
+from pony.converting import str2date, str2time, str2datetime
 from pony.utils import localbase, decorator, cut_traceback, throw, reraise, truncate_repr, get_lambda_args, \
-     deprecated, import_module, parse_expr, is_ident, tostring, strjoin, concat
+     deprecated, import_module, parse_expr, is_ident, tostring, strjoin, concat, LRUCache, lambda_args_cache
 
 __all__ = '''
     pony
@@ -35,7 +40,7 @@ __all__ = '''
     DBException RowNotFound MultipleRowsFound TooManyRowsFound
 
     Warning Error InterfaceError DatabaseError DataError OperationalError
-    IntegrityError InternalError ProgrammingError NotSupportedError
+    IntegrityError InternalError ProgrammingError NotSupportedError PoolTimeoutError
 
     OrmError ERDiagramError DBSchemaError MappingError
     TableDoesNotExist TableIsNotEmpty ConstraintError CacheIndexError PermissionError
@@ -49,6 +54,8 @@ __all__ = '''
 
     Database sql_debug show
 
+    CacheBackend LocalCache
+
     PrimaryKey Required Optional Set Discriminator
     composite_key composite_index
     flush commit rollback db_session with_transaction
@@ -105,8 +112,8 @@ def args2str(args):
     elif isinstance(args, dict):
         return '{%s}' % ', '.join('%s:%s' % (repr(key), repr(val)) for key, val in sorted(iteritems(args)))
 
-adapted_sql_cache = {}
-string2ast_cache = {}
+adapted_sql_cache = LRUCache()
+string2ast_cache = LRUCache()
 
 class OrmError(Exception): pass
 
@@ -244,6 +251,7 @@ def adapt_sql(sql, paramstyle):
     return result
 
 num_counter = itertools.count()
+table_version_counter = itertools.count(1)
 
 class Local(localbase):
     def __init__(local):
@@ -324,15 +332,18 @@ def rollback():
 select_re = re.compile(r'\s*select\b', re.IGNORECASE)
 
 class DBSessionContextManager(object):
-    __slots__ = 'retry', 'retry_exceptions', 'allowed_exceptions', 'immediate', 'ddl', 'serializable', 'strict'
+    __slots__ = 'retry', 'retry_exceptions', 'allowed_exceptions', 'immediate', 'ddl', 'serializable', 'strict', \
+                'readonly'
     def __init__(db_session, retry=0, immediate=False, ddl=False, serializable=False, strict=False,
-                 retry_exceptions=(TransactionError,), allowed_exceptions=()):
+                 readonly=False, retry_exceptions=(TransactionError,), allowed_exceptions=()):
         if retry is not 0:
             if type(retry) is not int: throw(TypeError,
                 "'retry' parameter of db_session must be of integer type. Got: %s" % type(retry))
             if retry < 0: throw(TypeError,
                 "'retry' parameter of db_session must not be negative. Got: %d" % retry)
             if ddl: throw(TypeError, "'ddl' and 'retry' parameters of db_session cannot be used together")
+        if readonly and (immediate or ddl or serializable): throw(TypeError,
+            "'readonly' parameter of db_session cannot be used together with 'immediate', 'ddl' or 'serializable'")
         if not callable(allowed_exceptions) and not callable(retry_exceptions):
             for e in allowed_exceptions:
                 if e in retry_exceptions: throw(TypeError,
@@ -343,6 +354,7 @@ class DBSessionContextManager(object):
         db_session.serializable = serializable
         db_session.immediate = immediate or ddl or serializable
         db_session.strict = strict
+        db_session.readonly = readonly
         db_session.retry_exceptions = retry_exceptions
         db_session.allowed_exceptions = allowed_exceptions
     def __call__(db_session, *args, **kwargs):
@@ -510,11 +522,17 @@ class Database(object):
     def __init__(self, *args, **kwargs):
         # argument 'self' cannot be named 'database', because 'database' can be in kwargs
         self.priority = 0
-        self._insert_cache = {}
+        self._insert_cache = LRUCache()
 
         # ER-diagram related stuff:
-        self._translator_cache = {}
-        self._constructed_sql_cache = {}
+        self._translator_cache = LRUCache()
+        self._constructed_sql_cache = LRUCache()
+        self._persistent_sql_cache = None
+        self._query_result_cache = LocalCache(max_size=None)
+        self._query_tables_cache = LRUCache()
+        self._table_versions = {}  # None key is used for changes in unknown tables
+        self._cached_entities = ()  # root entities with _cache_ option
+        self.cache_namespace = None
         self.entities = {}
         self.schema = None
         self.Entity = type.__new__(EntityMeta, 'Entity', (Entity,), {})
@@ -526,6 +544,10 @@ class Database(object):
         self._dblocal = DbLocal()
 
         self.provider = None
+        self.replicas = []
+        self._replica_sessions = {}
+        self._replica_counter = itertools.count()
+        self._replica_lock = Lock()
         if args or kwargs: self._bind(*args, **kwargs)
     @cut_traceback
     def bind(self, *args, **kwargs):
@@ -545,13 +567,57 @@ class Database(object):
                 'Pony no longer supports PyGreSQL module. Please use psycopg2 instead.')
             provider_module = import_module('pony.orm.dbproviders.' + provider)
             provider_cls = provider_module.provider_cls
+        replica_specs = kwargs.pop('replicas', ())
+        # keys of entity caches are prefixed with the namespace, so several databases can share a cache backend;
+        # processes which work with the same database should use the same namespace to share cached objects
+        self.cache_namespace = kwargs.pop('cache_namespace', None) or uuid4().hex
+        self.replica_selection = kwargs.pop('replica_selection', 'round_robin')
+        if self.replica_selection not in ('round_robin', 'least_busy'): throw(ValueError,
+            "Value of replica_selection option must be 'round_robin' or 'least_busy'. Got: %r"
+            % self.replica_selection)
+        self.replica_auto_routing = kwargs.pop('replica_auto_routing', False)
+        if isinstance(replica_specs, (basestring, dict)): replica_specs = [ replica_specs ]
         self.provider = provider = provider_cls(*args, **kwargs)
+        for spec in replica_specs:
+            if isinstance(spec, dict):
+                replica_args, replica_kwargs = args, kwargs.copy()
+                replica_kwargs.update(spec)
+            elif isinstance(spec, basestring): replica_args, replica_kwargs = (spec,), kwargs
+            else: throw(TypeError, 'Replica should be specified as a dict of connection parameters '
+                                   'or a connection string. Got: %r' % (spec,))
+            replica = provider_cls(*replica_args, **replica_kwargs)
+            replica.immediate_after_commit = False  # replica connections never start write transactions
+            self.replicas.append(replica)
+            self._replica_sessions[replica] = 0
     @property
     def last_sql(database):
         return database._dblocal.last_sql
     @property
     def local_stats(database):
         return database._dblocal.stats
+    @property
+    def pool_stats(database):
+        provider = database.provider
+        if provider is None: return None
+        get_stats = getattr(provider.pool, 'get_stats', None)
+        return get_stats() if get_stats is not None else None
+    def _get_query_caches(database):
+        return [ ('ast', ast_cache), ('lambda_args', lambda_args_cache),
+                 ('getattr', getattr_cache), ('extractors', extractors_cache),
+                 ('adapted_sql', adapted_sql_cache), ('string2ast', string2ast_cache),
+                 ('translator', database._translator_cache), ('constructed_sql', database._constructed_sql_cache),
+                 ('insert', database._insert_cache), ('result', database._query_result_cache) ]
+    @property
+    def query_cache_stats(database):
+        return dict((name, cache.get_stats()) for name, cache in database._get_query_caches())
+    def resize_query_caches(database, maxsize, names=None):
+        caches = database._get_query_caches()
+        if names is not None:
+            known_names = set(name for name, cache in caches)
+            for name in names:
+                if name not in known_names: throw(ValueError, 'Unknown query cache name: %r' % name)
+            caches = [ (name, cache) for name, cache in caches if name in names ]
+        for name, cache in caches: cache.resize(maxsize)
     def _update_local_stat(database, sql, query_start_time):
         dblocal = database._dblocal
         dblocal.last_sql = sql
@@ -581,6 +647,7 @@ class Database(object):
             cache.immediate = True
             cache.prepare_connection_for_query_execution()
             cache.in_transaction = True
+        cache.session_state_changed = True  # raw connection can be used in arbitrary way
         connection = cache.connection
         assert connection is not None
         return connection
@@ -592,6 +659,18 @@ class Database(object):
         cache = local.db2cache.get(database)
         if cache is not None: cache.rollback()
         provider.disconnect()
+        for replica in database.replicas: replica.disconnect()
+    def _acquire_replica(database):
+        replicas = database.replicas
+        with database._replica_lock:
+            if database.replica_selection == 'least_busy':
+                replica = builtins.min(replicas, key=database._replica_sessions.__getitem__)
+            else: replica = replicas[next(database._replica_counter) % len(replicas)]
+            database._replica_sessions[replica] += 1
+        return replica
+    def _release_replica(database, replica):
+        with database._replica_lock:
+            database._replica_sessions[replica] -= 1
     def _get_cache(database):
         if database.provider is None: throw(MappingError, 'Database object is not bound with a provider yet')
         cache = local.db2cache.get(database)
@@ -617,7 +696,14 @@ class Database(object):
             except: transact_reraise(RollbackException, [sys.exc_info()])
     @cut_traceback
     def execute(database, sql, globals=None, locals=None):
+        database._get_cache().modified_tables.add(None)
         return database._exec_raw_sql(sql, globals, locals, frame_depth=3, start_transaction=True)
+    def _get_table_versions(database, tables):
+        get_version = database._table_versions.get
+        return tuple(get_version(table, 0) for table in chain((None,), tables))
+    def _update_table_versions(database, tables):
+        table_versions = database._table_versions
+        for table in tables: table_versions[table] = next(table_version_counter)
     def _exec_raw_sql(database, sql, globals, locals, frame_depth, start_transaction=False):
         provider = database.provider
         if provider is None: throw(MappingError, 'Database object is not bound with a provider yet')
@@ -629,6 +715,7 @@ class Database(object):
             locals = sys._getframe(frame_depth).f_locals
         adapted_sql, code = adapt_sql(sql, provider.paramstyle)
         arguments = eval(code, globals, locals)
+        if provider.affects_session_state(adapted_sql): database._get_cache().session_state_changed = True
         return database._exec_sql(adapted_sql, arguments, False, start_transaction)
     @cut_traceback
     def select(database, sql, globals=None, locals=None, frame_depth=0):
@@ -661,9 +748,19 @@ class Database(object):
         result = cursor.fetchone()
         return bool(result)
     @cut_traceback
+    def prepare(database, func):
+        if type(func) is not types.FunctionType: throw(TypeError,
+            'Argument of prepare() method must be a lambda which returns a query. Got: %r' % func)
+        return PreparedQuery(database, func)
+    @cut_traceback
     def insert(database, table_name, returning=None, **kwargs):
         table_name = database._get_table_name(table_name)
         if database.provider is None: throw(MappingError, 'Database object is not bound with a provider yet')
+        schema = database.schema
+        cache = database._get_cache()
+        cache.modified_tables.add(table_name)
+        if schema is None or table_name not in schema.tables:
+            cache.session_state_changed = True  # it may be a temporary table of the session
         query_key = (table_name,) + tuple(kwargs)  # keys are not sorted deliberately!!
         if returning is not None: query_key = query_key + (returning,)
         cached_sql = database._insert_cache.get(query_key)
@@ -682,18 +779,19 @@ class Database(object):
     def _ast2sql(database, sql_ast):
         sql, adapter = database.provider.ast2sql(sql_ast)
         return sql, adapter
-    def _exec_sql(database, sql, arguments=None, returning_id=False, start_transaction=False):
+    def _exec_sql(database, sql, arguments=None, returning_id=False, start_transaction=False, streaming=False):
         cache = database._get_cache()
-        if start_transaction: cache.immediate = True
+        if start_transaction or streaming and cache.provider.streaming_requires_transaction: cache.immediate = True
         connection = cache.prepare_connection_for_query_execution()
-        cursor = connection.cursor()
+        provider = cache.provider  # can be a replica
+        cursor = provider.get_streaming_cursor(connection) if streaming else connection.cursor()
         if debug: log_sql(sql, arguments)
-        provider = database.provider
         t = time()
         try: new_id = provider.execute(cursor, sql, arguments, returning_id)
         except Exception as e:
             connection = cache.reconnect(e)
-            cursor = connection.cursor()
+            provider = cache.provider
+            cursor = provider.get_streaming_cursor(connection) if streaming else connection.cursor()
             if debug: log_sql(sql, arguments)
             t = time()
             new_id = provider.execute(cursor, sql, arguments, returning_id)
@@ -702,8 +800,17 @@ class Database(object):
         if not returning_id: return cursor
         if PY2 and type(new_id) is long: new_id = int(new_id)
         return new_id
+    def _exec_copy(database, table_name, column_names, rows):
+        cache = database._get_cache()
+        cache.immediate = True
+        connection = cache.prepare_connection_for_query_execution()
+        t = time()
+        sql = cache.provider.copy_rows(connection.cursor(), table_name, column_names, rows)
+        if debug: log_sql(sql)
+        cache.in_transaction = True
+        database._update_local_stat(sql, t)
     @cut_traceback
-    def generate_mapping(database, filename=None, check_tables=True, create_tables=False):
+    def generate_mapping(database, filename=None, check_tables=True, create_tables=False, translation_cache=None):
         provider = database.provider
         if provider is None: throw(MappingError, 'Database object is not bound with a provider yet')
         if database.schema: throw(MappingError, 'Mapping was already generated')
@@ -871,8 +978,13 @@ class Database(object):
                     table.add_index(attr.index, columns, is_unique=attr.is_unique)
             entity._initialize_bits_()
 
+        database._cached_entities = tuple(entity for entity in entities
+                                          if entity._root_ is entity and entity._cache_backend_ is not None)
         if create_tables: database.create_tables(check_tables)
         elif check_tables: database.check_tables()
+        if translation_cache is not None:
+            from pony.orm.persistentcache import PersistentSQLCache
+            database._persistent_sql_cache = PersistentSQLCache(database, translation_cache)
     @cut_traceback
     @db_session(ddl=True)
     def drop_table(database, table_name, if_exists=False, with_all_data=False):
@@ -902,7 +1014,7 @@ class Database(object):
     def _drop_tables(database, table_names, if_exists, with_all_data, try_normalized=False):
         cache = database._get_cache()
         connection = cache.prepare_connection_for_query_execution()
-        provider = database.provider
+        provider = cache.provider
         existed_tables = []
         for table_name in table_names:
             table_name = database._get_table_name(table_name)
@@ -929,15 +1041,15 @@ class Database(object):
         cache = database._get_cache()
         if database.schema is None: throw(MappingError, 'No mapping was generated for the database')
         connection = cache.prepare_connection_for_query_execution()
-        database.schema.create_tables(database.provider, connection)
-        if check_tables: database.schema.check_tables(database.provider, connection)
+        database.schema.create_tables(cache.provider, connection)
+        if check_tables: database.schema.check_tables(cache.provider, connection)
     @cut_traceback
     @db_session()
     def check_tables(database):
         cache = database._get_cache()
         if database.schema is None: throw(MappingError, 'No mapping was generated for the database')
         connection = cache.prepare_connection_for_query_execution()
-        database.schema.check_tables(database.provider, connection)
+        database.schema.check_tables(cache.provider, connection)
     @contextmanager
     def set_perms_for(database, *entities):
         if not entities: throw(TypeError, 'You should specify at least one positional argument')
@@ -1475,12 +1587,20 @@ class SessionCache(object):
         cache.objects_to_save = []
         cache.saved_objects = []
         cache.query_results = {}
+        cache.entity_cache_invalidations = defaultdict(set)  # root entity -> pkvals, None means all objects
+        cache.entity_cache_generations = {}
+        if database._cached_entities: cache.save_entity_cache_generations()
+        cache.modified_tables = set()
         cache.modified = False
         cache.db_session = db_session = local.db_session
         cache.immediate = db_session is not None and db_session.immediate
+        cache.provider = database.provider  # can be replaced with a replica until the first write
+        cache.replica_allowed = True
         cache.connection = None
         cache.in_transaction = False
         cache.saved_fk_state = None
+        cache.session_state_changed = False
+        cache.blocking_stream = None  # unbuffered cursor which is being read
         cache.perm_cache = defaultdict(lambda : defaultdict(dict))  # user -> perm -> cls_or_attr_or_obj -> bool
         cache.user_roles_cache = defaultdict(dict)  # user -> obj -> roles
         cache.obj_labels_cache = {}  # obj -> labels
@@ -1488,7 +1608,12 @@ class SessionCache(object):
         assert cache.connection is None
         if cache.in_transaction: throw(ConnectionClosedError,
             'Transaction cannot be continued because database connection failed')
-        provider = cache.database.provider
+        database = cache.database
+        if cache.replica_allowed:
+            cache.replica_allowed = False  # the choice is made once per session
+            if database.replicas and not cache.immediate and cache.can_use_replica():
+                cache.provider = database._acquire_replica()
+        provider = cache.provider
         connection = provider.connect()
         try: provider.set_transaction_mode(connection, cache)  # can set cache.in_transaction
         except:
@@ -1496,8 +1621,21 @@ class SessionCache(object):
             raise
         cache.connection = connection
         return connection
+    def can_use_replica(cache):
+        db_session = cache.db_session
+        if db_session is None: return False
+        return db_session.readonly or cache.database.replica_auto_routing and not cache.modified
+    def switch_to_primary(cache):
+        database = cache.database
+        replica = cache.provider
+        assert replica is not database.provider and not cache.in_transaction
+        connection = cache.connection
+        cache.connection = None
+        cache.provider = database.provider
+        database._release_replica(replica)
+        if connection is not None: replica.release(connection, cache)
     def reconnect(cache, exc):
-        provider = cache.database.provider
+        provider = cache.provider
         if exc is not None:
             exc = getattr(exc, 'original_exc', exc)
             if not provider.should_reconnect(exc): reraise(*sys.exc_info())
@@ -1509,6 +1647,9 @@ class SessionCache(object):
         else: assert cache.connection is None
         return cache.connect()
     def prepare_connection_for_query_execution(cache):
+        if cache.blocking_stream is not None: throw(TransactionError,
+            'Cannot execute another query while the result of stream() or iter_chunks() is being read '
+            'from an unbuffered %s cursor. Load all necessary data before the iteration' % cache.provider.dialect)
         db_session = local.db_session
         if db_session is not None and cache.db_session is None:
             # This situation can arise when a transaction was started
@@ -1520,13 +1661,19 @@ class SessionCache(object):
             cache.db_session = db_session
             cache.immediate = cache.immediate or db_session.immediate
         else: assert cache.db_session is db_session, (cache.db_session, db_session)
+        if cache.immediate:
+            if db_session is not None and db_session.readonly: throw(TransactionError,
+                'Cannot write to the database inside of read-only db_session')
+            if cache.provider is not cache.database.provider: cache.switch_to_primary()
         connection = cache.connection
         if connection is None: connection = cache.connect()
         elif cache.immediate and not cache.in_transaction:
-            provider = cache.database.provider
+            provider = cache.provider
             try: provider.set_transaction_mode(connection, cache)  # can set cache.in_transaction
             except Exception as e: connection = cache.reconnect(e)
-        if not cache.noflush_counter and cache.modified: cache.flush()
+        if not cache.noflush_counter and cache.modified:
+            cache.flush()
+            connection = cache.connection  # flush may switch session from replica to primary
         return connection
     def flush_and_commit(cache):
         try: cache.flush()
@@ -1541,9 +1688,17 @@ class SessionCache(object):
             if cache.modified: cache.flush()
             if cache.in_transaction:
                 assert cache.connection is not None
-                cache.database.provider.commit(cache.connection, cache)
+                cache.provider.commit(cache.connection, cache)
             cache.for_update.clear()
-            cache.immediate = True
+            if cache.entity_cache_invalidations: cache.invalidate_entity_caches()
+            if cache.entity_cache_generations: cache.save_entity_cache_generations()
+            if cache.modified_tables:
+                cache.database._update_table_versions(cache.modified_tables)
+                cache.modified_tables = set()
+            db_session = cache.db_session
+            if db_session is None: cache.immediate = cache.provider.immediate_after_commit
+            else: cache.immediate = db_session.immediate \
+                                    or cache.provider.immediate_after_commit and not db_session.readonly
         except:
             cache.rollback()
             raise
@@ -1557,7 +1712,8 @@ class SessionCache(object):
         database = cache.database
         x = local.db2cache.pop(database); assert x is cache
         cache.is_alive = False
-        provider = database.provider
+        provider = cache.provider
+        if provider is not database.provider: database._release_replica(provider)
         connection = cache.connection
         if connection is None: return
         cache.connection = None
@@ -1576,6 +1732,61 @@ class SessionCache(object):
         cache.objects = cache.indexes = cache.seeds = cache.for_update = cache.modified_collections \
             = cache.objects_to_save = cache.saved_objects = cache.query_results \
             = cache.perm_cache = cache.user_roles_cache = cache.obj_labels_cache = None
+    def save_entity_cache_generations(cache):
+        # rows which were read by the transaction are not stored if some other session
+        # changed the generation of the entity cache after the transaction start
+        cache.entity_cache_generations = dict((entity, entity._get_entity_cache_generation_())
+                                              for entity in cache.database._cached_entities)
+    def invalidate_entity_caches(cache):
+        invalidations = cache.entity_cache_invalidations
+        cache.entity_cache_invalidations = defaultdict(set)
+        namespace = cache.database.cache_namespace
+        for entity, pkvals in iteritems(invalidations):
+            backend = entity._cache_backend_
+            generation_key = namespace, entity.__name__
+            generation = uuid4().hex
+            backend.set(generation_key, generation)  # should be changed before deletion of rows
+            if None in pkvals:
+                backend.clear()
+                backend.set(generation_key, generation)
+            else:
+                for pkval in pkvals: backend.delete((namespace, entity.__name__, pkval))
+    def evict(cache, objects):
+        if not cache.is_alive: return
+        cache.query_results.clear()
+        indexes = cache.indexes
+        modified_collections = cache.modified_collections
+        for obj in objects:
+            # inserted and updated objects are kept, the application may still work with them
+            if obj._session_cache_ is not cache or obj._status_ != 'loaded' or obj._wbits_: continue
+            if obj in cache.for_update: continue
+            entity = obj.__class__
+            if any(obj in modified_collections.get(attr, ()) for attr in entity._attrs_ if attr.is_collection):
+                continue
+            vals = obj._vals_
+            pk_index = indexes[entity._pk_attrs_]
+            if pk_index.get(obj._pkval_) is obj: del pk_index[obj._pkval_]
+            for attr in entity._simple_keys_:
+                val = vals.get(attr)
+                if val is None: continue
+                cache_index = indexes[attr]
+                if cache_index.get(val) is obj: del cache_index[val]
+            for attrs in entity._composite_keys_:
+                keyval = tuple(vals.get(attr) for attr in attrs)
+                if None in keyval: continue
+                cache_index = indexes[attrs]
+                if cache_index.get(keyval) is obj: del cache_index[keyval]
+            for attr in entity._attrs_:
+                reverse = attr.reverse
+                if not reverse or attr.is_collection or not reverse.is_collection: continue
+                val = vals.get(attr)
+                if val is None or val._vals_ is None: continue
+                setdata = val._vals_.get(reverse)
+                if setdata is not None and obj in setdata:
+                    setdata.remove(obj)
+                    setdata.is_fully_loaded = False
+            cache.seeds[entity._pk_attrs_].discard(obj)
+            cache.objects.discard(obj)
     @contextmanager
     def flush_disabled(cache):
         cache.noflush_counter += 1
@@ -1596,10 +1807,10 @@ class SessionCache(object):
                 cache.query_results.clear()
                 modified_m2m = cache._calc_modified_m2m()
                 for attr, (added, removed) in iteritems(modified_m2m):
+                    cache.modified_tables.add(attr.table)
                     if not removed: continue
                     attr.remove_m2m(removed)
-                for obj in cache.objects_to_save:
-                    if obj is not None: obj._save_()
+                cache._save_objects()
                 for attr, (added, removed) in iteritems(modified_m2m):
                     if not added: continue
                     attr.add_m2m(added)
@@ -1613,6 +1824,46 @@ class SessionCache(object):
         else:
             if cache.modified: throw(TransactionError,
                 'Recursion depth limit reached in obj._after_save_() call')
+    def _save_objects(cache):
+        # consecutive created objects of the same entity with the same set of non-null attributes are inserted
+        # by a single executemany() or multi-row INSERT ... RETURNING statement, so the rows are still inserted
+        # in the order of creation; consecutive updates and deletes with the same SQL are executed together as well
+        provider = cache.provider
+        pending = []
+        pending_key = None
+        def save_pending():
+            key = pending_key
+            objects = [ obj for obj, values in pending ]
+            values_list = [ values for obj, values in pending ]
+            del pending[:]
+            if len(objects) == 1: objects[0]._save_()
+            elif key[1] == 'created': key[0]._save_created_many_(objects, key[2], values_list, key[3])
+            elif key[1] == 'modified': key[0]._save_updated_many_(objects, key[2], key[3], values_list)
+            else: key[0]._save_deleted_many_(objects, key[2] != ((), ()), key[3], key[4], values_list)
+        for obj in cache.objects_to_save:  # can grow during iteration
+            if obj is None: continue
+            status = obj._status_
+            key = None
+            if status == 'marked_to_delete':
+                query_key, sql, adapter, values = obj._prepare_delete_()
+                key = obj.__class__, status, query_key, sql, adapter
+            elif obj._has_unsaved_principals_(): pass
+            elif status == 'created':
+                auto_pk, attrs, values = obj._get_insert_values_()
+                if attrs and (not auto_pk or provider.insert_returning_syntax):
+                    key = obj.__class__, status, attrs, auto_pk
+            else:
+                prepared = obj._prepare_update_()
+                if prepared is not None:
+                    query_key, sql, adapter, values = prepared
+                    key = obj.__class__, status, sql, adapter
+            if pending and key != pending_key: save_pending()
+            if key is not None:
+                pending_key = key
+                pending.append((obj, values))
+                continue
+            obj._save_()
+        if pending: save_pending()
     def call_after_save_hooks(cache):
         saved_objects = cache.saved_objects
         cache.saved_objects = []
@@ -1718,7 +1969,7 @@ class Attribute(object):
                 'lazy', 'lazy_sql_cache', 'args', 'auto', 'default', 'reverse', 'composite_keys', \
                 'column', 'columns', 'col_paths', '_columns_checked', 'converters', 'kwargs', \
                 'cascade_delete', 'index', 'original_default', 'sql_default', 'py_check', 'hidden', \
-                'optimistic'
+                'optimistic', 'nplus1_threshold'
     def __deepcopy__(attr, memo):
         return attr  # Attribute cannot be cloned by deepcopy()
     @cut_traceback
@@ -1781,7 +2032,15 @@ class Attribute(object):
         attr._columns_checked = False
         attr.composite_keys = []
         attr.lazy = kwargs.pop('lazy', getattr(py_type, 'lazy', False))
-        attr.lazy_sql_cache = None
+        attr.lazy_sql_cache = {}
+        if 'nplus1_threshold' in kwargs:
+            if attr.is_basic and not attr.lazy: throw(TypeError,
+                "'nplus1_threshold' option can be set only for lazy attributes, relationships and collections")
+            threshold = kwargs['nplus1_threshold']
+            if threshold is not None and not (isinstance(threshold, int_types) and threshold >= 0): throw(TypeError,
+                "'nplus1_threshold' option value must be non-negative integer or None. Got: %r" % threshold)
+        # batch loading of lazy attributes is turned on explicitly
+        attr.nplus1_threshold = kwargs.pop('nplus1_threshold', None if attr.is_basic else 1)
         attr.is_volatile = kwargs.pop('volatile', False)
         attr.optimistic = kwargs.pop('optimistic', True)
         attr.sql_default = kwargs.pop('sql_default', None)
@@ -1925,38 +2184,94 @@ class Attribute(object):
         if not attr.columns:
             reverse = attr.reverse
             assert reverse is not None and reverse.columns
-            dbval = reverse.entity._find_in_db_({reverse : obj})
-            if dbval is None: obj._vals_[attr] = None
-            else: assert obj._vals_[attr] == dbval
-            return dbval
+            rentity = reverse.entity
+            prefetching = options.PREFETCHING and attr.nplus1_threshold is not None
+            objects = attr.get_objects_to_load(obj) if prefetching else [ obj ]
+            if len(objects) == 1:
+                dbval = rentity._find_in_db_({reverse : obj})
+                if dbval is None:
+                    obj._unshare_vals_()
+                    obj._vals_[attr] = None
+                else: assert obj._vals_[attr] == dbval
+                return dbval
+            sql, adapter, attr_offsets = rentity._construct_batchload_sql_(len(objects), reverse)
+            arguments = adapter(objects)
+            cursor = rentity._database_._exec_sql(sql, arguments)
+            rentity._fetch_objects(cursor, attr_offsets)
+            for obj2 in objects:
+                if attr not in obj2._vals_:
+                    obj2._unshare_vals_()
+                    obj2._vals_[attr] = None
+            return obj._vals_[attr]
 
         if attr.lazy:
             entity = attr.entity
             database = entity._database_
-            if not attr.lazy_sql_cache:
-                select_list = [ 'ALL' ] + [ [ 'COLUMN', None, column ] for column in attr.columns ]
-                from_list = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
-                pk_columns = entity._pk_columns_
-                pk_converters = entity._pk_converters_
-                criteria_list = [ [ converter.EQ, [ 'COLUMN', None, column ], [ 'PARAM', (i, None, None), converter ] ]
-                                  for i, (column, converter) in enumerate(izip(pk_columns, pk_converters)) ]
-                sql_ast = [ 'SELECT', select_list, from_list, [ 'WHERE' ] + criteria_list ]
-                sql, adapter = database._ast2sql(sql_ast)
-                offsets = tuple(xrange(len(attr.columns)))
-                attr.lazy_sql_cache = sql, adapter, offsets
-            else: sql, adapter, offsets = attr.lazy_sql_cache
-            arguments = adapter(obj._get_raw_pkval_())
-            cursor = database._exec_sql(sql, arguments)
-            row = cursor.fetchone()
-            dbval = attr.parse_value(row, offsets)
-            attr.db_set(obj, dbval)
+            cache = obj._session_cache_
+            counter = cache.collection_statistics.setdefault(attr, 0)
+            nplus1_threshold = attr.nplus1_threshold
+            prefetching = options.PREFETCHING and nplus1_threshold is not None and counter >= nplus1_threshold
+            objects = attr.get_objects_to_load(obj) if prefetching else [ obj ]
+            sql, adapter, offsets = attr.get_lazy_sql(len(objects))
+            if len(objects) == 1:
+                arguments = adapter(obj._get_raw_pkval_())
+                cursor = database._exec_sql(sql, arguments)
+                row = cursor.fetchone()
+                dbval = attr.parse_value(row, offsets)
+                attr.db_set(obj, dbval)
+            else:
+                arguments = adapter(objects)
+                cursor = database._exec_sql(sql, arguments)
+                pk_len = len(entity._pk_columns_)
+                for row in cursor.fetchall():
+                    obj2 = entity._get_by_raw_pkval_(row[:pk_len])
+                    attr.db_set(obj2, attr.parse_value(row, offsets))
+            cache.collection_statistics[attr] = counter + 1
         else: obj._load_()
         return obj._vals_[attr]
+    def get_objects_to_load(attr, obj):
+        # obj and other loaded objects of the session which lack the value of attr
+        entity = attr.entity
+        cache = obj._session_cache_
+        seeds = cache.seeds[entity._pk_attrs_]
+        max_batch_size = entity._database_.provider.max_params_count // len(entity._pk_columns_)
+        objects = [ obj ]
+        for obj2 in itervalues(cache.indexes[entity._pk_attrs_]):
+            if len(objects) >= max_batch_size: break
+            if obj2 is obj or attr in obj2._vals_ or obj2 in seeds: continue
+            if obj2._status_ in created_or_deleted_statuses or not isinstance(obj2, entity): continue
+            objects.append(obj2)
+        return objects
+    def get_lazy_sql(attr, batch_size=1):
+        cached_sql = attr.lazy_sql_cache.get(batch_size)
+        if cached_sql is not None: return cached_sql
+        entity = attr.entity
+        database = entity._database_
+        pk_columns = entity._pk_columns_
+        pk_converters = entity._pk_converters_
+        columns = list(attr.columns) if batch_size == 1 else list(pk_columns) + list(attr.columns)
+        select_list = [ 'ALL' ] + [ [ 'COLUMN', None, column ] for column in columns ]
+        from_list = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
+        if batch_size == 1:
+            criteria_list = [ [ converter.EQ, [ 'COLUMN', None, column ], [ 'PARAM', (i, None, None), converter ] ]
+                              for i, (column, converter) in enumerate(izip(pk_columns, pk_converters)) ]
+        else:
+            row_value_syntax = database.provider.translator_cls.row_value_syntax
+            criteria_list = construct_batchload_criteria_list(
+                None, pk_columns, pk_converters, batch_size, row_value_syntax)
+        sql_ast = [ 'SELECT', select_list, from_list, [ 'WHERE' ] + criteria_list ]
+        sql, adapter = database._ast2sql(sql_ast)
+        offsets = tuple(xrange(len(columns) - len(attr.columns), len(columns)))
+        cached_sql = attr.lazy_sql_cache[batch_size] = sql, adapter, offsets
+        return cached_sql
     @cut_traceback
     def __get__(attr, obj, cls=None):
         if obj is None: return attr
         if attr.pk_offset is not None: return attr.get(obj)
-        value = attr.get(obj)
+        vals = obj._vals_
+        if vals is not None and attr in vals and not attr.reverse and obj._status_ not in ('deleted', 'cancelled'):
+            value = vals[attr]
+        else: value = attr.get(obj)
         bit = obj._bits_except_volatile_[attr]
         wbits = obj._wbits_
         if wbits is not None and not wbits & bit: obj._rbits_ |= bit
@@ -1995,6 +2310,7 @@ class Attribute(object):
             bit = obj._bits_[attr]
             objects_to_save = cache.objects_to_save
             objects_to_save_needs_undo = False
+            obj._unshare_vals_()
             if wbits is not None and bit:
                 obj._wbits_ = wbits | bit
                 if status != 'modified':
@@ -2077,6 +2393,7 @@ class Attribute(object):
                 'Value of %s.%s for %s was updated outside of current transaction%s'
                 % (obj.__class__.__name__, attr.name, obj, diff))
 
+        obj._unshare_vals_()
         if new_dbval is NOT_LOADED: obj._dbvals_.pop(attr, None)
         else: obj._dbvals_[attr] = new_dbval
 
@@ -2354,7 +2671,7 @@ class PrimaryKey(Required):
 
 class Collection(Attribute):
     __slots__ = 'table', 'wrapper_class', 'symmetric', 'reverse_column', 'reverse_columns', \
-                'nplus1_threshold', 'cached_load_sql', 'cached_add_m2m_sql', 'cached_remove_m2m_sql', \
+                'cached_load_sql', 'cached_add_m2m_sql', 'cached_remove_m2m_sql', \
                 'cached_count_sql', 'cached_empty_sql'
     def __init__(attr, py_type, *args, **kwargs):
         if attr.__class__ is Collection: throw(TypeError, "'Collection' is abstract type")
@@ -2388,7 +2705,6 @@ class Collection(Attribute):
             if len(attr.reverse_columns) == 1: attr.reverse_column = attr.reverse_columns[0]
         else: attr.reverse_columns = []
 
-        attr.nplus1_threshold = kwargs.pop('nplus1_threshold', 1)
         for option in attr.kwargs: throw(TypeError, 'Unknown option %r' % option)
         attr.cached_load_sql = {}
         attr.cached_add_m2m_sql = None
@@ -2482,13 +2798,17 @@ class Set(Collection):
             if item._session_cache_ is not cache:
                 throw(TransactionError, 'An attempt to mix objects belonging to different transactions')
         return items
+    def new_setdata(attr, obj):
+        obj._unshare_vals_()
+        setdata = obj._vals_[attr] = SetData()
+        return setdata
     def load(attr, obj, items=None):
         cache = obj._session_cache_
         if not cache.is_alive: throw(DatabaseSessionIsOver,
             'Cannot load collection %s.%s: the database session is over' % (safe_repr(obj), attr.name))
         assert obj._status_ not in del_statuses
         setdata = obj._vals_.get(attr)
-        if setdata is None: setdata = obj._vals_[attr] = SetData()
+        if setdata is None: setdata = attr.new_setdata(obj)
         elif setdata.is_fully_loaded: return setdata
         entity = attr.entity
         reverse = attr.reverse
@@ -2539,7 +2859,7 @@ class Set(Collection):
                 if obj2 is obj: continue
                 if obj2._status_ in created_or_deleted_statuses: continue
                 setdata2 = obj2._vals_.get(attr)
-                if setdata2 is None: setdata2 = obj2._vals_[attr] = SetData()
+                if setdata2 is None: setdata2 = attr.new_setdata(obj2)
                 elif setdata2.is_fully_loaded: continue
                 objects.append(obj2)
                 setdata_list.append(setdata2)
@@ -2566,7 +2886,7 @@ class Set(Collection):
             else: d[obj] = set(imap(rentity._get_by_raw_pkval_, cursor.fetchall()))
             for obj2, items in iteritems(d):
                 setdata2 = obj2._vals_.get(attr)
-                if setdata2 is None: setdata2 = obj._vals_[attr] = SetData()
+                if setdata2 is None: setdata2 = attr.new_setdata(obj2)
                 else:
                     phantoms = setdata2 - items
                     if setdata2.added: phantoms -= setdata2.added
@@ -2656,7 +2976,7 @@ class Set(Collection):
             setdata = obj._vals_.get(attr)
             if setdata is None:
                 if obj._status_ == 'created':
-                    setdata = obj._vals_[attr] = SetData()
+                    setdata = attr.new_setdata(obj)
                     setdata.is_fully_loaded = True
                     setdata.count = 0
                 else: setdata = attr.load(obj)
@@ -2703,7 +3023,7 @@ class Set(Collection):
         objects_with_modified_collections = cache.modified_collections[attr]
         for obj in objects:
             setdata = obj._vals_.get(attr)
-            if setdata is None: setdata = obj._vals_[attr] = SetData()
+            if setdata is None: setdata = attr.new_setdata(obj)
             else: assert item not in setdata
             if setdata.added is None: setdata.added = set()
             else: assert item not in setdata.added
@@ -2727,7 +3047,7 @@ class Set(Collection):
     def db_reverse_add(attr, objects, item):
         for obj in objects:
             setdata = obj._vals_.get(attr)
-            if setdata is None: setdata = obj._vals_[attr] = SetData()
+            if setdata is None: setdata = attr.new_setdata(obj)
             elif setdata.is_fully_loaded: throw(UnrepeatableReadError,
                 'Phantom object %s appeared in collection %s.%s' % (safe_repr(item), safe_repr(obj), attr.name))
             setdata.add(item)
@@ -2859,7 +3179,7 @@ def unpickle_setwrapper(obj, attrname, items):
     wrapper_cls = attr.py_type._get_set_wrapper_subclass_()
     wrapper = wrapper_cls(obj, attr)
     setdata = obj._vals_.get(attr)
-    if setdata is None: setdata = obj._vals_[attr] = SetData()
+    if setdata is None: setdata = attr.new_setdata(obj)
     setdata.is_fully_loaded = True
     setdata.absent = None
     setdata.count = len(setdata)
@@ -2903,7 +3223,7 @@ class SetInstance(object):
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         if obj._vals_ is None: throw_db_session_is_over(obj, attr)
         setdata = obj._vals_.get(attr)
-        if setdata is None: setdata = obj._vals_[attr] = SetData()
+        if setdata is None: setdata = attr.new_setdata(obj)
         elif setdata.is_fully_loaded: return not setdata
         elif setdata: return False
         elif setdata.count is not None: return not setdata.count
@@ -2959,7 +3279,7 @@ class SetInstance(object):
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         if obj._vals_ is None: throw_db_session_is_over(obj, attr)
         setdata = obj._vals_.get(attr)
-        if setdata is None: setdata = obj._vals_[attr] = SetData()
+        if setdata is None: setdata = attr.new_setdata(obj)
         elif setdata.count is not None: return setdata.count
         entity = attr.entity
         reverse = attr.reverse
@@ -3402,8 +3722,27 @@ class EntityMeta(type):
         entity._load_sql_cache_ = {}
         entity._batchload_sql_cache_ = {}
         entity._insert_sql_cache_ = {}
+        entity._upsert_sql_cache_ = {}
         entity._update_sql_cache_ = {}
         entity._delete_sql_cache_ = {}
+        entity._row_parsers_ = {}
+
+        cache_option = entity.__dict__.get('_cache_')
+        if direct_bases:
+            if cache_option is not None: throw(ERDiagramError,
+                '_cache_ option can be specified for root entity only. Got: %s' % entity.__name__)
+            entity._cache_backend_ = entity._root_._cache_backend_
+        elif cache_option is None or cache_option is False: entity._cache_backend_ = None
+        else:
+            if cache_option is True: cache_option = LocalCache()
+            elif not isinstance(cache_option, CacheBackend): throw(TypeError,
+                '%s._cache_ option must be True or instance of CacheBackend. Got: %r' % (entity.__name__, cache_option))
+            for attr in pk_attrs:
+                if isinstance(attr.py_type, (basestring, EntityMeta, types.FunctionType)): throw(ERDiagramError,
+                    'Entity %s cannot be cached because its primary key contains relationship attribute %s'
+                    % (entity.__name__, attr.name))
+            entity._cache_backend_ = cache_option
+        entity._entity_cache_offsets_ = {}
 
         entity._propagation_mixin_ = None
         entity._set_wrapper_subclass_ = None
@@ -3646,6 +3985,298 @@ class EntityMeta(type):
                     if obj in seeds: obj._load_()
         if found_in_cache: shuffle(result)
         return result
+    @cut_traceback
+    def bulk_insert(entity, rows, batch_size=1000, return_ids=False):
+        if entity._database_.schema is None:
+            throw(ERDiagramError, 'Mapping is not generated for entity %r' % entity.__name__)
+        if not isinstance(batch_size, int_types) or batch_size < 1: throw(ValueError,
+            'batch_size must be positive integer. Got: %r' % batch_size)
+        database = entity._database_
+        cache = database._get_cache()
+        if cache.modified: cache.flush()
+        ids = [] if return_ids else None
+        count = 0
+        batch = []
+        try:
+            for row in rows:
+                batch.append(entity._get_bulk_insert_values_(row, cache))
+                if len(batch) == batch_size:
+                    entity._bulk_insert_batch_(batch, ids)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                entity._bulk_insert_batch_(batch, ids)
+                count += len(batch)
+        except IntegrityError as e:
+            msg = " ".join(tostring(arg) for arg in e.args)
+            throw(TransactionIntegrityError, 'Bulk insert of %s rows failed. %s: %s'
+                                             % (entity.__name__, e.__class__.__name__, msg), e)
+        finally:
+            if count or batch:
+                entity._invalidate_after_bulk_write_(cache, entity._attrs_with_columns_)
+        return ids if return_ids else count
+    def _invalidate_after_bulk_write_(entity, cache, attrs):
+        # the rows were changed without the identity map, so cached reverse collections may be incomplete
+        cache.modified_tables.add(entity._table_)
+        cache.max_id_cache.pop(entity._pk_attrs_[0], None)
+        if entity._cache_backend_ is not None: cache.entity_cache_invalidations[entity._root_].add(None)
+        for attr in attrs:
+            reverse = attr.reverse
+            if not reverse or not reverse.is_collection: continue
+            for obj in itervalues(cache.indexes[reverse.entity._pk_attrs_]):
+                setdata = obj._vals_.get(reverse) if obj._vals_ is not None else None
+                if setdata is not None:
+                    setdata.is_fully_loaded = False
+                    setdata.count = None
+    def _get_bulk_insert_values_(entity, row, cache, include_nulls=False):
+        if not isinstance(row, dict): throw(TypeError,
+            'Rows passed to %s.bulk_insert() must be dicts. Got: %r' % (entity.__name__, row))
+        for name in row:
+            attr = entity._adict_.get(name)
+            if attr is None: throw(TypeError, 'Unknown attribute %r' % name)
+            if attr.is_collection: throw(TypeError,
+                'Collection attribute %s cannot be specified in bulk_insert()' % attr)
+        pk_attrs = entity._pk_attrs_
+        auto_pk = not entity._pk_is_composite_ and pk_attrs[0].auto and row.get(pk_attrs[0].name) is None
+        attrs = []
+        values = []
+        raw_pkval = []
+        for attr in entity._attrs_with_columns_:
+            if auto_pk and attr.is_pk: continue
+            val = row.get(attr.name, DEFAULT)
+            if not attr.reverse:
+                val = attr.validate(val, None, entity)
+                if val is None and not (include_nulls and attr.name in row): continue
+                raw_vals = (val,)
+            else:
+                # related objects are referenced by primary key, so the identity map is not involved
+                rentity = attr.py_type
+                if val is DEFAULT: val = None
+                if val is None:
+                    if attr.is_required: throw(ValueError, 'Attribute %s is required' % attr)
+                    if not (include_nulls and attr.name in row): continue
+                    raw_vals = rentity._pk_nones_
+                elif isinstance(val, Entity):
+                    if not isinstance(val, rentity): throw(TypeError,
+                        'Attribute %s must be of %s type. Got: %r' % (attr, rentity.__name__, val))
+                    if val._session_cache_ is not cache:
+                        throw(TransactionError, 'An attempt to mix objects belonging to different transactions')
+                    raw_vals = val._get_raw_pkval_()
+                elif isinstance(val, ReadOnlyRecord):
+                    if not issubclass(val._entity_, rentity): throw(TypeError,
+                        'Attribute %s must be of %s type. Got: %r' % (attr, rentity.__name__, val))
+                    raw_vals = val._get_raw_pkval_()
+                else:
+                    vals = val if type(val) is tuple else (val,)
+                    if len(vals) != len(rentity._pk_columns_): throw(TypeError,
+                        'Invalid number of columns were specified for attribute %s. Expected: %d, got: %d'
+                        % (attr, len(rentity._pk_columns_), len(vals)))
+                    raw_vals = tuple(converter.validate(item) for converter, item
+                                     in izip(rentity._pk_converters_, vals))
+            attrs.append(attr)
+            values.extend(raw_vals)
+            if attr.pk_offset is not None: raw_pkval.append((attr.pk_offset, raw_vals))
+        if auto_pk: pkval = None
+        else:
+            raw_pkval = tuple(chain.from_iterable(raw_vals for pk_offset, raw_vals in sorted(raw_pkval)))
+            pkval = raw_pkval[0] if len(raw_pkval) == 1 else raw_pkval
+        return auto_pk, tuple(attrs), values, pkval
+    def _bulk_insert_batch_(entity, batch, ids):
+        groups = {}
+        for i, (auto_pk, attrs, values, pkval) in enumerate(batch):
+            groups.setdefault((auto_pk, attrs), []).append(i)
+        batch_ids = [ pkval for auto_pk, attrs, values, pkval in batch ]
+        for (auto_pk, attrs), indexes in iteritems(groups):
+            values_list = [ batch[i][2] for i in indexes ]
+            if auto_pk and ids is not None:
+                new_ids = entity._insert_returning_ids_(attrs, values_list)
+                for i, new_id in izip(indexes, new_ids): batch_ids[i] = new_id
+            else: entity._insert_rows_(attrs, values_list)
+        if ids is not None: ids.extend(batch_ids)
+    def _insert_rows_(entity, attrs, values_list):
+        database = entity._database_
+        provider = database.provider
+        mode = provider.bulk_insert_mode if attrs else 'executemany'
+        if mode == 'copy':
+            columns = []
+            converters = []
+            for attr in attrs:
+                columns.extend(attr.columns)
+                converters.extend(attr.converters)
+            rows = [ [ None if val is None else converter.py2sql(converter.val2dbval(val))
+                       for converter, val in izip(converters, values) ] for values in values_list ]
+            database._exec_copy(entity._table_, columns, rows)
+        elif mode == 'multirow':
+            rows_per_batch = max(1, provider.max_params_count // len(values_list[0]))
+            for i in xrange(0, len(values_list), rows_per_batch):
+                batch_values = values_list[i:i+rows_per_batch]
+                sql, adapter = entity._construct_insert_sql_(attrs, False, len(batch_values))
+                database._exec_sql(sql, adapter(list(chain.from_iterable(batch_values))), start_transaction=True)
+        else:
+            assert mode == 'executemany'
+            sql, adapter = entity._construct_insert_sql_(attrs, False)
+            database._exec_sql(sql, [ adapter(values) for values in values_list ], start_transaction=True)
+    def _insert_returning_ids_(entity, attrs, values_list):
+        database = entity._database_
+        provider = database.provider
+        # the order of rows returned by multi-row INSERT ... RETURNING is not guaranteed,
+        # so ids are matched to rows by the values of an inserted unique key
+        key_offsets = None
+        if provider.insert_returning_syntax and attrs: key_offsets = entity._get_returning_key_offsets_(attrs)
+        if key_offsets is None or any(values[offset] is None for values in values_list for offset in key_offsets):
+            sql, adapter = entity._construct_insert_sql_(attrs, True)
+            return [ database._exec_sql(sql, adapter(values), returning_id=True, start_transaction=True)
+                     for values in values_list ]
+        rows_per_batch = max(1, provider.max_params_count // len(values_list[0]))
+        ids_by_key = {}
+        for i in xrange(0, len(values_list), rows_per_batch):
+            batch_values = values_list[i:i+rows_per_batch]
+            sql, adapter = entity._construct_insert_sql_(attrs, True, len(batch_values))
+            cursor = database._exec_sql(sql, adapter(list(chain.from_iterable(batch_values))),
+                                        start_transaction=True)
+            for row in cursor.fetchall(): ids_by_key[tuple(row[1:])] = row[0]
+        new_ids = [ ids_by_key.get(tuple(values[offset] for offset in key_offsets)) for values in values_list ]
+        if len(ids_by_key) != len(values_list) or None in new_ids: throw(UnexpectedError,
+            'Expected %d ids of inserted %s rows, got %d' % (len(values_list), entity.__name__, len(ids_by_key)))
+        if PY2: new_ids = [ int(new_id) if type(new_id) is long else new_id for new_id in new_ids ]
+        return new_ids
+    def _get_returning_key_offsets_(entity, attrs):
+        # offsets of the columns of a unique key whose values are returned by the database unchanged
+        offsets = {}
+        offset = 0
+        for attr in attrs:
+            offsets[attr] = offset
+            offset += len(attr.columns)
+        for key in entity._keys_:
+            if not all(attr in offsets for attr in key): continue
+            converters = [ converter for attr in key for converter in attr.converters ]
+            if all(isinstance(converter.py_type, type) and issubclass(converter.py_type, (basestring,) + int_types)
+                   for converter in converters):
+                return [ offsets[attr] + i for attr in key for i in xrange(len(attr.columns)) ]
+        return None
+    @cut_traceback
+    def upsert(entity, key_attrs, **kwargs):
+        return entity._upsert_(key_attrs, [ kwargs ])[0]
+    @cut_traceback
+    def upsert_many(entity, key_attrs, rows):
+        return entity._upsert_(key_attrs, rows)
+    def _get_upsert_key_(entity, key_attrs):
+        if isinstance(key_attrs, (basestring, Attribute)): key_attrs = (key_attrs,)
+        attrs = []
+        for key_attr in key_attrs:
+            attr = entity._adict_.get(key_attr) if isinstance(key_attr, basestring) else key_attr
+            if not isinstance(attr, Attribute) or attr.entity is not entity and attr not in entity._attrs_:
+                throw(TypeError, 'Unknown attribute %r' % (key_attr,))
+            attrs.append(attr)
+        if set(attrs) == set(entity._pk_attrs_): return entity._pk_attrs_
+        for key in entity._keys_:
+            if set(attrs) == set(key): return key
+        throw(TypeError, 'Attribute%s %s %s not a unique key of %s' % ('s' if len(attrs) > 1 else '',
+              ', '.join(attr.name for attr in attrs), 'are' if len(attrs) > 1 else 'is', entity.__name__))
+    def _upsert_(entity, key_attrs, rows):
+        database = entity._database_
+        if database.schema is None:
+            throw(ERDiagramError, 'Mapping is not generated for entity %r' % entity.__name__)
+        provider = database.provider
+        if not provider.upsert_syntax:
+            throw(NotImplementedError, 'Upsert is not supported by this version of %s' % provider.dialect)
+        key = entity._get_upsert_key_(key_attrs)
+        cache = database._get_cache()
+        if cache.modified: cache.flush()
+        keyvals = []
+        merged_rows = {}
+        for row in rows:
+            for attr in key:
+                if row.get(attr.name) is None: throw(ValueError, 'Value of key attribute %s is not specified' % attr)
+            auto_pk, attrs, values, pkval = entity._get_bulk_insert_values_(row, cache, include_nulls=True)
+            keyval = []
+            offset = 0
+            for attr in attrs:
+                if attr in key: keyval.append((key.index(attr), values[offset:offset+len(attr.columns)]))
+                offset += len(attr.columns)
+            keyval = tuple(chain.from_iterable(vals for i, vals in sorted(keyval)))
+            keyvals.append(keyval)
+            # rows with the same key are merged, as if they were applied one after another
+            if keyval not in merged_rows: merged_rows[keyval] = row, attrs, values
+            else: merged_rows[keyval] = dict(merged_rows[keyval][0], **row), None, None
+        groups = {}
+        for keyval, (row, attrs, values) in iteritems(merged_rows):
+            if attrs is None:
+                auto_pk, attrs, values, pkval = entity._get_bulk_insert_values_(row, cache, include_nulls=True)
+            update_attrs = tuple(attr for attr in attrs
+                                 if attr.name in row and attr.pk_offset is None and attr not in key)
+            groups.setdefault((attrs, update_attrs), {})[keyval] = values
+        objects = {}
+        try:
+            for (attrs, update_attrs), values_dict in iteritems(groups):
+                rows_per_batch = max(1, provider.max_params_count // sum(len(attr.columns) for attr in attrs))
+                items = list(iteritems(values_dict))
+                for i in xrange(0, len(items), rows_per_batch):
+                    batch = items[i:i+rows_per_batch]
+                    for obj in entity._exec_upsert_(key, attrs, update_attrs, batch):
+                        objects[tuple(chain.from_iterable(attr.get_raw_values(obj._vals_[attr]) for attr in key))] = obj
+        except IntegrityError as e:
+            msg = " ".join(tostring(arg) for arg in e.args)
+            throw(TransactionIntegrityError, 'Upsert of %s rows failed. %s: %s'
+                                             % (entity.__name__, e.__class__.__name__, msg), e)
+        finally:
+            if groups:
+                entity._invalidate_after_bulk_write_(cache, entity._attrs_with_columns_)
+        result = []
+        for keyval in keyvals:
+            obj = objects.get(keyval)
+            if obj is None: throw(UnexpectedError,
+                'Row of %s with key %s was not found after upsert' % (entity.__name__, keyval))
+            result.append(obj)
+        return result
+    def _exec_upsert_(entity, key, attrs, update_attrs, batch):
+        database = entity._database_
+        returning = database.provider.insert_returning_syntax
+        sql, adapter, attr_offsets = entity._construct_upsert_sql_(key, attrs, update_attrs, len(batch), returning)
+        cursor = database._exec_sql(sql, adapter(list(chain.from_iterable(values for keyval, values in batch))),
+                                    start_transaction=True)
+        if not returning:
+            key_attrs = None if key is entity._pk_attrs_ else key
+            sql, adapter, attr_offsets = entity._construct_batchload_sql_(len(batch), key_attrs, from_seeds=False)
+            cursor = database._exec_sql(sql, adapter([ keyval for keyval, values in batch ]))
+        objects = []
+        parse_row = entity._get_row_parser_(attr_offsets)
+        for row in cursor.fetchall():
+            real_entity_subclass, pkval, avdict = parse_row(row)
+            obj = real_entity_subclass._get_from_identity_map_(pkval, 'loaded')
+            if obj._status_ in del_statuses: continue
+            # new values were written by the current transaction, so they are not unrepeatable reads
+            for attr in update_attrs: obj._rbits_ &= ~obj._bits_[attr]
+            obj._db_set_(avdict)
+            objects.append(obj)
+        return objects
+    def _construct_upsert_sql_(entity, key, attrs, update_attrs, rows_count, returning):
+        query_key = key, attrs, update_attrs, rows_count, returning
+        cached_sql = entity._upsert_sql_cache_.get(query_key)
+        if cached_sql is not None: return cached_sql
+        columns = []
+        converters = []
+        for attr in attrs:
+            columns.extend(attr.columns)
+            converters.extend(attr.converters)
+        rows = [ [ [ 'PARAM', (i * len(converters) + j, None, None), converter ]
+                   for j, converter in enumerate(converters) ] for i in xrange(rows_count) ]
+        key_columns = list(chain.from_iterable(attr.columns for attr in key))
+        update_columns = list(chain.from_iterable(attr.columns for attr in update_attrs))
+        sql_ast = [ 'UPSERT', entity._table_, columns, rows, key_columns, update_columns ]
+        attr_offsets = None
+        if returning:
+            returning_columns = []
+            attr_offsets = {}
+            for attr in entity._attrs_with_columns_:
+                if attr.lazy: continue
+                attr_offsets[attr] = list(xrange(len(returning_columns), len(returning_columns) + len(attr.columns)))
+                returning_columns.extend(attr.columns)
+            sql_ast.append(returning_columns)
+        sql, adapter = entity._database_._ast2sql(sql_ast)
+        cached_sql = sql, adapter, attr_offsets
+        entity._upsert_sql_cache_[query_key] = cached_sql
+        return cached_sql
     def _find_one_(entity, kwargs, for_update=False, nowait=False):
         if entity._database_.schema is None:
             throw(ERDiagramError, 'Mapping is not generated for entity %r' % entity.__name__)
@@ -3654,6 +4285,8 @@ class EntityMeta(type):
             if attr.is_collection:
                 throw(TypeError, 'Collection attribute %s cannot be specified as search criteria' % attr)
         obj, unique = entity._find_in_cache_(pkval, avdict, for_update)
+        if obj is None and unique and not for_update and entity._cache_backend_ is not None:
+            obj = entity._find_in_entity_cache_(pkval, avdict)
         if obj is None: obj = entity._find_in_db_(avdict, unique, for_update, nowait)
         if obj is None: throw(ObjectNotFound, entity, pkval)
         return obj
@@ -3706,6 +4339,91 @@ class EntityMeta(type):
             entity._set_rbits((obj,), avdict)
             return obj, unique
         return None, unique
+    def _find_in_entity_cache_(entity, pkval, avdict):
+        root = entity._root_
+        if pkval is None:
+            backend = root._cache_backend_
+            for attr in root._simple_keys_:
+                val = avdict.get(attr)
+                if val is None or attr.reverse: continue
+                pkval = backend.get((entity._database_.cache_namespace, root.__name__, attr.name, val))
+                if pkval is not None: break
+            else: return None
+            if entity._database_._get_cache().indexes[entity._pk_attrs_].get(pkval) is not None: return None
+        parsed_row = entity._get_from_entity_cache_(pkval)
+        if parsed_row is None: return None
+        real_entity_subclass, pkval, row_avdict = parsed_row
+        if not issubclass(real_entity_subclass, entity): return None
+        for attr, val in iteritems(avdict):
+            if attr.pk_offset is not None: continue
+            if attr not in row_avdict or row_avdict[attr] != val: return None
+        obj = real_entity_subclass._get_from_identity_map_(pkval, 'loaded')
+        if obj._status_ in del_statuses: return None
+        obj._db_set_(row_avdict)
+        entity._set_rbits((obj,), avdict)
+        return obj
+    def _get_from_entity_cache_(entity, pkval):
+        root = entity._root_
+        if root in entity._database_._get_cache().entity_cache_invalidations:
+            return None  # objects were modified in the current transaction
+        cached_row = root._cache_backend_.get((entity._database_.cache_namespace, root.__name__, pkval))
+        if cached_row is None: return None
+        names, row = cached_row
+        attr_offsets = root._entity_cache_offsets_.get(names)
+        if attr_offsets is None:
+            attr_offsets = {}
+            offset = 0
+            for name in names:
+                attr = root._adict_.get(name) or root._subclass_adict_.get(name)
+                if attr is None: return None
+                attr_offsets[attr] = list(xrange(offset, offset + len(attr.columns)))
+                offset += len(attr.columns)
+            root._entity_cache_offsets_[names] = attr_offsets
+        return root._parse_row_(row, attr_offsets)
+    def _get_entity_cache_generation_(entity):
+        backend = entity._cache_backend_
+        generation_key = entity._database_.cache_namespace, entity.__name__
+        generation = backend.get(generation_key)
+        if generation is None:
+            generation = uuid4().hex
+            backend.set(generation_key, generation)
+        return generation
+    def _store_in_entity_cache_(entity, objects_and_rows, attr_offsets):
+        root = entity._root_
+        cache = entity._database_._get_cache()
+        if root in cache.entity_cache_invalidations:
+            return  # rows can contain changes which are not committed yet
+        backend = root._cache_backend_
+        namespace = entity._database_.cache_namespace
+        generation_key = namespace, root.__name__
+        generation = cache.entity_cache_generations.get(root)
+        if generation is None or backend.get(generation_key) != generation:
+            return  # rows can be older than changes committed by other sessions
+        attrs = list(attr_offsets)
+        names = tuple(attr.name for attr in attrs)
+        offsets = [ offset for attr in attrs for offset in attr_offsets[attr] ]
+        stored_keys = []
+        is_complete_dict = {}
+        for obj, row in objects_and_rows:
+            cls = obj.__class__
+            is_complete = is_complete_dict.get(cls)
+            if is_complete is None:
+                is_complete = is_complete_dict[cls] = all(
+                    attr in attr_offsets for attr in cls._attrs_with_columns_ if not attr.lazy)
+            if not is_complete: continue
+            pkval = obj._pkval_
+            key = namespace, root.__name__, pkval
+            backend.set(key, (names, tuple(row[offset] for offset in offsets)))
+            stored_keys.append(key)
+            for attr in root._simple_keys_:
+                if attr.reverse: continue
+                val = obj._vals_.get(attr)
+                if val is None: continue
+                key = namespace, root.__name__, attr.name, val
+                backend.set(key, pkval)
+                stored_keys.append(key)
+        if backend.get(generation_key) != generation:
+            for key in stored_keys: backend.delete(key)  # the cache was invalidated concurrently
     def _find_in_db_(entity, avdict, unique=False, for_update=False, nowait=False):
         database = entity._database_
         query_attrs = dict((attr, value is None) for attr, value in iteritems(avdict))
@@ -3774,6 +4492,9 @@ class EntityMeta(type):
         if attr is None:
             columns = entity._pk_columns_
             converters = entity._pk_converters_
+        elif type(attr) is tuple:
+            columns = list(chain.from_iterable(a.columns for a in attr))
+            converters = list(chain.from_iterable(a.converters for a in attr))
         else:
             columns = attr.columns
             converters = attr.converters
@@ -3786,6 +4507,90 @@ class EntityMeta(type):
         cached_sql = sql, adapter, attr_offsets
         entity._batchload_sql_cache_[query_key] = cached_sql
         return cached_sql
+    def _construct_insert_sql_(entity, attrs, auto_pk, rows_count=None):
+        query_key = attrs, auto_pk, rows_count
+        cached_sql = entity._insert_sql_cache_.get(query_key)
+        if cached_sql is not None: return cached_sql
+        database = entity._database_
+        columns = []
+        converters = []
+        for attr in attrs:
+            columns.extend(attr.columns)
+            converters.extend(attr.converters)
+        assert len(columns) == len(converters)
+        if rows_count is not None:
+            rows = [ [ [ 'PARAM', (i * len(converters) + j, None, None), converter ]
+                       for j, converter in enumerate(converters) ] for i in xrange(rows_count) ]
+            sql_ast = [ 'INSERT_MANY', entity._table_, columns, rows ]
+        else:
+            params = [ [ 'PARAM', (i, None, None),  converter ] for i, converter in enumerate(converters) ]
+            if not columns and database.provider.dialect == 'Oracle':
+                sql_ast = [ 'INSERT', entity._table_, entity._pk_columns_,
+                            [ [ 'DEFAULT' ] for column in entity._pk_columns_ ] ]
+            else: sql_ast = [ 'INSERT', entity._table_, columns, params ]
+        if auto_pk and rows_count is not None:
+            key_columns = [ columns[offset] for offset in entity._get_returning_key_offsets_(attrs) ]
+            sql_ast.append([ entity._pk_columns_[0] ] + key_columns)
+        elif auto_pk: sql_ast.append(entity._pk_columns_[0])
+        cached_sql = database._ast2sql(sql_ast)
+        entity._insert_sql_cache_[query_key] = cached_sql
+        return cached_sql
+    def _save_created_many_(entity, objects, attrs, values_list, auto_pk):
+        database = entity._database_
+        provider = database.provider
+        try:
+            if not auto_pk:
+                sql, adapter = entity._construct_insert_sql_(attrs, False)
+                database._exec_sql(sql, [ adapter(values) for values in values_list ], start_transaction=True)
+                new_ids = ()
+            else:
+                assert provider.insert_returning_syntax
+                new_ids = entity._insert_returning_ids_(attrs, values_list)
+        except IntegrityError as e:
+            msg = " ".join(tostring(arg) for arg in e.args)
+            throw(TransactionIntegrityError,
+                  'One of %d %s objects cannot be stored in the database. %s: %s'
+                  % (len(objects), entity.__name__, e.__class__.__name__, msg), e)
+        except DatabaseError as e:
+            msg = " ".join(tostring(arg) for arg in e.args)
+            throw(UnexpectedError, 'One of %d %s objects cannot be stored in the database. %s: %s'
+                                   % (len(objects), entity.__name__, e.__class__.__name__, msg), e)
+        for obj, new_id in izip(objects, new_ids or repeat(None)):
+            obj._set_inserted_(new_id)
+            obj._finish_save_()
+    def _save_updated_many_(entity, objects, sql, adapter, values_list):
+        database = entity._database_
+        cursor = database._exec_sql(sql, [ adapter(values) for values in values_list ], start_transaction=True)
+        # with executemany() the rowcount is the total number of updated rows or -1 if the driver does not know it
+        if cursor.rowcount not in (-1, len(objects)): throw(OptimisticCheckError,
+            'Some of %s objects %s were updated outside of current transaction'
+            % (entity.__name__, ', '.join(safe_repr(obj) for obj in objects[:10])))
+        for obj in objects:
+            obj._set_updated_()
+            obj._finish_save_()
+    def _save_deleted_many_(entity, objects, optimistic, sql, adapter, values_list):
+        database = entity._database_
+        if optimistic:
+            database._exec_sql(sql, [ adapter(values) for values in values_list ], start_transaction=True)
+        else:
+            max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
+            for i in xrange(0, len(objects), max_batch_size):
+                batch = objects[i:i+max_batch_size]
+                sql, adapter = entity._construct_batch_delete_sql_(len(batch))
+                database._exec_sql(sql, adapter(batch), start_transaction=True)
+        for obj in objects:
+            obj._set_deleted_()
+            obj._finish_save_()
+    def _construct_batch_delete_sql_(entity, batch_size):
+        cached_sql = entity._delete_sql_cache_.get(batch_size)
+        if cached_sql is not None: return cached_sql
+        row_value_syntax = entity._database_.provider.translator_cls.row_value_syntax
+        criteria_list = construct_batchload_criteria_list(
+            None, entity._pk_columns_, entity._pk_converters_, batch_size, row_value_syntax)
+        from_ast = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
+        sql_ast = [ 'DELETE', None, from_ast, [ 'WHERE' ] + criteria_list ]
+        cached_sql = entity._delete_sql_cache_[batch_size] = entity._database_._ast2sql(sql_ast)
+        return cached_sql
     def _construct_sql_(entity, query_attrs, order_by_pk=False, limit=None, for_update=False, nowait=False):
         if nowait: assert for_update
         sorted_query_attrs = tuple(sorted(query_attrs.items()))
@@ -3827,7 +4632,8 @@ class EntityMeta(type):
         cached_sql = sql, adapter, attr_offsets
         entity._find_sql_cache_[query_key] = cached_sql
         return cached_sql
-    def _fetch_objects(entity, cursor, attr_offsets, max_fetch_count=None, for_update=False, used_attrs=()):
+    def _fetch_objects(entity, cursor, attr_offsets, max_fetch_count=None, for_update=False, used_attrs=(),
+                       new_objects=None):
         if max_fetch_count is None: max_fetch_count = options.MAX_FETCH_COUNT
         if max_fetch_count is not None:
             rows = cursor.fetchmany(max_fetch_count + 1)
@@ -3837,17 +4643,31 @@ class EntityMeta(type):
                 throw(TooManyObjectsFoundError,
                     'Found more then pony.options.MAX_FETCH_COUNT=%d objects' % options.MAX_FETCH_COUNT)
         else: rows = cursor.fetchall()
+        return entity._objects_from_rows_(rows, attr_offsets, for_update, used_attrs, new_objects)
+    def _objects_from_rows_(entity, rows, attr_offsets, for_update=False, used_attrs=(), new_objects=None):
+        # new_objects, if given, receives objects which were absent in the identity map before
+        cache_objects = entity._database_._get_cache().objects if new_objects is not None else None
         objects = []
         if attr_offsets is None:
-            objects = [ entity._get_by_raw_pkval_(row, for_update) for row in rows ]
+            for row in rows:
+                if new_objects is not None: objects_count = len(cache_objects)
+                obj = entity._get_by_raw_pkval_(row, for_update)
+                if new_objects is not None and len(cache_objects) > objects_count: new_objects.append(obj)
+                objects.append(obj)
             entity._load_many_(objects)
         else:
+            entity_cache_rows = [] if entity._cache_backend_ is not None and not for_update else None
+            parse_row = entity._get_row_parser_(attr_offsets)
             for row in rows:
-                real_entity_subclass, pkval, avdict = entity._parse_row_(row, attr_offsets)
+                real_entity_subclass, pkval, avdict = parse_row(row)
+                if new_objects is not None: objects_count = len(cache_objects)
                 obj = real_entity_subclass._get_from_identity_map_(pkval, 'loaded', for_update)
                 if obj._status_ in del_statuses: continue
+                if new_objects is not None and len(cache_objects) > objects_count: new_objects.append(obj)
                 obj._db_set_(avdict)
                 objects.append(obj)
+                if entity_cache_rows is not None: entity_cache_rows.append((obj, row))
+            if entity_cache_rows: entity._store_in_entity_cache_(entity_cache_rows, attr_offsets)
         if used_attrs: entity._set_rbits(objects, used_attrs)
         return objects
     def _set_rbits(entity, objects, attrs):
@@ -3877,12 +4697,87 @@ class EntityMeta(type):
         if not entity._pk_is_composite_: pkval = avdict.pop(entity._pk_attrs_[0], None)
         else: pkval = tuple(avdict.pop(attr, None) for attr in entity._pk_attrs_)
         return real_entity_subclass, pkval, avdict
+    def _get_row_parser_(entity, attr_offsets, readonly=False):
+        key = readonly, tuple(sorted((attr.id, tuple(offsets)) for attr, offsets in iteritems(attr_offsets)))
+        parser = entity._row_parsers_.get(key)
+        if parser is None:
+            discr_attr = entity._discriminator_attr_
+            if not discr_attr: parser = entity._compile_row_parser_(attr_offsets, readonly)
+            else:
+                discr_offset = attr_offsets[discr_attr][0]
+                code2cls = discr_attr.code2cls
+                subclass_parsers = {}
+                def parser(row):
+                    real_entity_subclass = code2cls[discr_attr.validate(row[discr_offset], None, entity, from_db=True)]
+                    subclass_parser = subclass_parsers.get(real_entity_subclass)
+                    if subclass_parser is None:
+                        subclass_parser = real_entity_subclass._compile_row_parser_(attr_offsets, readonly)
+                        subclass_parsers[real_entity_subclass] = subclass_parser
+                    return subclass_parser(row)
+            entity._row_parsers_[key] = parser
+        return parser
+    def _compile_row_parser_(entity, attr_offsets, readonly=False):
+        # generates the equivalent of _parse_row_() specialized for the given entity and attr_offsets;
+        # readonly parsers represent related objects as ReadOnlyRecord references instead of entity instances
+        provider = entity._database_.provider
+        trusted = provider.trusted_driver_types
+        namespace = dict(entity=entity, throw=throw, slow_parse=entity._parse_row_, attr_offsets=attr_offsets)
+        lines = [ 'def parse_row(row):', ' try:', '  avdict = {}' ]
+        pk_names = [ None ] * len(entity._pk_attrs_)
+        for i, attr in enumerate(entity._attrs_):
+            offsets = attr_offsets.get(attr)
+            if offsets is None or attr.is_discriminator: continue
+            attr_name = 'a%d' % i
+            namespace[attr_name] = attr
+            if attr.pk_offset is None: target = 'avdict[%s]' % attr_name
+            else: target = pk_names[attr.pk_offset] = 'pk%d' % attr.pk_offset
+            if attr.reverse:
+                entity_name = 'e%d' % i
+                namespace[entity_name] = attr.py_type
+                get_ref = '_get_readonly_ref_' if readonly else '_get_by_raw_pkval_'
+                if len(offsets) == 1:
+                    lines.append('  v = row[%d]' % offsets[0])
+                    lines.append('  %s = None if v is None else %s.%s((v,))' % (target, entity_name, get_ref))
+                else:
+                    lines.append('  v = (%s)' % ', '.join('row[%d]' % offset for offset in offsets))
+                    lines.append('  %s = None if None in v else %s.%s(v)' % (target, entity_name, get_ref))
+                continue
+            converter = attr.converters[0] if len(attr.converters) == 1 else None
+            converter_name = 'c%d' % i
+            namespace[converter_name] = converter
+            if type(attr) not in (Optional, Required, PrimaryKey) or len(offsets) != 1 or converter is None:
+                lines.append('  v = %s.parse_value(row, %r)' % (attr_name, offsets))
+            else:
+                lines.append('  v = row[%d]' % offsets[0])
+                if overrides(converter, 'sql2py') and not (trusted and converter.py_type in provider.native_driver_types):
+                    lines.append('  if v is not None: v = %s.sql2py(v)' % converter_name)
+                if isinstance(attr, Required) and not trusted:
+                    conditions = []
+                    if not (attr.auto or attr.is_volatile or attr.sql_default): conditions.append('v is None')
+                    if issubclass(attr.py_type, basestring): conditions.append("v == ''")
+                    if conditions: lines.append("  if %s: throw(ValueError, 'Attribute %%s is required' %% %s)"
+                                                % (' or '.join(conditions), attr_name))
+            if readonly and converter is not None and overrides(converter, 'dbval2val'):
+                lines.append('  if v is not None: v = %s.dbval2val(v)' % converter_name)
+            lines.append('  %s = v' % target)
+        if None in pk_names:
+            assert not readonly
+            return lambda row: entity._parse_row_(row, attr_offsets)
+        if len(pk_names) == 1: pkval = pk_names[0]
+        else: pkval = '(%s)' % ', '.join(pk_names)
+        lines.append('  return entity, %s, avdict' % pkval)
+        lines.append(' except UnicodeDecodeError:')
+        lines.append('  return slow_parse(row, attr_offsets)')  # raises exception with a proper message
+        exec('\n'.join(lines), namespace)
+        return namespace['parse_row']
     def _load_many_(entity, objects):
         database = entity._database_
         cache = database._get_cache()
         seeds = cache.seeds[entity._pk_attrs_]
         if not seeds: return
         objects = set(obj for obj in objects if obj in seeds)
+        if entity._cache_backend_ is not None:
+            objects = [ obj for obj in objects if not obj._load_from_entity_cache_() ]
         objects = sorted(objects, key=attrgetter('_pkval_'))
         max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
         while objects:
@@ -3896,6 +4791,32 @@ class EntityMeta(type):
                 for obj in result:
                     if obj not in batch: throw(UnrepeatableReadError,
                                                'Phantom object %s disappeared' % safe_repr(obj))
+    def _refresh_updated_objects_(entity, attrs):
+        database = entity._database_
+        cache = database._get_cache()
+        objects = []
+        for obj in itervalues(cache.indexes[entity._pk_attrs_]):
+            if not isinstance(obj, entity) or obj._status_ in created_or_deleted_statuses: continue
+            dbvals = obj._dbvals_
+            loaded_attrs = [ attr for attr in attrs if attr in dbvals ]
+            if not loaded_attrs: continue
+            for attr in loaded_attrs:
+                # new values were written by the current transaction, so they are not unrepeatable reads
+                obj._rbits_ &= ~obj._bits_[attr]
+                if attr.lazy:
+                    val = obj._vals_.pop(attr, None)
+                    if dbvals is not obj._vals_: del dbvals[attr]
+                    if attr.is_unique and val is not None:
+                        cache_index = cache.indexes[attr]
+                        if cache_index.get(val) is obj: del cache_index[val]
+            if not all(attr.lazy for attr in loaded_attrs): objects.append(obj)
+        max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
+        while objects:
+            batch = objects[:max_batch_size]
+            objects = objects[max_batch_size:]
+            sql, adapter, attr_offsets = entity._construct_batchload_sql_(len(batch))
+            cursor = database._exec_sql(sql, adapter(batch))
+            entity._fetch_objects(cursor, attr_offsets, max_fetch_count=len(batch))
     def _select_all(entity):
         return Query(entity._default_iter_name_, entity._default_genexpr_, {}, { '.0' : entity })
     def _query_from_args_(entity, args, kwargs, frame_depth):
@@ -3904,7 +4825,7 @@ class EntityMeta(type):
 
         if type(func) is types.FunctionType:
             names = get_lambda_args(func)
-            code_key = id(func.func_code if PY2 else func.__code__)
+            code_key = get_code_key(func.func_code if PY2 else func.__code__)
             cond_expr, external_names, cells = decompile(func)
         elif isinstance(func, basestring):
             code_key = func
@@ -3955,7 +4876,9 @@ class EntityMeta(type):
                 obj._pkval_ = pkval
                 obj._status_ = status
                 obj._vals_ = {}
-                obj._dbvals_ = {}
+                # until the first modification, values of a loaded object are the same as values in the database,
+                # so _dbvals_ is the same dict as _vals_ until _unshare_vals_() is called
+                obj._dbvals_ = obj._vals_ if status == 'loaded' else {}
                 obj._save_pos_ = None
                 obj._session_cache_ = cache
                 if pkval is not None:
@@ -4003,6 +4926,25 @@ class EntityMeta(type):
         obj = entity._get_from_identity_map_(pkval, 'loaded', for_update)
         assert obj._status_ != 'cancelled'
         return obj
+    def _get_readonly_ref_(entity, raw_pkval):
+        i = 0
+        pkval = []
+        for attr in entity._pk_attrs_:
+            if not attr.reverse:
+                pkval.append(attr.validate(raw_pkval[i], None, entity, from_db=True))
+                i += 1
+            else:
+                pkval.append(attr.py_type._get_readonly_ref_(raw_pkval[i:i+len(attr.columns)]))
+                i += len(attr.columns)
+        return ReadOnlyRecord(entity, pkval[0] if not entity._pk_is_composite_ else tuple(pkval), None)
+    def _readonly_records_from_rows_(entity, rows, attr_offsets):
+        parse_row = entity._get_row_parser_(attr_offsets, readonly=True)
+        return [ ReadOnlyRecord(*parse_row(row)) for row in rows ]
+    def _find_readonly_(entity, avdict):
+        query_attrs = dict((attr, value is None) for attr, value in iteritems(avdict))
+        sql, adapter, attr_offsets = entity._construct_sql_(query_attrs)
+        cursor = entity._database_._exec_sql(sql, adapter(avdict))
+        return entity._readonly_records_from_rows_(cursor.fetchall(), attr_offsets)
     def _get_propagation_mixin_(entity):
         mixin = entity._propagation_mixin_
         if mixin is not None: return mixin
@@ -4255,6 +5197,7 @@ class Entity(with_metaclass(EntityMeta)):
         if cache is not database._get_cache():
             throw(TransactionError, "Object %s doesn't belong to current transaction" % safe_repr(obj))
         seeds = cache.seeds[entity._pk_attrs_]
+        if entity._cache_backend_ is not None and obj in seeds and obj._load_from_entity_cache_(): return
         max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
         objects = [ obj ]
         if options.PREFETCHING:
@@ -4267,6 +5210,14 @@ class Entity(with_metaclass(EntityMeta)):
         objects = entity._fetch_objects(cursor, attr_offsets)
         if obj not in objects: throw(UnrepeatableReadError,
                                      'Phantom object %s disappeared' % safe_repr(obj))
+    def _load_from_entity_cache_(obj):
+        parsed_row = obj.__class__._get_from_entity_cache_(obj._pkval_)
+        if parsed_row is None: return False
+        real_entity_subclass, pkval, avdict = parsed_row
+        if not issubclass(real_entity_subclass, obj.__class__): return False
+        real_entity_subclass._get_from_identity_map_(pkval, 'loaded')
+        obj._db_set_(avdict)
+        return True
     @cut_traceback
     def load(obj, *attrs):
         cache = obj._session_cache_
@@ -4329,6 +5280,10 @@ class Entity(with_metaclass(EntityMeta)):
         objects = entity._fetch_objects(cursor, attr_offsets)
         if obj not in objects: throw(UnrepeatableReadError,
                                      'Phantom object %s disappeared' % safe_repr(obj))
+    def _unshare_vals_(obj):
+        # _dbvals_ of an unmodified loaded object is the same dict as _vals_, so it should be
+        # copied before _vals_ gets anything that is not a value loaded from the database
+        if obj._dbvals_ is obj._vals_: obj._dbvals_ = obj._vals_.copy()
     def _attr_changed_(obj, attr):
         cache = obj._session_cache_
         if not cache.is_alive: throw(
@@ -4341,6 +5296,7 @@ class Entity(with_metaclass(EntityMeta)):
         wbits = obj._wbits_
         bit = obj._bits_[attr]
         objects_to_save = cache.objects_to_save
+        obj._unshare_vals_()
         if wbits is not None and bit:
             obj._wbits_ |= bit
             if status != 'modified':
@@ -4358,13 +5314,12 @@ class Entity(with_metaclass(EntityMeta)):
         if not avdict: return
 
         get_val = obj._vals_.get
-        get_dbval = obj._dbvals_.get
         rbits = obj._rbits_
         wbits = obj._wbits_
         for attr, new_dbval in items_list(avdict):
             assert attr.pk_offset is None
             assert new_dbval is not NOT_LOADED
-            old_dbval = get_dbval(attr, NOT_LOADED)
+            old_dbval = obj._dbvals_.get(attr, NOT_LOADED)
             if old_dbval is not NOT_LOADED:
                 if unpickling or old_dbval == new_dbval or (
                         not attr.reverse and attr.converters[0].dbvals_equal(old_dbval, new_dbval)):
@@ -4377,7 +5332,7 @@ class Entity(with_metaclass(EntityMeta)):
                 % (obj.__class__.__name__, attr.name, obj, old_dbval, new_dbval))
 
             if attr.reverse: attr.db_update_reverse(obj, old_dbval, new_dbval)
-            obj._dbvals_[attr] = new_dbval
+            if obj._dbvals_ is not obj._vals_: obj._dbvals_[attr] = new_dbval
             if wbits & bit: del avdict[attr]
             if attr.is_unique:
                 old_val = get_val(attr)
@@ -4395,9 +5350,11 @@ class Entity(with_metaclass(EntityMeta)):
             new_vals = tuple(vals)
             cache.db_update_composite_index(obj, attrs, prev_vals, new_vals)
 
-        for attr, new_val in iteritems(avdict):
+        for attr, new_dbval in iteritems(avdict):
             converter = attr.converters[0]
-            new_val = converter.dbval2val(new_val, obj)
+            new_val = converter.dbval2val(new_dbval, obj)
+            if new_val is not new_dbval: obj._unshare_vals_()
+            if obj._dbvals_ is not obj._vals_: obj._dbvals_[attr] = new_dbval
             obj._vals_[attr] = new_val
     def _delete_(obj, undo_funcs=None):
         status = obj._status_
@@ -4528,6 +5485,7 @@ class Entity(with_metaclass(EntityMeta)):
                         obj._save_pos_ = len(objects_to_save)
                         objects_to_save.append(obj)
                         cache.modified = True
+                obj._unshare_vals_()
                 if not collection_avdict:
                     for attr in avdict:
                         if attr.reverse or attr.is_part_of_unique_index: break
@@ -4609,6 +5567,15 @@ class Entity(with_metaclass(EntityMeta)):
             else:
                 optimistic_operations.extend(converter.EQ for converter in converters)
         return optimistic_operations, optimistic_columns, optimistic_converters, optimistic_values
+    def _has_unsaved_principals_(obj):
+        status = obj._status_
+        if status == 'created': attrs = obj._attrs_with_columns_
+        else: attrs = obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_)
+        for attr in attrs:
+            if not attr.reverse: continue
+            val = obj._vals_[attr]
+            if val is not None and val._status_ == 'created': return True
+        return False
     def _save_principal_objects_(obj, dependent_objects):
         if dependent_objects is None: dependent_objects = []
         elif obj in dependent_objects:
@@ -4627,6 +5594,7 @@ class Entity(with_metaclass(EntityMeta)):
     def _update_dbvals_(obj, after_create):
         bits = obj._bits_
         vals = obj._vals_
+        obj._unshare_vals_()
         dbvals = obj._dbvals_
         cache_indexes = obj._session_cache_.indexes
         for attr in obj._attrs_with_columns_:
@@ -4648,7 +5616,7 @@ class Entity(with_metaclass(EntityMeta)):
                 # TODO this conversion should be unnecessary
                 converter = attr.converters[0]
                 dbvals[attr] = converter.val2dbval(val, obj)
-    def _save_created_(obj):
+    def _get_insert_values_(obj):
         auto_pk = (obj._pkval_ is None)
         attrs = []
         values = []
@@ -4658,28 +5626,11 @@ class Entity(with_metaclass(EntityMeta)):
             if val is not None:
                 attrs.append(attr)
                 values.extend(attr.get_raw_values(val))
-        attrs = tuple(attrs)
-
+        return auto_pk, tuple(attrs), values
+    def _save_created_(obj):
+        auto_pk, attrs, values = obj._get_insert_values_()
         database = obj._database_
-        cached_sql = obj._insert_sql_cache_.get(attrs)
-        if cached_sql is None:
-            columns = []
-            converters = []
-            for attr in attrs:
-                columns.extend(attr.columns)
-                converters.extend(attr.converters)
-            assert len(columns) == len(converters)
-            params = [ [ 'PARAM', (i, None, None),  converter ] for i, converter in enumerate(converters) ]
-            entity = obj.__class__
-            if not columns and database.provider.dialect == 'Oracle':
-                sql_ast = [ 'INSERT', entity._table_, obj._pk_columns_,
-                            [ [ 'DEFAULT' ] for column in obj._pk_columns_ ] ]
-            else: sql_ast = [ 'INSERT', entity._table_, columns, params ]
-            if auto_pk: sql_ast.append(entity._pk_columns_[0])
-            sql, adapter = database._ast2sql(sql_ast)
-            entity._insert_sql_cache_[attrs] = sql, adapter
-        else: sql, adapter = cached_sql
-
+        sql, adapter = obj.__class__._construct_insert_sql_(attrs, auto_pk)
         arguments = adapter(values)
         try:
             if auto_pk: new_id = database._exec_sql(sql, arguments, returning_id=True,
@@ -4694,8 +5645,9 @@ class Entity(with_metaclass(EntityMeta)):
             msg = " ".join(tostring(arg) for arg in e.args)
             throw(UnexpectedError, 'Object %r cannot be stored in the database. %s: %s'
                                    % (obj, e.__class__.__name__, msg), e)
-
-        if auto_pk:
+        obj._set_inserted_(new_id if auto_pk else None)
+    def _set_inserted_(obj, new_id=None):
+        if new_id is not None:
             pk_attrs = obj._pk_attrs_
             cache_index = obj._session_cache_.indexes[pk_attrs]
             obj2 = cache_index.setdefault(new_id, obj)
@@ -4708,52 +5660,59 @@ class Entity(with_metaclass(EntityMeta)):
         obj._rbits_ = obj._all_bits_except_volatile_
         obj._wbits_ = 0
         obj._update_dbvals_(True)
-    def _save_updated_(obj):
+    def _prepare_update_(obj):
         update_columns = []
         values = []
         for attr in obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_):
             update_columns.extend(attr.columns)
             val = obj._vals_[attr]
             values.extend(attr.get_raw_values(val))
-        if update_columns:
-            for attr in obj._pk_attrs_:
-                val = obj._vals_[attr]
-                values.extend(attr.get_raw_values(val))
-            cache = obj._session_cache_
-            if obj not in cache.for_update:
-                optimistic_ops, optimistic_columns, optimistic_converters, optimistic_values = \
-                    obj._construct_optimistic_criteria_()
-                values.extend(optimistic_values)
-            else: optimistic_columns = optimistic_converters = optimistic_ops = ()
-            query_key = tuple(update_columns), tuple(optimistic_columns), tuple(optimistic_ops)
-            database = obj._database_
-            cached_sql = obj._update_sql_cache_.get(query_key)
-            if cached_sql is None:
-                update_converters = []
-                for attr in obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_):
-                    update_converters.extend(attr.converters)
-                assert len(update_columns) == len(update_converters)
-                update_params = [ [ 'PARAM', (i, None, None), converter ] for i, converter in enumerate(update_converters) ]
-                params_count = len(update_params)
-                where_list = [ 'WHERE' ]
-                pk_columns = obj._pk_columns_
-                pk_converters = obj._pk_converters_
-                params_count = populate_criteria_list(where_list, pk_columns, pk_converters, repeat('EQ'), params_count)
-                if optimistic_columns: populate_criteria_list(
-                    where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
-                sql_ast = [ 'UPDATE', obj._table_, list(izip(update_columns, update_params)), where_list ]
-                sql, adapter = database._ast2sql(sql_ast)
-                obj._update_sql_cache_[query_key] = sql, adapter
-            else: sql, adapter = cached_sql
+        if not update_columns: return None
+        for attr in obj._pk_attrs_:
+            val = obj._vals_[attr]
+            values.extend(attr.get_raw_values(val))
+        cache = obj._session_cache_
+        if obj not in cache.for_update:
+            optimistic_ops, optimistic_columns, optimistic_converters, optimistic_values = \
+                obj._construct_optimistic_criteria_()
+            values.extend(optimistic_values)
+        else: optimistic_columns = optimistic_converters = optimistic_ops = ()
+        query_key = tuple(update_columns), tuple(optimistic_columns), tuple(optimistic_ops)
+        database = obj._database_
+        cached_sql = obj._update_sql_cache_.get(query_key)
+        if cached_sql is None:
+            update_converters = []
+            for attr in obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_):
+                update_converters.extend(attr.converters)
+            assert len(update_columns) == len(update_converters)
+            update_params = [ [ 'PARAM', (i, None, None), converter ] for i, converter in enumerate(update_converters) ]
+            params_count = len(update_params)
+            where_list = [ 'WHERE' ]
+            pk_columns = obj._pk_columns_
+            pk_converters = obj._pk_converters_
+            params_count = populate_criteria_list(where_list, pk_columns, pk_converters, repeat('EQ'), params_count)
+            if optimistic_columns: populate_criteria_list(
+                where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
+            sql_ast = [ 'UPDATE', obj._table_, list(izip(update_columns, update_params)), where_list ]
+            sql, adapter = database._ast2sql(sql_ast)
+            obj._update_sql_cache_[query_key] = sql, adapter
+        else: sql, adapter = cached_sql
+        return query_key, sql, adapter, values
+    def _save_updated_(obj):
+        prepared = obj._prepare_update_()
+        if prepared is not None:
+            query_key, sql, adapter, values = prepared
             arguments = adapter(values)
-            cursor = database._exec_sql(sql, arguments, start_transaction=True)
+            cursor = obj._database_._exec_sql(sql, arguments, start_transaction=True)
             if cursor.rowcount != 1:
                 throw(OptimisticCheckError, 'Object %s was updated outside of current transaction' % safe_repr(obj))
+        obj._set_updated_()
+    def _set_updated_(obj):
         obj._status_ = 'updated'
         obj._rbits_ |= obj._wbits_ & obj._all_bits_except_volatile_
         obj._wbits_ = 0
         obj._update_dbvals_(False)
-    def _save_deleted_(obj):
+    def _prepare_delete_(obj):
         values = []
         values.extend(obj._get_raw_pkval_())
         cache = obj._session_cache_
@@ -4775,10 +5734,15 @@ class Entity(with_metaclass(EntityMeta)):
             sql, adapter = database._ast2sql(sql_ast)
             obj.__class__._delete_sql_cache_[query_key] = sql, adapter
         else: sql, adapter = cached_sql
+        return query_key, sql, adapter, values
+    def _save_deleted_(obj):
+        query_key, sql, adapter, values = obj._prepare_delete_()
         arguments = adapter(values)
-        database._exec_sql(sql, arguments, start_transaction=True)
+        obj._database_._exec_sql(sql, arguments, start_transaction=True)
+        obj._set_deleted_()
+    def _set_deleted_(obj):
         obj._status_ = 'deleted'
-        cache.indexes[obj._pk_attrs_].pop(obj._pkval_)
+        obj._session_cache_.indexes[obj._pk_attrs_].pop(obj._pkval_)
     def _save_(obj, dependent_objects=None):
         cache = obj._session_cache_
         assert cache.is_alive
@@ -4793,8 +5757,12 @@ class Entity(with_metaclass(EntityMeta)):
         else: assert False, "_save_() called for object %r with incorrect status %s" % (obj, status)  # pragma: no cover
 
         assert obj._status_ in saved_statuses
+        obj._finish_save_()
+    def _finish_save_(obj):
         cache = obj._session_cache_
         cache.saved_objects.append((obj, obj._status_))
+        cache.modified_tables.add(obj._table_)
+        if obj._cache_backend_ is not None: cache.entity_cache_invalidations[obj._root_].add(obj._pkval_)
         objects_to_save = cache.objects_to_save
         save_pos = obj._save_pos_
         if save_pos == len(objects_to_save) - 1:
@@ -4855,6 +5823,70 @@ class Entity(with_metaclass(EntityMeta)):
     def to_json(obj, include=(), exclude=(), converter=None, with_schema=True, schema_hash=None):
         return obj._database_.to_json(obj, include, exclude, converter, with_schema, schema_hash)
 
+class ReadOnlyRecord(object):
+    __slots__ = '_entity_', '_pkval_', '_vals_'
+    def __init__(record, entity, pkval, vals):
+        object.__setattr__(record, '_entity_', entity)
+        object.__setattr__(record, '_pkval_', pkval)
+        object.__setattr__(record, '_vals_', vals)  # None means that only primary key is known
+    def __getattr__(record, name):
+        entity = record._entity_
+        attr = entity._adict_.get(name)
+        if attr is None: throw(AttributeError, "'%s' object has no attribute %r" % (entity.__name__, name))
+        if attr.pk_offset is not None:
+            return record._pkval_[attr.pk_offset] if entity._pk_is_composite_ else record._pkval_
+        if attr.is_collection: throw(TypeError,
+            'Collection attribute %s is not available for read-only object %r' % (attr, record))
+        if record._vals_ is None: record._load_()
+        vals = record._vals_
+        if attr in vals: return vals[attr]
+        if not attr.columns:
+            records = attr.py_type._find_readonly_({ attr.reverse : record })
+            val = records[0] if records else None
+        else:
+            sql, adapter, offsets = attr.get_lazy_sql()
+            cursor = entity._database_._exec_sql(sql, adapter(record._get_raw_pkval_()))
+            row = cursor.fetchone()
+            if attr.reverse: val = None if None in row else attr.py_type._get_readonly_ref_(row)
+            else:
+                val = attr.parse_value(row, offsets)
+                converter = attr.converters[0]
+                if val is not None: val = converter.dbval2val(val)
+        vals[attr] = val
+        return val
+    def __setattr__(record, name, value):
+        throw(TypeError, 'Read-only object %r cannot be modified' % record)
+    def _load_(record):
+        entity = record._entity_
+        pkval = record._pkval_
+        avdict = dict(izip(entity._pk_attrs_, pkval if entity._pk_is_composite_ else (pkval,)))
+        records = entity._find_readonly_(avdict)
+        if not records: throw(ObjectNotFound, entity, pkval)
+        loaded = records[0]
+        object.__setattr__(record, '_entity_', loaded._entity_)
+        object.__setattr__(record, '_vals_', loaded._vals_)
+    def _get_raw_pkval_(record):
+        entity = record._entity_
+        pkval = record._pkval_
+        if not entity._pk_is_composite_: pkval = (pkval,)
+        raw_pkval = []
+        for attr, val in izip(entity._pk_attrs_, pkval):
+            if not attr.reverse: raw_pkval.append(val)
+            else: raw_pkval.extend(val._get_raw_pkval_())
+        return tuple(raw_pkval)
+    def __eq__(record, other):
+        return isinstance(other, ReadOnlyRecord) and record._entity_._root_ is other._entity_._root_ \
+               and record._pkval_ == other._pkval_
+    def __ne__(record, other):
+        return not record.__eq__(other)
+    def __hash__(record):
+        return hash((record._entity_._root_, record._pkval_))
+    def __repr__(record):
+        pkval = record._pkval_
+        if record._entity_._pk_is_composite_: pkval = ','.join(imap(repr, pkval))
+        else: pkval = repr(pkval)
+        return '%s[%s]' % (record._entity_.__name__, pkval)
+
 def string2ast(s):
     result = string2ast_cache.get(s)
     if result is not None: return result
@@ -4914,7 +5946,7 @@ def make_query(args, frame_depth, left_join=False):
         args, kwargs=None, frame_depth=frame_depth+1, from_generator=True)
     if isinstance(gen, types.GeneratorType):
         tree, external_names, cells = decompile(gen)
-        code_key = id(gen.gi_frame.f_code)
+        code_key = get_code_key(gen.gi_frame.f_code)
     elif isinstance(gen, basestring):
         tree = string2ast(gen)
         if not isinstance(tree, ast.GenExpr): throw(TypeError,
@@ -5014,6 +6046,36 @@ def extract_vars(extractors, globals, locals, cells=None):
         vars[key] = value
     return vars, vartypes
 
+def encode_page_cursor(values):
+    items = []
+    for value in values:
+        t = type(value)
+        if value is None or t is bool or t is float or t in int_types or isinstance(value, basestring):
+            items.append(value)
+        elif t is datetime.datetime: items.append({'datetime': value.isoformat()})
+        elif t is datetime.date: items.append({'date': value.isoformat()})
+        elif t is datetime.time: items.append({'time': value.isoformat()})
+        elif t is Decimal: items.append({'decimal': str(value)})
+        elif t is UUID: items.append({'uuid': str(value)})
+        else: throw(TypeError, 'Value of type %r cannot be stored in page cursor' % t.__name__)
+    data = json.dumps(items, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+page_cursor_decoders = {'datetime': str2datetime, 'date': str2date, 'time': str2time, 'decimal': Decimal, 'uuid': UUID}
+
+def decode_page_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(str(cursor + '=' * (-len(cursor) % 4)))
+        items = json.loads(data.decode('utf-8'))
+        values = []
+        for item in items:
+            if type(item) is dict:
+                (name, value), = item.items()
+                item = page_cursor_decoders[name](value)
+            values.append(item)
+    except (TypeError, ValueError, KeyError, ArithmeticError): throw(ValueError, 'Invalid page cursor: %r' % cursor)
+    return tuple(values)
+
 def unpickle_query(query_result):
     return query_result
 
@@ -5043,7 +6105,7 @@ def unpickle_ast(pickled):
 class Query(object):
     def __init__(query, code_key, tree, globals, locals, cells=None, left_join=False):
         assert isinstance(tree, ast.GenExprInner)
-        extractors, varnames, tree, pretranslator_key = create_extractors(
+        extractors, varnames, tree, pretranslator_key, list_keys = create_extractors(
             code_key, tree, 0, globals, locals, special_functions, const_functions)
         vars, vartypes = extract_vars(extractors, globals, locals, cells)
 
@@ -5058,7 +6120,9 @@ class Query(object):
         if database is None: throw(TranslationError, 'Entity %s is not mapped to a database' % origin.__name__)
         if database.schema is None: throw(ERDiagramError, 'Mapping is not generated for entity %r' % origin.__name__)
         database.provider.normalize_vars(vars, vartypes)
+        database.provider.normalize_in_lists(vars, vartypes, list_keys)
         query._vars = vars
+        query._list_keys = list_keys
         query._key = pretranslator_key, tuple(vartypes[name] for name in varnames), left_join
         query._database = database
 
@@ -5083,6 +6147,9 @@ class Query(object):
         query._prefetch = False
         query._entities_to_prefetch = set()
         query._attrs_to_prefetch_dict = defaultdict(set)
+        query._cached = False
+        query._cache_ttl = None
+        query._readonly = False
     def _clone(query, **kwargs):
         new_query = object.__new__(Query)
         new_query.__dict__.update(query.__dict__)
@@ -5102,13 +6169,19 @@ class Query(object):
         database = query._database
         cache_entry = database._constructed_sql_cache.get(sql_key)
         if cache_entry is None:
-            sql_ast, attr_offsets = translator.construct_sql_ast(
-                range, query._distinct, aggr_func_name, query._for_update, query._nowait, attrs_to_prefetch)
-            cache = database._get_cache()
-            sql, adapter = database.provider.ast2sql(sql_ast)
-            cache_entry = sql, adapter, attr_offsets
+            persistent_cache = database._persistent_sql_cache
+            if persistent_cache is not None: cache_entry = persistent_cache.get(sql_key)
+            if cache_entry is None:
+                sql_ast, attr_offsets = translator.construct_sql_ast(
+                    range, query._distinct, aggr_func_name, query._for_update, query._nowait, attrs_to_prefetch)
+                cache = database._get_cache()
+                provider = database.provider
+                builder = provider.sqlbuilder_cls(provider, sql_ast)
+                sql, adapter = builder.sql, builder.adapter
+                if persistent_cache is not None: persistent_cache.put(sql_key, sql, builder.params, attr_offsets)
+                cache_entry = sql, adapter, attr_offsets
             database._constructed_sql_cache[sql_key] = cache_entry
-        else: sql, adapter, attr_offsets = cache_entry
+        sql, adapter, attr_offsets = cache_entry
         arguments = adapter(query._vars)
         if query._translator.query_result_is_cacheable:
             arguments_type = type(arguments)
@@ -5122,29 +6195,34 @@ class Query(object):
     def get_sql(query):
         sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments()
         return sql
-    def _fetch(query, range=None):
+    def _fetch(query, range=None, new_objects=None):
         translator = query._translator
         sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments(range)
         database = query._database
         cache = database._get_cache()
         if query._for_update: cache.immediate = True
         cache.prepare_connection_for_query_execution()  # may clear cache.query_results
+        if query._is_readonly():
+            if query._cached and query_key is not None:
+                rows = query._fetch_rows_from_shared_cache(sql, arguments, query_key)
+            else: rows = database._exec_sql(sql, arguments).fetchall()
+            result = translator.expr_type._readonly_records_from_rows_(rows, attr_offsets)
+            return QueryResult(result, query, translator.expr_type, translator.col_names)
         try: result = cache.query_results[query_key]
         except KeyError:
-            cursor = database._exec_sql(sql, arguments)
-            if isinstance(translator.expr_type, EntityMeta):
-                entity = translator.expr_type
-                result = entity._fetch_objects(cursor, attr_offsets, for_update=query._for_update,
-                                               used_attrs=translator.get_used_attrs())
-            elif len(translator.row_layout) == 1:
-                func, slice_or_offset, src = translator.row_layout[0]
-                result = list(starmap(func, cursor.fetchall()))
+            if query._cached and query_key is not None:
+                rows = query._fetch_rows_from_shared_cache(sql, arguments, query_key)
+                if isinstance(translator.expr_type, EntityMeta):
+                    result = translator.expr_type._objects_from_rows_(
+                        rows, attr_offsets, used_attrs=translator.get_used_attrs(), new_objects=new_objects)
+                else: result = query._parse_rows(rows)
             else:
-                result = [ tuple(func(sql_row[slice_or_offset])
-                                 for func, slice_or_offset, src in translator.row_layout)
-                           for sql_row in cursor.fetchall() ]
-                for i, t in enumerate(translator.expr_type):
-                    if isinstance(t, EntityMeta) and t._subclasses_: t._load_many_(row[i] for row in result)
+                cursor = database._exec_sql(sql, arguments)
+                if isinstance(translator.expr_type, EntityMeta):
+                    entity = translator.expr_type
+                    result = entity._fetch_objects(cursor, attr_offsets, for_update=query._for_update,
+                                                   used_attrs=translator.get_used_attrs(), new_objects=new_objects)
+                else: result = query._parse_rows(cursor.fetchall())
             if query_key is not None: cache.query_results[query_key] = result
         else:
             stats = database._dblocal.stats
@@ -5154,8 +6232,104 @@ class Query(object):
 
         if query._prefetch: query._do_prefetch(result)
         return QueryResult(result, query, translator.expr_type, translator.col_names)
+    def _is_readonly(query):
+        return query._readonly and isinstance(query._translator.expr_type, EntityMeta)
+    def _parse_rows(query, rows):
+        translator = query._translator
+        if len(translator.row_layout) == 1:
+            func, slice_or_offset, src = translator.row_layout[0]
+            return list(starmap(func, rows))
+        result = [ tuple(func(sql_row[slice_or_offset])
+                         for func, slice_or_offset, src in translator.row_layout)
+                   for sql_row in rows ]
+        for i, t in enumerate(translator.expr_type):
+            if isinstance(t, EntityMeta) and t._subclasses_: t._load_many_(row[i] for row in result)
+        return result
+    def _get_used_tables(query):
+        database = query._database
+        tables = database._query_tables_cache.get(query._key)
+        if tables is None:
+            sql_ast, attr_offsets = query._translator.construct_sql_ast()
+            tables = database._query_tables_cache[query._key] = tuple(set(get_sql_ast_tables(sql_ast)))
+        return tables
+    def _fetch_rows_from_shared_cache(query, sql, arguments, query_key):
+        database = query._database
+        cache = database._get_cache()
+        tables = query._get_used_tables()
+        modified_tables = cache.modified_tables
+        if cache.modified or None in modified_tables or not modified_tables.isdisjoint(tables):
+            return database._exec_sql(sql, arguments).fetchall()  # the transaction sees its own changes
+        versions = database._get_table_versions(tables)
+        result_cache = database._query_result_cache
+        cached_entry = result_cache.get(query_key)
+        if cached_entry is not None and cached_entry[0] == versions:
+            stats = database._dblocal.stats
+            stat = stats.get(sql)
+            if stat is not None: stat.cache_count += 1
+            else: stats[sql] = QueryStat(sql)
+            return cached_entry[1]
+        rows = database._exec_sql(sql, arguments).fetchall()
+        result_cache.set(query_key, (versions, rows), query._cache_ttl)
+        return rows
+    @cut_traceback
+    def cached(query, ttl=None):
+        if ttl is not None and not (isinstance(ttl, (int_types, float)) and ttl > 0): throw(ValueError,
+            'ttl must be a positive number. Got: %r' % ttl)
+        if query._for_update: throw(TypeError, 'Query with for_update() cannot be cached')
+        return query._clone(_cached=True, _cache_ttl=ttl)
+    @cut_traceback
+    def readonly(query):
+        if query._for_update: throw(TypeError, 'Query with for_update() cannot be read-only')
+        if query._prefetch: throw(TypeError, 'Query with prefetch() cannot be read-only')
+        return query._clone(_readonly=True)
+    @cut_traceback
+    def iter_chunks(query, size=1000, evict=False):
+        if not isinstance(size, int_types): throw(TypeError, 'Chunk size must be integer. Got: %r' % size)
+        if size < 1: throw(ValueError, 'Chunk size must be positive. Got: %d' % size)
+        if query._prefetch and query._database.provider.streaming_blocks_connection: throw(TypeError,
+            'Query with prefetch() cannot be streamed on %s' % query._database.provider.dialect)
+        return query._iter_chunks(size, evict)
+    def _iter_chunks(query, size, evict):
+        translator = query._translator
+        expr_type = translator.expr_type
+        sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments()
+        database = query._database
+        cache = database._get_cache()
+        if query._for_update: cache.immediate = True
+        cursor = database._exec_sql(sql, arguments, streaming=True)
+        if cache.provider.streaming_blocks_connection: cache.blocking_stream = cursor
+        is_entity_query = isinstance(expr_type, EntityMeta)
+        used_attrs = translator.get_used_attrs() if is_entity_query else ()
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows: break
+                new_objects = [] if evict and is_entity_query else None
+                if is_entity_query:
+                    chunk = expr_type._objects_from_rows_(rows, attr_offsets, query._for_update,
+                                                          used_attrs, new_objects)
+                elif len(translator.row_layout) == 1:
+                    func, slice_or_offset, src = translator.row_layout[0]
+                    chunk = list(starmap(func, rows))
+                else:
+                    chunk = [ tuple(func(sql_row[slice_or_offset])
+                                    for func, slice_or_offset, src in translator.row_layout)
+                              for sql_row in rows ]
+                    for i, t in enumerate(expr_type):
+                        if isinstance(t, EntityMeta) and t._subclasses_: t._load_many_(row[i] for row in chunk)
+                if query._prefetch: query._do_prefetch(chunk)
+                yield chunk
+                # objects of the previous chunk which were not modified are not needed in the session anymore
+                if new_objects: cache.evict(new_objects)
+        finally:
+            if cache.blocking_stream is cursor: cache.blocking_stream = None
+            cursor.close()
+    @cut_traceback
+    def stream(query, chunk_size=1000, evict=False):
+        return chain.from_iterable(query.iter_chunks(chunk_size, evict))
     @cut_traceback
     def prefetch(query, *args):
+        if query._readonly: throw(TypeError, 'Read-only query cannot be used with prefetch()')
         query = query._clone(_entities_to_prefetch=query._entities_to_prefetch.copy(),
                              _attrs_to_prefetch_dict=query._attrs_to_prefetch_dict.copy())
         query._prefetch = True
@@ -5288,6 +6462,82 @@ class Query(object):
         cache.immediate = True
         cache.prepare_connection_for_query_execution()  # may clear cache.query_results
         cursor = database._exec_sql(sql, arguments)
+        entity = translator.expr_type
+        entity._invalidate_after_bulk_write_(cache, entity._attrs_with_columns_)
+        return cursor.rowcount
+    @cut_traceback
+    def update(query, **kwargs):
+        translator = query._translator
+        entity = translator.expr_type
+        if not isinstance(entity, EntityMeta): throw(TypeError,
+            'Update query should be applied to a single entity. Got: %s' % ast2src(translator.tree.expr))
+        if not kwargs: throw(TypeError, 'At least one attribute value should be specified for update')
+        attrs = []
+        for name in sorted(kwargs):
+            attr = entity._adict_.get(name)
+            if attr is None: throw(TypeError, 'Unknown attribute %r' % name)
+            if attr.is_collection: throw(TypeError, 'Collection attribute %s cannot be updated in bulk' % attr)
+            if attr.pk_offset is not None: throw(TypeError, 'Cannot change value of primary key attribute %s' % attr)
+            if attr.is_discriminator: throw(TypeError, 'Cannot assign value to discriminator attribute')
+            if not attr.columns: throw(TypeError,
+                'Attribute %s has no columns and cannot be updated in bulk. Update %s instead' % (attr, attr.reverse))
+            attrs.append(attr)
+
+        # lambdas are translated as order_by() expressions, each of them is prepended to the ORDER BY list
+        new_query = query
+        new_vars = {}
+        exprs = {}
+        lambda_attrs = []
+        for attr in attrs:
+            val = kwargs[attr.name]
+            if type(val) is types.FunctionType:
+                func, globals, locals = get_globals_and_locals((val,), kwargs=None, frame_depth=3)
+                order_len = len(new_query._translator.order)
+                new_query = new_query._process_lambda(func, globals, locals, order_by=True)
+                expr_types = new_query._translator.new_order_types
+                if len(expr_types) != 1 or len(new_query._translator.order) - order_len != len(attr.columns):
+                    throw(TypeError, 'Expression assigned to attribute %s has incorrect number of columns' % attr)
+                expr_type = expr_types[0]
+                if not are_assignable_types(normalize_type(attr.py_type), expr_type): throw(TypeError,
+                    'Expression of type %s cannot be assigned to attribute %s'
+                    % (getattr(expr_type, '__name__', expr_type), attr))
+                lambda_attrs.append(attr)
+                continue
+            val = attr.validate(val, None, entity)
+            exprs[attr] = params = []
+            for j, (raw_val, converter) in enumerate(izip(attr.get_raw_values(val), attr.converters)):
+                varkey = ('update', attr.name, j)
+                new_vars[varkey] = raw_val
+                params.append([ 'PARAM', (varkey, None, None), converter ])
+
+        translator = new_query._translator
+        offset = 0
+        for attr in reversed(lambda_attrs):
+            exprs[attr] = translator.order[offset:offset+len(attr.columns)]
+            offset += len(attr.columns)
+        sql_key = new_query._key + ('UPDATE', tuple((attr.name, type(kwargs[attr.name]) is types.FunctionType)
+                                                    for attr in attrs))
+        database = query._database
+        cache = database._get_cache()
+        cache_entry = database._constructed_sql_cache.get(sql_key)
+        if cache_entry is None:
+            pairs = []
+            for attr in attrs:
+                pairs.extend(izip(attr.columns, exprs[attr]))
+            sql_ast = translator.construct_update_sql_ast(pairs)
+            cache_entry = database.provider.ast2sql(sql_ast)
+            database._constructed_sql_cache[sql_key] = cache_entry
+        sql, adapter = cache_entry
+        vars = new_query._vars
+        if new_vars:
+            vars = vars.copy()
+            vars.update(new_vars)
+        arguments = adapter(vars)
+        cache.immediate = True
+        cache.prepare_connection_for_query_execution()  # may clear cache.query_results
+        cursor = database._exec_sql(sql, arguments)
+        entity._invalidate_after_bulk_write_(cache, attrs)
+        entity._refresh_updated_objects_(attrs)
         return cursor.rowcount
     @cut_traceback
     def __len__(query):
@@ -5345,7 +6595,7 @@ class Query(object):
         elif type(func) is types.FunctionType:
             argnames = get_lambda_args(func)
             subquery = prev_translator.subquery
-            func_id = id(func.func_code if PY2 else func.__code__)
+            func_id = get_code_key(func.func_code if PY2 else func.__code__)
             func_ast, external_names, cells = decompile(func)
         elif not order_by: throw(TypeError,
             'Argument of filter() method must be a lambda functon or its text. Got: %r' % func)
@@ -5359,12 +6609,13 @@ class Query(object):
                                  'Expected: %d, got: %d' % (expr_count, len(argnames)))
 
         filter_num = len(query._filters) + 1
-        extractors, varnames, func_ast, pretranslator_key = create_extractors(
+        extractors, varnames, func_ast, pretranslator_key, list_keys = create_extractors(
             func_id, func_ast, filter_num, globals, locals, special_functions, const_functions,
             argnames or prev_translator.subquery)
         if extractors:
             vars, vartypes = extract_vars(extractors, globals, locals, cells)
             query._database.provider.normalize_vars(vars, vartypes)
+            query._database.provider.normalize_in_lists(vars, vartypes, list_keys)
             new_query_vars = query._vars.copy()
             new_query_vars.update(vars)
             sorted_vartypes = tuple(vartypes[name] for name in varnames)
@@ -5388,7 +6639,8 @@ class Query(object):
                     new_translator = query._reapply_filters(new_translator)
                     new_translator = new_translator.apply_lambda(filter_num, order_by, func_ast, argnames, extractors, vartypes)
             query._database._translator_cache[new_key] = new_translator
-        return query._clone(_vars=new_query_vars, _key=new_key, _filters=new_filters, _translator=new_translator)
+        return query._clone(_vars=new_query_vars, _key=new_key, _filters=new_filters, _translator=new_translator,
+                            _list_keys=query._list_keys | list_keys)
     def _reapply_filters(query, translator):
         for i, tup in enumerate(query._filters):
             if not tup:
@@ -5471,14 +6723,104 @@ class Query(object):
         start = (pagenum - 1) * pagesize
         stop = pagenum * pagesize
         return query[start:stop]
+    def _get_seek_columns(query):
+        translator = query._translator
+        entity = translator.expr_type
+        if not isinstance(entity, EntityMeta): throw(TypeError,
+            'Keyset pagination is supported only for queries which return entity objects')
+        column_attrs = {}
+        for attr in entity._attrs_:
+            if attr.is_collection: continue
+            for j, column in enumerate(attr.columns): column_attrs.setdefault(column, (attr, j))
+        seek_columns = []
+        for item in translator.order:
+            is_desc = item[0] == 'DESC'
+            if is_desc: item = item[1]
+            if item[0] != 'COLUMN' or item[1] != translator.alias or item[2] not in column_attrs: throw(TypeError,
+                'Keyset pagination requires the query to be ordered by attributes of %s' % entity.__name__)
+            seek_columns.append((item[2], is_desc))
+        ordered_columns = set(column for column, is_desc in seek_columns)
+        for column in entity._pk_columns_:
+            if column not in ordered_columns: seek_columns.append((column, False))
+        return [ (column, is_desc) + column_attrs[column] for column, is_desc in seek_columns ]
+    def _get_seek_values(query, seek_columns, obj):
+        values = []
+        for column, is_desc, attr, j in seek_columns:
+            value = attr.__get__(obj)
+            if attr.reverse and value is not None: value = value._get_raw_pkval_()[j]
+            values.append(value)
+        return values
+    @cut_traceback
+    def get_page_cursor(query, obj):
+        seek_columns = query._get_seek_columns()
+        if not isinstance(obj, query._translator.expr_type): throw(TypeError,
+            'Expected instance of %s. Got: %r' % (query._translator.expr_type.__name__, obj))
+        return encode_page_cursor(query._get_seek_values(seek_columns, obj))
+    @cut_traceback
+    def page_after(query, after, pagesize=10):
+        return query._page_after_query(after)[:pagesize]
+    def _page_after_query(query, after):
+        if after is None: return query
+        seek_columns = query._get_seek_columns()
+        entity = query._translator.expr_type
+        if isinstance(after, Entity):
+            if not isinstance(after, entity): throw(TypeError,
+                'Expected instance of %s. Got: %r' % (entity.__name__, after))
+            values = query._get_seek_values(seek_columns, after)
+        elif isinstance(after, basestring): values = decode_page_cursor(after)
+        elif isinstance(after, tuple): values = after
+        else: values = (after,)
+        if len(values) != len(seek_columns): throw(ValueError,
+            'Pagination key must contain %d values, got %d' % (len(seek_columns), len(values)))
+        if None in values: throw(ValueError, 'Pagination key cannot contain None values')
+        next_id = query._next_kwarg_id
+        seek = []
+        new_vars = query._vars.copy()
+        for (column, is_desc, attr, j), value in izip(seek_columns, values):
+            seek.append((column, is_desc, next_id, attr.converters[j]))
+            new_vars[next_id] = value
+            next_id += 1
+        seek = tuple(seek)
+        new_key = query._key + ('page_after', tuple((column, is_desc, id) for column, is_desc, id, converter in seek))
+        new_translator = query._database._translator_cache.get(new_key)
+        if new_translator is None:
+            new_translator = query._translator.apply_seek(seek)
+            query._database._translator_cache[new_key] = new_translator
+        return query._clone(_key=new_key, _translator=new_translator, _next_kwarg_id=next_id, _vars=new_vars)
+    @cut_traceback
+    def batches(query, size=1000, commit=True, evict=True):
+        if not isinstance(size, int_types): throw(TypeError, 'Batch size must be integer. Got: %r' % size)
+        if size < 1: throw(ValueError, 'Batch size must be positive. Got: %d' % size)
+        if not isinstance(query._translator.expr_type, EntityMeta): throw(TypeError,
+            'batches() method is supported only for queries which return entity objects')
+        return query.order_by(None)._batches(size, commit, evict)
+    def _batches(query, size, commit, evict):
+        database = query._database
+        seek_columns = query._get_seek_columns()
+        after = None
+        while True:
+            # only objects which were loaded by the batch itself can be evicted
+            new_objects = [] if evict else None
+            batch = query._page_after_query(after)._fetch(range=(0, size), new_objects=new_objects)
+            if not batch: break
+            after = tuple(query._get_seek_values(seek_columns, batch[-1]))
+            yield batch
+            cache = database._get_cache()
+            if commit: cache.flush_and_commit()
+            if new_objects: cache.evict(new_objects)
+            if len(batch) < size: break
     def _aggregate(query, aggr_func_name):
         translator = query._translator
         sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments(aggr_func_name=aggr_func_name)
         cache = query._database._get_cache()
         try: result = cache.query_results[query_key]
         except KeyError:
-            cursor = query._database._exec_sql(sql, arguments)
-            row = cursor.fetchone()
+            if query._cached and query_key is not None:
+                rows = query._fetch_rows_from_shared_cache(sql, arguments, query_key)
+                row = rows[0] if rows else None
+            else:
+                cursor = query._database._exec_sql(sql, arguments)
+                row = cursor.fetchone()
             if row is not None: result = row[0]
             else: result = None
             if result is None and aggr_func_name == 'SUM': result = 0
@@ -5511,6 +6853,7 @@ class Query(object):
         provider = query._database.provider
         if nowait and not provider.select_for_update_nowait_syntax: throw(TranslationError,
             '%s provider does not support SELECT FOR UPDATE NOWAIT syntax' % provider.dialect)
+        if query._readonly: throw(TypeError, 'Read-only query cannot be used with for_update()')
         return query._clone(_for_update=True, _nowait=nowait)
     def random(query, limit):
         return query.order_by('random()')[:limit]
@@ -5523,6 +6866,95 @@ def strcut(s, width):
     else:
         return s[:width-3] + '...'
 
+def refers_to_names(node, names):
+    if isinstance(node, (ast.GenExpr, ast.Lambda)): return False  # their external names are extracted on each call
+    if isinstance(node, ast.Name): return node.name in names
+    for child in node.getChildNodes():
+        if refers_to_names(child, names): return True
+    return False
+
+class PreparedQuery(object):
+    def __init__(prepared, database, func):
+        code = func.func_code if PY2 else func.__code__
+        if code.co_flags & (CO_VARARGS | CO_VARKEYWORDS): throw(TypeError,
+            'Function passed to prepare() cannot accept *args or **kwargs')
+        prepared.database = database
+        prepared.func = func
+        prepared.argnames = argnames = code.co_varnames[:code.co_argcount]
+        prepared.freevars = code.co_freevars
+        prepared.closure = func.__closure__ or ()
+        prepared.globals = func.__globals__
+        body = None
+        if code.co_name == '<lambda>':
+            try: body = decompile(func)[0]
+            except (NotImplementedError, InvalidQuery): pass  # e.g. conditional expression
+        prepared._check_body(body)
+        prepared.extractors = None
+        prepared.list_keys = None
+        prepared.keys = None
+        prepared.templates = {}
+    def _check_body(prepared, node):
+        # Structure of the query should not depend on arguments, otherwise the template cannot be reused.
+        # Arguments can be used inside generators and lambdas only, where they are extracted on each call
+        if node is not None and isinstance(node, ast.CallFunc):
+            argnames = set(prepared.argnames)
+            while isinstance(node, ast.CallFunc):
+                for arg in chain(node.args, (node.star_args, node.dstar_args)):
+                    if arg is not None and refers_to_names(arg, argnames): break
+                else:
+                    node = node.node
+                    if isinstance(node, ast.Getattr): node = node.expr
+                    continue
+                break
+            else:
+                if not refers_to_names(node, argnames): return
+        throw(TypeError, 'Argument of prepare() must be a lambda which returns a query, '
+                         'and its arguments can be used inside of generators and lambdas only')
+    def _bind_args(prepared, args, kwargs):
+        argnames = prepared.argnames
+        if not kwargs and len(args) == len(argnames): argvalues = dict(izip(argnames, args))
+        else: argvalues = getcallargs(prepared.func, *args, **kwargs)
+        locals = dict((name, cell.cell_contents) for name, cell in izip(prepared.freevars, prepared.closure))
+        locals.update(argvalues)
+        return locals
+    def _make_template(prepared, args, kwargs):
+        query = prepared.func(*args, **kwargs)
+        if not isinstance(query, Query): throw(TypeError,
+            'Function passed to prepare() must return a query. Got: %r' % query)
+        if query._database is not prepared.database: throw(TypeError,
+            'Query returned by prepared function belongs to another database')
+        for tup in query._filters:
+            if len(tup) == 1: throw(TypeError,
+                'Keyword arguments of filter() method are not supported in prepared queries, use lambda instead')
+        if prepared.extractors is None:
+            # all external values are extracted on each call, so changed globals and closure values are noticed
+            extractors = dict((key, code) for key, code in iteritems(query._translator.extractors)
+                              if key[1] != '.0')
+            prepared.extractors = extractors
+            prepared.list_keys = query._list_keys.intersection(extractors)
+            prepared.keys = sorted(extractors)
+        return query
+    @cut_traceback
+    def __call__(prepared, *args, **kwargs):
+        locals = prepared._bind_args(args, kwargs)
+        if prepared.extractors is None: query = prepared._make_template(args, kwargs)
+        else: query = None
+        vars, vartypes = extract_vars(prepared.extractors, prepared.globals, locals)
+        provider = prepared.database.provider
+        provider.normalize_vars(vars, vartypes)
+        provider.normalize_in_lists(vars, vartypes, prepared.list_keys)
+        types_key = tuple(vartypes[key] for key in prepared.keys)
+        if query is not None:
+            prepared.templates[types_key] = query
+            return query
+        template = prepared.templates.get(types_key)
+        if template is None:
+            template = prepared.templates[types_key] = prepared._make_template(args, kwargs)
+            return template
+        new_vars = template._vars.copy()
+        new_vars.update(vars)
+        return template._clone(_vars=new_vars)
+
 class QueryResult(list):
     __slots__ = '_query', '_expr_type', '_col_names'
     def __init__(result, list, query, expr_type, col_names):
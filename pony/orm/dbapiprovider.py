@@ -1,7 +1,9 @@
 from __future__ import absolute_import, print_function, division
-from pony.py23compat import PY2, basestring, unicode, buffer, int_types
+from pony.py23compat import PY2, basestring, unicode, buffer, int_types, itervalues
 
 import os, re, json
+from threading import Condition, Lock
+import time as _time
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, date, time, timedelta
 from uuid import uuid4, UUID
@@ -74,16 +76,29 @@ def get_version_tuple(s):
         return tuple(int(component) for component in components)
     return None
 
+shared_pool_options = 'max_size', 'min_size', 'timeout', 'max_idle', 'max_lifetime'
+
 class DBAPIProvider(object):
     paramstyle = 'qmark'
     quote_char = '"'
     max_params_count = 200
+    max_in_list_padding = 512  # SQLite < 3.32 allows 999 params per query, Oracle allows 1000 items per IN list
     max_name_len = 128
     table_if_not_exists_syntax = True
     index_if_not_exists_syntax = True
     max_time_precision = default_time_precision = 6
     uint64_support = False
     select_for_update_nowait_syntax = True
+    immediate_after_commit = True
+    streaming_requires_transaction = False
+    streaming_blocks_connection = False  # no other queries can run until the stream is read
+    insert_returning_syntax = False  # multi-row INSERT ... RETURNING returns auto-generated ids
+    bulk_insert_mode = 'executemany'  # or 'multirow' for multi-row INSERT statements, or 'copy' for copy_rows()
+    upsert_syntax = False  # the UPSERT node of the SQL builder is supported
+
+    # types of values which the driver returns already converted to Python objects;
+    # with trusted_driver_types=True option, such values are not checked during object loading
+    native_driver_types = frozenset()
 
     # SQLite and PostgreSQL does not limit varchar max length.
     varchar_default_max_len = None
@@ -100,12 +115,17 @@ class DBAPIProvider(object):
     fk_types = { 'SERIAL' : 'INTEGER', 'BIGSERIAL' : 'BIGINT' }
 
     def __init__(provider, *args, **kwargs):
+        provider.trusted_driver_types = bool(kwargs.pop('trusted_driver_types', False))
         pool_mockup = kwargs.pop('pony_pool_mockup', None)
+        pool_options = dict((option, kwargs.pop('pool_' + option)) for option in shared_pool_options
+                            if 'pool_' + option in kwargs)
         if pool_mockup: provider.pool = pool_mockup
         else: provider.pool = provider.get_pool(*args, **kwargs)
+        if pool_options: provider.pool = provider.get_shared_pool(provider.pool, **pool_options)
         connection = provider.connect()
         provider.inspect_connection(connection)
         provider.release(connection)
+        if pool_options: provider.pool.fill()
 
     @wrap_dbapi_exceptions
     def inspect_connection(provider, connection):
@@ -179,6 +199,23 @@ class DBAPIProvider(object):
     def normalize_vars(provider, vars, vartypes):
         pass
 
+    def normalize_in_lists(provider, vars, vartypes, keys):
+        # pad IN lists to power-of-two sizes, so that lists of similar length share the same SQL
+        core = pony.orm.core
+        for key in keys:
+            t = vartypes[key]
+            if type(t) is not tuple: continue
+            size = len(t)
+            padded_size = 1 << (size - 1).bit_length() if size > 1 else size
+            if padded_size == size: continue
+            item_type = t[0]
+            if any(x != item_type for x in t): continue
+            width = len(item_type._pk_columns_) if isinstance(item_type, core.EntityMeta) else 1
+            if padded_size * width > provider.max_in_list_padding: continue
+            value = vars[key]
+            vars[key] = value + (value[-1],) * (padded_size - size)
+            vartypes[key] = t + (item_type,) * (padded_size - size)
+
     def ast2sql(provider, ast):
         builder = provider.sqlbuilder_cls(provider, ast)
         return builder.sql, builder.adapter
@@ -186,6 +223,9 @@ class DBAPIProvider(object):
     def should_reconnect(provider, exc):
         return False
 
+    def affects_session_state(provider, sql):
+        return False
+
     @wrap_dbapi_exceptions
     def connect(provider):
         return provider.pool.connect()
@@ -230,6 +270,9 @@ class DBAPIProvider(object):
         if core.debug: core.log_orm('DISCONNECT')
         provider.pool.disconnect()
 
+    def get_streaming_cursor(provider, connection):
+        return connection.cursor()
+
     @wrap_dbapi_exceptions
     def execute(provider, cursor, sql, arguments=None, returning_id=False):
         if type(arguments) is list:
@@ -240,6 +283,9 @@ class DBAPIProvider(object):
             else: cursor.execute(sql, arguments)
             if returning_id: return cursor.lastrowid
 
+    def copy_rows(provider, cursor, table_name, column_names, rows):
+        throw(NotImplementedError)
+
     converter_classes = []
 
     def _get_converter_type_by_py_type(provider, py_type):
@@ -262,6 +308,9 @@ class DBAPIProvider(object):
     def get_pool(provider, *args, **kwargs):
         return Pool(provider.dbapi_module, *args, **kwargs)
 
+    def get_shared_pool(provider, pool, **options):
+        return SharedPool(pool, **options)
+
     def table_exists(provider, connection, table_name, case_sensitive=True):
         throw(NotImplementedError)
 
@@ -304,15 +353,17 @@ class Pool(localbase):
         core = pony.orm.core
         if pool.con is None:
             if core.debug: core.log_orm('GET NEW CONNECTION')
-            pool._connect()
+            pool.con = pool._connect()
             pool.pid = pid
         elif core.debug: core.log_orm('GET CONNECTION FROM THE LOCAL POOL')
         return pool.con
     def _connect(pool):
-        pool.con = pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+        return pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+    def _reset(pool, con):
+        con.rollback()
     def release(pool, con):
         assert con is pool.con
-        try: con.rollback()
+        try: pool._reset(con)
         except:
             pool.drop(con)
             raise
@@ -325,6 +376,179 @@ class Pool(localbase):
         pool.con = None
         if con is not None: con.close()
 
+class PoolTimeoutError(OperationalError):
+    def __init__(exc, *args):
+        OperationalError.__init__(exc, None, *args)
+
+class PoolStats(object):
+    def __init__(stats):
+        stats.created = stats.dropped = stats.checkouts = 0
+        stats.waits = stats.timeouts = 0
+        stats.wait_time = stats.max_wait_time = 0.0
+        stats.size = stats.in_use = stats.idle = 0
+    def copy(stats):
+        result = object.__new__(PoolStats)
+        result.__dict__.update(stats.__dict__)
+        return result
+    def __repr__(stats):
+        return '<PoolStats %s>' % ', '.join('%s=%r' % item for item in sorted(stats.__dict__.items()))
+
+class SharedPool(object):
+    def __init__(pool, factory, max_size=10, min_size=0, timeout=30.0, max_idle=None, max_lifetime=None):
+        if max_size < 1: throw(ValueError, 'Maximum pool size must be positive. Got: %r' % max_size)
+        if not 0 <= min_size <= max_size: throw(ValueError,
+            'Minimum pool size must be between 0 and %d. Got: %r' % (max_size, min_size))
+        pool.factory = factory  # a thread-local pool instance which knows how to open and reset connections
+        pool.max_size = max_size
+        pool.min_size = min_size
+        pool.timeout = timeout
+        pool.max_idle = max_idle
+        pool.max_lifetime = max_lifetime
+        pool.lock = Condition(Lock())
+        pool.idle = []  # (con, created, last_used) items, the most recently used connection is the last one
+        pool.in_use = {}  # id(con) -> (con, created)
+        pool.size = 0  # open connections plus connections which are being opened right now
+        pool.pid = os.getpid()
+        pool._stats = PoolStats()
+    def _check_fork(pool):
+        pid = os.getpid()
+        if pool.pid == pid: return
+        forked_connections = Pool.forked_connections
+        for con, created, last_used in pool.idle: forked_connections.append((con, pool.pid))
+        for con, created in itervalues(pool.in_use): forked_connections.append((con, pool.pid))
+        pool.idle = []
+        pool.in_use = {}
+        pool.size = 0
+        pool.pid = pid
+    def _is_expired(pool, created, last_used, now):
+        if pool.max_lifetime is not None and now - created >= pool.max_lifetime: return True
+        if pool.max_idle is not None and now - last_used >= pool.max_idle: return True
+        return False
+    def _evict(pool, now, to_close):
+        idle = pool.idle
+        if not idle or pool.max_idle is None and pool.max_lifetime is None: return
+        alive = []
+        for item in idle:
+            con, created, last_used = item
+            if pool.size > pool.min_size and pool._is_expired(created, last_used, now):
+                pool.size -= 1
+                pool._stats.dropped += 1
+                to_close.append(con)
+            else: alive.append(item)
+        pool.idle = alive
+    def _close(pool, connections):
+        for con in connections:
+            try: con.close()
+            except: pass
+    def connect(pool):
+        core = pony.orm.core
+        start = now = _time.time()
+        deadline = None
+        to_close = []
+        try:
+            with pool.lock:
+                pool._check_fork()
+                while True:
+                    pool._evict(now, to_close)
+                    if pool.idle:
+                        con, created, last_used = pool.idle.pop()
+                        pool.in_use[id(con)] = con, created
+                        pool._register_checkout(start, now)
+                        if core.debug: core.log_orm('GET CONNECTION FROM THE SHARED POOL')
+                        return con
+                    if pool.size < pool.max_size:
+                        pool.size += 1
+                        pool._register_checkout(start, now)
+                        break
+                    if deadline is None:
+                        deadline = start + pool.timeout
+                        pool._stats.waits += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        pool._stats.timeouts += 1
+                        throw(PoolTimeoutError, 'Cannot get a connection from the pool within %s seconds '
+                                                '(all %d connections are in use)' % (pool.timeout, pool.max_size))
+                    pool.lock.wait(remaining)
+                    now = _time.time()
+        finally: pool._close(to_close)
+        if core.debug: core.log_orm('GET NEW CONNECTION')
+        try: con = pool.factory._connect()
+        except:
+            with pool.lock:
+                pool.size -= 1
+                pool.lock.notify()
+            raise
+        with pool.lock:
+            pool.in_use[id(con)] = con, _time.time()
+            pool._stats.created += 1
+        return con
+    def _register_checkout(pool, start, now):
+        stats = pool._stats
+        stats.checkouts += 1
+        wait_time = now - start
+        stats.wait_time += wait_time
+        if wait_time > stats.max_wait_time: stats.max_wait_time = wait_time
+    def fill(pool):
+        core = pony.orm.core
+        while True:
+            with pool.lock:
+                pool._check_fork()
+                if pool.size >= pool.min_size: return
+                pool.size += 1
+            if core.debug: core.log_orm('GET NEW CONNECTION')
+            try: con = pool.factory._connect()
+            except:
+                with pool.lock: pool.size -= 1
+                raise
+            now = _time.time()
+            with pool.lock:
+                pool._stats.created += 1
+                pool.idle.insert(0, (con, now, now))
+                pool.lock.notify()
+    def release(pool, con):
+        try: pool.factory._reset(con)
+        except:
+            pool.drop(con)
+            raise
+        now = _time.time()
+        with pool.lock:
+            pool._check_fork()
+            item = pool.in_use.pop(id(con), None)
+            if item is None: return  # connection was inherited from the parent process
+            created = item[1]
+            if pool.max_lifetime is not None and now - created >= pool.max_lifetime:
+                pool.size -= 1
+                pool._stats.dropped += 1
+            else:
+                pool.idle.append((con, created, now))
+                con = None
+            pool.lock.notify()
+        if con is not None: pool._close([ con ])
+    def drop(pool, con):
+        with pool.lock:
+            pool._check_fork()
+            if pool.in_use.pop(id(con), None) is not None:
+                pool.size -= 1
+                pool._stats.dropped += 1
+                pool.lock.notify()
+        con.close()
+    def disconnect(pool):
+        with pool.lock:
+            pool._check_fork()
+            to_close = [ con for con, created, last_used in pool.idle ]
+            pool.idle = []
+            pool.size -= len(to_close)
+            pool._stats.dropped += len(to_close)
+            pool.lock.notify_all()
+        pool._close(to_close)
+    def get_stats(pool):
+        with pool.lock:
+            stats = pool._stats.copy()
+            stats.size = pool.size
+            stats.in_use = len(pool.in_use)
+            stats.idle = len(pool.idle)
+        return stats
+
 class Converter(object):
     EQ = 'EQ'
     NE = 'NE'
@@ -16,6 +16,7 @@ try:
     from MySQLdb import string_literal
     import MySQLdb.converters as mysql_converters
     from MySQLdb.constants import FIELD_TYPE, FLAG, CLIENT
+    from MySQLdb.cursors import SSCursor
     mysql_module_name = 'MySQLdb'
 except ImportError:
     try:
@@ -25,6 +26,7 @@ except ImportError:
     from pymysql.converters import escape_str as string_literal
     import pymysql.converters as mysql_converters
     from pymysql.constants import FIELD_TYPE, FLAG, CLIENT
+    from pymysql.cursors import SSCursor
     mysql_module_name = 'pymysql'
 
 from pony.orm import core, dbschema, dbapiprovider, ormtypes, sqltranslation
@@ -49,6 +51,18 @@ class MySQLTranslator(SQLTranslator):
 
 class MySQLBuilder(SQLBuilder):
     dialect = 'MySQL'
+    def UPSERT(builder, table_name, columns, rows, key_columns, update_columns, returning=None):
+        assert returning is None
+        quote_name = builder.quote_name
+        if not update_columns: update_columns = key_columns[:1]
+        return builder.INSERT_MANY(table_name, columns, rows), ' ON DUPLICATE KEY UPDATE ', \
+               join(', ', [ (quote_name(column), ' = VALUES(', quote_name(column), ')') for column in update_columns ])
+    def UPDATE_JOIN(builder, from_ast, pairs, where=None):
+        builder.indent += 1
+        tables = builder(from_ast)[2:]  # without indentation and FROM keyword
+        return [ 'UPDATE ', tables, '\nSET ',
+                 join(', ', [ (builder(column), ' = ', builder(expr)) for column, expr in pairs ]),
+                 where and [ '\n', builder(where) ] or [] ]
     def CONCAT(builder, *args):
         return 'concat(',  join(', ', imap(builder, args)), ')'
     def TRIM(builder, expr, chars=None):
@@ -180,6 +194,11 @@ class MySQLProvider(DBAPIProvider):
     max_time_precision = default_time_precision = 0
     varchar_default_max_len = 255
     uint64_support = True
+    bulk_insert_mode = 'multirow'
+    upsert_syntax = True
+    streaming_blocks_connection = True
+
+    native_driver_types = frozenset(int_types + (float, Decimal, date, datetime))
 
     dbapi_module = mysql_module
     dbschema_cls = MySQLSchema
@@ -285,6 +304,10 @@ class MySQLProvider(DBAPIProvider):
                     raise
         DBAPIProvider.release(provider, connection, cache)
 
+    def get_streaming_cursor(provider, connection):
+        # unbuffered cursor: rows are read from the socket by fetchmany(),
+        # the connection cannot execute other queries until all rows are read
+        return connection.cursor(SSCursor)
 
     def table_exists(provider, connection, table_name, case_sensitive=True):
         db_name, table_name = provider.split_table_name(table_name)
@@ -1,5 +1,5 @@
 from __future__ import absolute_import
-from pony.py23compat import PY2, iteritems, basestring, unicode, buffer, int_types
+from pony.py23compat import PY2, izip, iteritems, basestring, unicode, buffer, int_types
 
 import os
 os.environ["NLS_LANG"] = "AMERICAN_AMERICA.UTF8"
@@ -15,7 +15,7 @@ from pony.orm import core, dbapiprovider, sqltranslation
 from pony.orm.core import log_orm, log_sql, DatabaseError, TranslationError
 from pony.orm.dbschema import DBSchema, DBObject, Table, Column
 from pony.orm.ormtypes import Json
-from pony.orm.sqlbuilding import SQLBuilder, Value
+from pony.orm.sqlbuilding import SQLBuilder, Value, join
 from pony.orm.dbapiprovider import DBAPIProvider, wrap_dbapi_exceptions, get_version_tuple
 from pony.utils import throw, is_ident
 from pony.converting import timedelta2str
@@ -136,6 +136,20 @@ class OraBuilder(SQLBuilder):
         if returning is not None:
             result.extend((' RETURNING ', builder.quote_name(returning), ' INTO :new_id'))
         return result
+    def UPSERT(builder, table_name, columns, rows, key_columns, update_columns, returning=None):
+        assert returning is None
+        quote_name = builder.quote_name
+        source = join(' UNION ALL ', [ ('SELECT ', join(', ', [ (builder(value), ' ', quote_name(column))
+                                                                for value, column in izip(row, columns) ]), ' FROM DUAL')
+                                       for row in rows ])
+        result = [ 'MERGE INTO ', quote_name(table_name), ' t USING (', source, ') s ON (',
+                   join(' AND ', [ ('t.', quote_name(column), ' = s.', quote_name(column)) for column in key_columns ]),
+                   ')' ]
+        if update_columns: result.extend([ ' WHEN MATCHED THEN UPDATE SET ', join(', ', [
+            ('t.', quote_name(column), ' = s.', quote_name(column)) for column in update_columns ]) ])
+        result.extend([ ' WHEN NOT MATCHED THEN INSERT (', join(', ', [ quote_name(column) for column in columns ]),
+                        ') VALUES (', join(', ', [ ('s.', quote_name(column)) for column in columns ]), ')' ])
+        return result
     def SELECT_FOR_UPDATE(builder, nowait, *sections):
         assert not builder.indent
         last_section = sections[-1]
@@ -383,6 +397,7 @@ class OraProvider(DBAPIProvider):
     index_if_not_exists_syntax = False
     varchar_default_max_len = 1000
     uint64_support = True
+    upsert_syntax = True
 
     dbapi_module = cx_Oracle
     dbschema_cls = OraSchema
@@ -487,6 +502,10 @@ class OraProvider(DBAPIProvider):
         kwargs.setdefault('increment', 1)
         return OraPool(**kwargs)
 
+    def get_shared_pool(provider, pool, **options):
+        throw(TypeError, 'Oracle provider always uses cx_Oracle session pool. '
+                         'Use min, max and increment options to configure it')
+
     def table_exists(provider, connection, table_name, case_sensitive=True):
         owner_name, table_name = provider.split_table_name(table_name)
         cursor = connection.cursor()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+from pony.py23compat import PY2, unicode, buffer
+
+import re
+from binascii import hexlify
+from datetime import timedelta
+
+from pony.converting import timedelta2str
+from pony.orm import core
+
+# Helpers of PostgreSQL provider which do not depend on psycopg2
+
+session_state_re = re.compile(r"""
+    ^\s*(?: (?:SET|RESET)\s+(?!LOCAL\b|TRANSACTION\b|CONSTRAINTS?\b)
+        | CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?TEMP(?:ORARY)?\b
+        | (?:PREPARE|DEALLOCATE|DECLARE|LISTEN|UNLISTEN|LOAD)\b )
+    | \b(?:set_config|pg_advisory_lock|pg_advisory_lock_shared)\s*\(
+    """, re.IGNORECASE | re.VERBOSE)
+
+reset_strategies = 'auto', 'discard', 'rollback'
+
+def affects_session_state(sql):
+    return session_state_re.search(sql) is not None
+
+def must_discard_session_state(reset_on_release, cache):
+    if cache is None: return reset_on_release == 'discard'
+    db_session = cache.db_session
+    if db_session is not None and db_session.ddl: return False  # connection will be closed anyway
+    if reset_on_release == 'discard': return True
+    return reset_on_release == 'auto' and cache.session_state_changed
+
+preparable_re = re.compile(r'^\s*(?:SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+deallocate_re = re.compile(r'^\s*(?:DEALLOCATE\s+(?:PREPARE\s+)?(?:ALL\b|"([^"]+)"|(\w+))|DISCARD\s+ALL\b)',
+                           re.IGNORECASE)
+pyformat_param_re = re.compile(r'%\(([^)]+)\)s|%%')
+
+def make_prepared_statement(name, sql):
+    param_names = []
+    def replace(match):
+        param_name = match.group(1)
+        if param_name is None: return '%'
+        if param_name not in param_names: param_names.append(param_name)
+        return '$%d' % (param_names.index(param_name) + 1)
+    prepare_sql = 'PREPARE %s AS %s' % (name, pyformat_param_re.sub(replace, sql))
+    if not param_names: return prepare_sql, 'EXECUTE %s' % name
+    execute_sql = 'EXECUTE %s(%s)' % (name, ', '.join('%%(%s)s' % param_name for param_name in param_names))
+    return prepare_sql, execute_sql
+
+class PreparedStatements(object):
+    # statements prepared on one connection, they survive between db_sessions
+    error_class = Exception
+    def __init__(statements):
+        statements.sql_cache = {}  # sql -> EXECUTE statement, or sql itself if it cannot be prepared
+        statements.names = {}  # name -> sql
+        statements.counts = {}  # sql -> number of executions before the statement is prepared
+        statements.last_id = 0  # names are not reused, statements deallocated by name may still exist
+    def in_transaction(statements, connection):
+        raise NotImplementedError
+    def deallocate(statements, name=None):
+        if name is None:
+            statements.sql_cache.clear()
+            statements.names.clear()
+            statements.counts.clear()
+            return
+        sql = statements.names.pop(name, None)
+        if sql is not None: del statements.sql_cache[sql]
+    def get_sql(statements, cursor, sql, arguments, threshold, max_count):
+        execute_sql = statements.sql_cache.get(sql)
+        if execute_sql is not None: return execute_sql
+        match = deallocate_re.match(sql)
+        if match is not None:
+            quoted_name, name = match.groups()
+            if quoted_name is not None: statements.deallocate(quoted_name)
+            elif name is not None: statements.deallocate(name.lower())
+            else: statements.deallocate()
+            return sql
+        if arguments is None or not preparable_re.match(sql): return sql
+        counts = statements.counts
+        count = counts.get(sql, 0) + 1
+        if count <= threshold or len(statements.names) >= max_count:
+            if len(counts) >= 10 * max_count: counts.clear()
+            counts[sql] = count
+            return sql
+        counts.pop(sql, None)
+        statements.last_id += 1
+        name = 'pony_%d' % statements.last_id
+        prepare_sql, execute_sql = make_prepared_statement(name, sql)
+        connection = cursor.connection
+        in_transaction = statements.in_transaction(connection)
+        if in_transaction: cursor.execute('SAVEPOINT pony_prepare')
+        if core.debug: core.log_orm(prepare_sql)
+        try: cursor.execute(prepare_sql)
+        except statements.error_class:  # e.g. types of parameters cannot be inferred
+            if in_transaction: cursor.execute('ROLLBACK TO SAVEPOINT pony_prepare')
+            elif not connection.autocommit: connection.rollback()
+            statements.sql_cache[sql] = sql  # do not try to prepare it again
+            return sql
+        if in_transaction: cursor.execute('RELEASE SAVEPOINT pony_prepare')
+        statements.names[name] = sql
+        statements.sql_cache[sql] = execute_sql
+        return execute_sql
+
+copy_escapes = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+copy_escape_re = re.compile(r'[\\\t\n\r]')
+
+def copy_text(value):
+    # formats a value for the text format of COPY
+    if value is None: return '\\N'
+    t = type(value)
+    if t is bool: return 't' if value else 'f'
+    if t is buffer: value = '\\x' + hexlify(value).decode('ascii')
+    elif PY2 and t is str: value = value.decode('utf8')
+    elif t is timedelta: value = timedelta2str(value)
+    elif t is float: value = repr(value)
+    else: value = unicode(value)
+    return copy_escape_re.sub(lambda match: copy_escapes[match.group()], value)
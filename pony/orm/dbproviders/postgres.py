@@ -1,6 +1,8 @@
 from __future__ import absolute_import
-from pony.py23compat import PY2, basestring, unicode, buffer, int_types
+from pony.py23compat import PY2, imap, basestring, unicode, buffer, int_types
 
+import itertools
+from io import BytesIO, StringIO
 from decimal import Decimal
 from datetime import datetime, date, time, timedelta
 from uuid import UUID
@@ -22,10 +24,12 @@ psycopg2.extras.register_default_jsonb(loads=lambda x: x)
 from pony.orm import core, dbschema, dbapiprovider, sqltranslation, ormtypes
 from pony.orm.core import log_orm
 from pony.orm.dbapiprovider import DBAPIProvider, Pool, wrap_dbapi_exceptions
+from pony.orm.ormtypes import ArrayParamType
+from pony.orm.dbproviders import pgutils
 from pony.orm.sqltranslation import SQLTranslator
 from pony.orm.sqlbuilding import Value, SQLBuilder
 from pony.converting import timedelta2str
-from pony.utils import is_ident
+from pony.utils import is_ident, throw
 
 NoneType = type(None)
 
@@ -105,6 +109,10 @@ class PGSQLBuilder(SQLBuilder):
         return (builder.JSON_QUERY(expr, path) if path else builder(expr)), ' ? ', builder(key)
     def JSON_ARRAY_LENGTH(builder, value):
         return 'jsonb_array_length(', builder(value), ')'
+    def IN_ARRAY(builder, expr1, param):
+        return builder(expr1), ' = ANY(', builder(param), ')'
+    def NOT_IN_ARRAY(builder, expr1, param):
+        return builder(expr1), ' <> ALL(', builder(param), ')'
 
 class PGStrConverter(dbapiprovider.StrConverter):
     if PY2:
@@ -140,22 +148,30 @@ class PGJsonConverter(dbapiprovider.JsonConverter):
     def sql_type(self):
         return "JSONB"
 
+class PGPreparedStatements(pgutils.PreparedStatements):
+    error_class = psycopg2.DatabaseError
+    def in_transaction(statements, connection):
+        return connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+
+class PGConnection(extensions.connection):
+    def __init__(con, *args, **kwargs):
+        extensions.connection.__init__(con, *args, **kwargs)
+        con.prepared_statements = PGPreparedStatements()
+
 class PGPool(Pool):
     def _connect(pool):
-        pool.con = pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+        kwargs = pool.kwargs
+        if 'connection_factory' not in kwargs: kwargs = dict(kwargs, connection_factory=PGConnection)
+        con = pool.dbapi_module.connect(*pool.args, **kwargs)
         if 'client_encoding' not in pool.kwargs:
-            pool.con.set_client_encoding('UTF8')
-    def release(pool, con):
-        assert con is pool.con
-        try:
-            con.rollback()
-            con.autocommit = True
-            cursor = con.cursor()
-            cursor.execute('DISCARD ALL')
-            con.autocommit = False
-        except:
-            pool.drop(con)
-            raise
+            con.set_client_encoding('UTF8')
+        return con
+    def _reset(pool, con):
+        if con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE: con.rollback()
+
+array_item_types = int, float, Decimal, unicode, date, datetime, UUID
+
+stream_counter = itertools.count(1)
 
 class PGProvider(DBAPIProvider):
     dialect = 'PostgreSQL'
@@ -172,6 +188,28 @@ class PGProvider(DBAPIProvider):
 
     fk_types = { 'SERIAL' : 'INTEGER', 'BIGSERIAL' : 'BIGINT' }
 
+    native_driver_types = frozenset(int_types + (float, bool, Decimal, date, time, timedelta, datetime))
+
+    max_prepared_statements = 500
+    insert_returning_syntax = True
+    bulk_insert_mode = 'copy'
+    upsert_syntax = True
+
+    # named cursors live until the end of the transaction
+    streaming_requires_transaction = True
+
+    def __init__(provider, *args, **kwargs):
+        reset_on_release = kwargs.pop('reset_on_release', 'auto')
+        if reset_on_release not in pgutils.reset_strategies: throw(ValueError,
+            'Invalid value of reset_on_release option: %r. Expected one of: %s'
+            % (reset_on_release, ', '.join(pgutils.reset_strategies)))
+        provider.reset_on_release = reset_on_release
+        prepare_threshold = kwargs.pop('prepare_threshold', None)
+        if prepare_threshold is not None and (not isinstance(prepare_threshold, int_types) or prepare_threshold < 0):
+            throw(ValueError, 'prepare_threshold must be a non-negative integer. Got: %r' % prepare_threshold)
+        provider.prepare_threshold = prepare_threshold
+        DBAPIProvider.__init__(provider, *args, **kwargs)
+
     def normalize_name(provider, name):
         return name[:provider.max_name_len].lower()
 
@@ -205,6 +243,53 @@ class PGProvider(DBAPIProvider):
         if db_session is not None and (db_session.serializable or db_session.ddl):
             cache.in_transaction = True
 
+    def normalize_in_lists(provider, vars, vartypes, keys):
+        # lists of scalar values are passed as a single array parameter
+        other_keys = []
+        for key in keys:
+            t = vartypes[key]
+            if type(t) is tuple and t and t[0] in array_item_types and all(x is t[0] for x in t):
+                vartypes[key] = ArrayParamType(t[0])
+            else: other_keys.append(key)
+        DBAPIProvider.normalize_in_lists(provider, vars, vartypes, other_keys)
+
+    def affects_session_state(provider, sql):
+        return pgutils.affects_session_state(sql)
+
+    @wrap_dbapi_exceptions
+    def release(provider, connection, cache=None):
+        if pgutils.must_discard_session_state(provider.reset_on_release, cache):
+            try: provider.discard_session_state(connection)
+            except:
+                provider.pool.drop(connection)
+                raise
+        DBAPIProvider.release(provider, connection, cache)
+
+    def discard_session_state(provider, connection):
+        connection.rollback()
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        cursor = connection.cursor()
+        statements = getattr(connection, 'prepared_statements', None)
+        if statements is not None and statements.names:
+            # DISCARD ALL without DEALLOCATE ALL, so statements prepared by Pony survive the reset
+            cursor.execute("SELECT name FROM pg_prepared_statements WHERE name NOT LIKE 'pony\\_%'")
+            sql = ''.join('DEALLOCATE %s; ' % provider.quote_name(name) for name, in cursor.fetchall())
+            sql += 'CLOSE ALL; SET SESSION AUTHORIZATION DEFAULT; RESET ALL; UNLISTEN *; ' \
+                   'SELECT pg_advisory_unlock_all(); DISCARD TEMP; DISCARD SEQUENCES'
+        else: sql = 'DISCARD ALL'
+        if core.debug: log_orm(sql)
+        cursor.execute(sql)
+        connection.autocommit = autocommit
+
+    def get_streaming_cursor(provider, connection):
+        return connection.cursor('pony_stream_%d' % next(stream_counter))
+
+    def get_prepared_sql(provider, cursor, sql, arguments):
+        statements = getattr(cursor.connection, 'prepared_statements', None)
+        if statements is None: return sql
+        return statements.get_sql(cursor, sql, arguments, provider.prepare_threshold, provider.max_prepared_statements)
+
     @wrap_dbapi_exceptions
     def execute(provider, cursor, sql, arguments=None, returning_id=False):
         if PY2 and isinstance(sql, unicode): sql = sql.encode('utf8')
@@ -212,10 +297,20 @@ class PGProvider(DBAPIProvider):
             assert arguments and not returning_id
             cursor.executemany(sql, arguments)
         else:
+            if provider.prepare_threshold is not None and cursor.name is None:
+                sql = provider.get_prepared_sql(cursor, sql, arguments)
             if arguments is None: cursor.execute(sql)
             else: cursor.execute(sql, arguments)
             if returning_id: return cursor.fetchone()[0]
 
+    @wrap_dbapi_exceptions
+    def copy_rows(provider, cursor, table_name, column_names, rows):
+        sql = 'COPY %s (%s) FROM STDIN' % (provider.quote_name(table_name),
+                                           ', '.join(imap(provider.quote_name, column_names)))
+        data = ''.join('\t'.join(imap(pgutils.copy_text, row)) + '\n' for row in rows)
+        cursor.copy_expert(sql, BytesIO(data.encode('utf8')) if PY2 else StringIO(data))
+        return sql
+
     def table_exists(provider, connection, table_name, case_sensitive=True):
         schema_name, table_name = provider.split_table_name(table_name)
         cursor = connection.cursor()
@@ -232,6 +232,14 @@ class SQLiteProvider(DBAPIProvider):
     name_before_table = 'db_name'
 
     server_version = sqlite.sqlite_version_info
+    insert_returning_syntax = sqlite.sqlite_version_info >= (3, 35)
+    upsert_syntax = sqlite.sqlite_version_info >= (3, 24)
+
+    # read-only queries after commit() are executed in autocommit mode
+    # and do not acquire transaction_lock until the next write
+    immediate_after_commit = False
+
+    native_driver_types = frozenset(int_types + (float,))
 
     converter_classes = [
         (NoneType, dbapiprovider.NoneConverter),
@@ -321,7 +329,7 @@ class SQLiteProvider(DBAPIProvider):
                     raise
         DBAPIProvider.release(provider, connection, cache)
 
-    def get_pool(provider, filename, create_db=False):
+    def get_pool(provider, filename, create_db=False, **pragmas):
         if filename != ':memory:':
             # When relative filename is specified, it is considered
             # not relative to cwd, but to user module where
@@ -337,7 +345,14 @@ class SQLiteProvider(DBAPIProvider):
             # 1 - SQLiteProvider.__init__()
             # 0 - pony.dbproviders.sqlite.get_pool()
             filename = absolutize_path(filename, frame_depth=7)
-        return SQLitePool(filename, create_db)
+        return SQLitePool(filename, create_db, make_pragmas(pragmas))
+
+    def get_shared_pool(provider, pool, **options):
+        if pool.filename == ':memory:': throw(TypeError,
+            'Shared connection pool cannot be used with in-memory SQLite database')
+        # connections of the shared pool are handed over between threads
+        pool = SQLitePool(pool.filename, pool.create_db, pool.pragmas, check_same_thread=False)
+        return DBAPIProvider.get_shared_pool(provider, pool, **options)
 
     def table_exists(provider, connection, table_name, case_sensitive=True):
         return provider._exists(connection, table_name, None, case_sensitive)
@@ -490,16 +505,40 @@ def py_json_array_length(expr, path=None):
         expr = _traverse(expr, keys)
     return len(expr) if type(expr) is list else 0
 
+journal_modes = set([ 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF' ])
+synchronous_modes = set([ 'OFF', 'NORMAL', 'FULL', 'EXTRA' ])
+
+def make_pragmas(options):
+    pragmas = []
+    for name in ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size'):
+        value = options.pop(name, None)
+        if value is None: continue
+        if name == 'journal_mode':
+            value = str(value).upper()
+            if value not in journal_modes: throw(ValueError, 'Invalid SQLite journal mode: %r' % value)
+        elif name == 'synchronous':
+            if isinstance(value, basestring): value = str(value).upper()
+            if value not in synchronous_modes and value not in (0, 1, 2, 3): throw(ValueError,
+                'Invalid SQLite synchronous mode: %r' % value)
+        elif not isinstance(value, int_types): throw(TypeError,
+            'Value of SQLite %s option must be integer. Got: %r' % (name, value))
+        pragmas.append('PRAGMA %s = %s' % (name, value))
+    if options: throw(TypeError, 'Unexpected SQLite option%s: %s'
+                                 % ('s' if len(options) > 1 else '', ', '.join(sorted(options))))
+    return tuple(pragmas)
+
 class SQLitePool(Pool):
-    def __init__(pool, filename, create_db): # called separately in each thread
+    def __init__(pool, filename, create_db, pragmas=(), check_same_thread=True): # called separately in each thread
         pool.filename = filename
         pool.create_db = create_db
+        pool.pragmas = pragmas
+        pool.check_same_thread = check_same_thread
         pool.con = None
     def _connect(pool):
         filename = pool.filename
         if filename != ':memory:' and not pool.create_db and not os.path.exists(filename):
             throw(IOError, "Database file is not found: %r" % filename)
-        pool.con = con = sqlite.connect(filename, isolation_level=None)
+        con = sqlite.connect(filename, isolation_level=None, check_same_thread=pool.check_same_thread)
         con.text_factory = _text_factory
         con.create_function('power', 2, pow)
         con.create_function('rand', 0, random)
@@ -513,6 +552,10 @@ class SQLitePool(Pool):
         con.create_function('py_lower', 1, py_lower)
         if sqlite.sqlite_version_info >= (3, 6, 19):
             con.execute('PRAGMA foreign_keys = true')
+        for sql in pool.pragmas:
+            if core.debug: log_orm(sql)
+            con.execute(sql)
+        return con
     def disconnect(pool):
         if pool.filename != ':memory:':
             Pool.disconnect(pool)
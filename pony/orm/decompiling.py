@@ -7,14 +7,30 @@ from opcode import hasconst, hasname, hasjrel, haslocal, hascompare, hasfree
 
 from pony.thirdparty.compiler import ast, parse
 
-from pony.utils import throw
+from pony.utils import throw, LRUCache
 
 ##ast.And.__repr__ = lambda self: "And(%s: %s)" % (getattr(self, 'endpos', '?'), repr(self.nodes),)
 ##ast.Or.__repr__ = lambda self: "Or(%s: %s)" % (getattr(self, 'endpos', '?'), repr(self.nodes),)
 
-ast_cache = {}
-
-codeobjects = {}
+ast_cache = LRUCache()
+
+class CodeKey(object):
+    # Hashing of a code object is expensive, so the key is hashed by the code location and id().
+    # The key references the code object, so the id cannot be reused while the cache entry is alive
+    __slots__ = 'code', 'hash'
+    def __init__(key, codeobject):
+        key.code = codeobject
+        key.hash = hash((codeobject.co_filename, codeobject.co_firstlineno, id(codeobject)))
+    def __hash__(key):
+        return key.hash
+    def __eq__(key, other):
+        return type(other) is CodeKey and other.code is key.code
+    def __ne__(key, other):
+        return not key.__eq__(other)
+    def __repr__(key):
+        return '<CodeKey %s:%d>' % (key.code.co_filename, key.code.co_firstlineno)
+
+get_code_key = CodeKey
 
 def decompile(x):
     cells = {}
@@ -28,10 +44,9 @@ def decompile(x):
         else:
             if x.__closure__: cells = dict(izip(codeobject.co_freevars, x.__closure__))
     else: throw(TypeError)
-    key = id(codeobject)
+    key = get_code_key(codeobject)
     result = ast_cache.get(key)
     if result is None:
-        codeobjects[key] = codeobject
         decompiler = Decompiler(codeobject)
         result = decompiler.ast, decompiler.external_names
         ast_cache[key] = result
@@ -33,6 +33,19 @@ class SetType(object):
     def __hash__(self):
         return hash(self.item_type) + 1
 
+class ArrayParamType(object):
+    __slots__ = 'item_type'
+    def __deepcopy__(self, memo):
+        return self  # ArrayParamType instances are "immutable"
+    def __init__(self, item_type):
+        self.item_type = item_type
+    def __eq__(self, other):
+        return type(other) is ArrayParamType and self.item_type == other.item_type
+    def __ne__(self, other):
+        return type(other) is not ArrayParamType or self.item_type != other.item_type
+    def __hash__(self):
+        return hash(self.item_type) + 2
+
 class FuncType(object):
     __slots__ = 'func'
     def __deepcopy__(self, memo):
@@ -220,6 +233,13 @@ def are_comparable_types(t1, t2, op='=='):
     if t1 is t2 and t1 in comparable_types: return True
     return (t1, t2) in coercions
 
+def are_assignable_types(t1, t2):
+    # can a value of type t2 be assigned to an attribute of type t1, types must be normalized already!
+    if t1 is t2 or t2 is NoneType or type(t2) is RawSQLType: return True
+    if not are_comparable_types(t1, t2): return False
+    if t1 is Json or type(t1).__name__ == 'EntityMeta': return True
+    return coerce_types(t1, t2) is t1
+
 class TrackedValue(object):
     def __init__(self, obj, attr):
         self.obj_ref = weakref.ref(obj)
@@ -0,0 +1,163 @@
+from __future__ import absolute_import, print_function, division
+from pony.py23compat import imap, iteritems, int_types, basestring
+
+import sys, types, marshal, sqlite3, json
+from hashlib import md5
+from threading import Lock
+
+import pony
+from pony.orm import core
+from pony.orm.decompiling import CodeKey
+from pony.orm.ormtypes import SetType, ArrayParamType, FuncType
+from pony.orm.sqlbuilding import Param, CompositeParam, make_adapter
+
+# entries are stored as JSON documents of plain data, so a cache file cannot contain executable objects
+entry_format = 3
+
+class UnsupportedKey(Exception): pass
+
+class InvalidEntry(Exception): pass
+
+def key2str(x):
+    t = type(x)
+    if x is None or t is bool or t is float or t in int_types or isinstance(x, basestring): return repr(x)
+    if t is tuple or t is list: return '(%s)' % ','.join(imap(key2str, x))
+    if t is types.CodeType: return 'code:' + md5(marshal.dumps(x)).hexdigest()
+    if t is CodeKey: return key2str(x.code)
+    if isinstance(x, core.EntityMeta): return 'entity:' + x.__name__
+    if isinstance(x, core.Attribute): return 'attr:%s.%s' % (x.entity.__name__, x.name)
+    if t is core.DescWrapper: return 'desc:' + key2str(x.attr)
+    if t is SetType: return 'set:' + key2str(x.item_type)
+    if t is ArrayParamType: return 'array:' + key2str(x.item_type)
+    if t is FuncType: return 'func:' + global_name(x.func)
+    if isinstance(x, type): return 'type:' + global_name(x)
+    raise UnsupportedKey(t)
+
+def global_name(x):
+    module_name = getattr(x, '__module__', None)
+    name = getattr(x, '__name__', None)
+    module = sys.modules.get(module_name)
+    if module is None or getattr(module, name, None) is not x: raise UnsupportedKey(x)
+    return '%s.%s' % (module_name, name)
+
+def converter2spec(converter):
+    if converter is None: return None
+    attr = converter.attr
+    if attr is None:
+        if not isinstance(converter.py_type, type): raise UnsupportedKey(converter.py_type)
+        return [ 'type', global_name(converter.py_type) ]
+    for i, attr_converter in enumerate(attr.converters):
+        if attr_converter is converter: return [ 'attr', attr.entity.__name__, attr.name, i ]
+    raise UnsupportedKey(converter)
+
+def json2paramkey(x):
+    t = type(x)
+    if t is list: return tuple(imap(json2paramkey, x))
+    if x is None or t in int_types or isinstance(x, basestring): return x
+    raise InvalidEntry(x)
+
+def check_int(x):
+    if type(x) not in int_types: raise InvalidEntry(x)
+    return x
+
+class PersistentSQLCache(object):
+    def __init__(cache, database, filename):
+        cache.database = database
+        cache.filename = filename
+        cache.signature = cache._calc_signature()
+        cache.lock = Lock()
+        cache.hits = 0
+        cache.connection = con = sqlite3.connect(filename, check_same_thread=False)
+        con.execute('CREATE TABLE IF NOT EXISTS pony_sql_cache '
+                    '(signature TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (signature, key))')
+        con.execute('DELETE FROM pony_sql_cache WHERE signature <> ?', (cache.signature,))
+        con.commit()
+        cursor = con.execute('SELECT key, value FROM pony_sql_cache WHERE signature = ?', (cache.signature,))
+        cache.entries = dict((key, value) for key, value in cursor if isinstance(value, basestring))
+        cache.loaded = len(cache.entries)
+    def _calc_signature(cache):
+        database = cache.database
+        provider = database.provider
+        entities = sorted(database.entities.values(), key=lambda entity: entity.__name__)
+        parts = [ 'format %d' % entry_format, pony.__version__, '%d.%d' % sys.version_info[:2],
+                  provider.dialect, provider.paramstyle, database.schema.generate_create_script() ]
+        for entity in entities:
+            parts.append(entity.__name__)
+            parts.extend('%s:%s' % (attr.name, attr.py_type) for attr in entity._attrs_)
+        return md5('\n'.join(parts).encode('utf-8')).hexdigest()
+    def _get_converter(cache, converter_spec):
+        if converter_spec is None: return None
+        if converter_spec[0] == 'type':
+            # the type is looked up among already imported modules only
+            module_name, _, type_name = converter_spec[1].rpartition('.')
+            py_type = getattr(sys.modules.get(module_name), type_name, None)
+            if not isinstance(py_type, type): raise InvalidEntry(converter_spec)
+            return cache.database.provider.get_converter_by_py_type(py_type)
+        if converter_spec[0] != 'attr': raise InvalidEntry(converter_spec)
+        _, entity_name, attr_name, i = converter_spec
+        return cache.database.entities[entity_name]._adict_[attr_name].converters[check_int(i)]
+    def _load_entry(cache, value):
+        database = cache.database
+        provider = database.provider
+        try:
+            version, sql, param_specs, offset_specs = json.loads(value)
+            if version != entry_format or not isinstance(sql, basestring): raise InvalidEntry(version)
+            params = []
+            for paramkey, converter_spec, optimistic, param_id in param_specs:
+                paramkey = json2paramkey(paramkey)
+                if type(paramkey) is not tuple or len(paramkey) != 3: raise InvalidEntry(paramkey)
+                if type(optimistic) is not bool: raise InvalidEntry(optimistic)
+                param = Param(provider.paramstyle, paramkey, cache._get_converter(converter_spec), optimistic)
+                param.id = check_int(param_id)
+                params.append(param)
+            if offset_specs is None: attr_offsets = None
+            else:
+                attr_offsets = {}
+                for entity_name, attr_name, offsets in offset_specs:
+                    attr = database.entities[entity_name]._adict_[attr_name]
+                    attr_offsets[attr] = [ check_int(offset) for offset in offsets ]
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e: raise InvalidEntry(e)
+        return sql, make_adapter(provider.paramstyle, params), attr_offsets
+    def get(cache, sql_key):
+        try: key = key2str(sql_key)
+        except UnsupportedKey: return None
+        value = cache.entries.get(key)
+        if value is None: return None
+        try: entry = cache._load_entry(value)
+        except InvalidEntry:
+            with cache.lock: cache.entries.pop(key, None)
+            return None
+        cache.hits += 1
+        return entry
+    def put(cache, sql_key, sql, params, attr_offsets):
+        try:
+            key = key2str(sql_key)
+            param_specs = []
+            for param in params:
+                if isinstance(param, CompositeParam): return
+                param_specs.append((param.paramkey, converter2spec(param.converter), param.optimistic, param.id))
+        except UnsupportedKey: return
+        if attr_offsets is None: offset_specs = None
+        else: offset_specs = [ (attr.entity.__name__, attr.name, offsets)
+                               for attr, offsets in iteritems(attr_offsets) ]
+        try: value = json.dumps([ entry_format, sql, param_specs, offset_specs ])
+        except (TypeError, ValueError): return
+        with cache.lock:
+            if key in cache.entries: return
+            cache.entries[key] = value
+            con = cache.connection
+            if con is None: return
+            con.execute('INSERT OR IGNORE INTO pony_sql_cache VALUES (?, ?, ?)', (cache.signature, key, value))
+            con.commit()
+    def clear(cache):
+        with cache.lock:
+            cache.entries.clear()
+            con = cache.connection
+            if con is None: return
+            con.execute('DELETE FROM pony_sql_cache')
+            con.commit()
+    def close(cache):
+        with cache.lock:
+            con = cache.connection
+            cache.connection = None
+            if con is not None: con.close()
@@ -0,0 +1,42 @@
+from __future__ import absolute_import, print_function, division
+
+from time import time
+
+from pony.utils import throw, LRUCache
+
+class CacheBackend(object):
+    # Interface of the storage which is shared between database sessions.
+    # Keys are tuples of strings and primitive values, values are picklable.
+    def get(backend, key):
+        throw(NotImplementedError)
+    def set(backend, key, value, ttl=None):
+        throw(NotImplementedError)
+    def delete(backend, key):
+        throw(NotImplementedError)
+    def clear(backend):
+        throw(NotImplementedError)
+
+class LocalCache(CacheBackend):
+    def __init__(backend, max_size=1000, ttl=None):
+        if ttl is not None and ttl <= 0: throw(ValueError, 'ttl must be positive. Got: %r' % ttl)
+        backend.ttl = ttl
+        backend.data = LRUCache(max_size)
+    def get(backend, key):
+        entry = backend.data.get(key)
+        if entry is None: return None
+        value, expires = entry
+        if expires is not None and expires <= time():
+            backend.data.pop(key)
+            return None
+        return value
+    def set(backend, key, value, ttl=None):
+        if ttl is None: ttl = backend.ttl
+        backend.data[key] = value, (time() + ttl if ttl is not None else None)
+    def delete(backend, key):
+        backend.data.pop(key)
+    def clear(backend):
+        backend.data.clear()
+    def resize(backend, max_size):
+        backend.data.resize(max_size)
+    def get_stats(backend):
+        return backend.data.get_stats()
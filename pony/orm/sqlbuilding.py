@@ -9,6 +9,7 @@ from binascii import hexlify
 from pony import options
 from pony.utils import datetime2timestamp, throw, is_ident
 from pony.orm.ormtypes import RawSQL, Json
+from pony.orm.dbapiprovider import Converter
 
 class AstError(Exception): pass
 
@@ -60,6 +61,16 @@ class CompositeParam(Param):
         args = [ item.eval(values) if isinstance(item, Param) else item.value for item in param.items ]
         return param.func(args)
 
+class ArrayParam(Param):
+    __slots__ = []
+    def eval(param, values):
+        varkey, i, j = param.paramkey
+        items = values[varkey]
+        converter = param.converter
+        if converter is None: return list(items)
+        if param.optimistic: return [ converter.py2sql(item) for item in items ]
+        return [ converter.py2sql(converter.val2dbval(item)) for item in items ]
+
 class Value(object):
     __slots__ = 'paramstyle', 'value'
     def __init__(self, paramstyle, value):
@@ -86,6 +97,78 @@ class Value(object):
         if self.paramstyle in ('format', 'pyformat'): s = s.replace('%', '%%')
         return "'%s'" % s.replace("'", "''")
 
+def overrides(converter, method_name):
+    method = getattr(type(converter), method_name)
+    base_method = getattr(Converter, method_name)
+    return getattr(method, '__func__', method) is not getattr(base_method, '__func__', base_method)
+
+# Larger adapters are not generated: their compilation is slow, and Python 2
+# crashes when a generated function has 65536 or more local variables
+MAX_GENERATED_ADAPTER_PARAMS = 1000
+
+def make_generic_adapter(named, params):
+    if named:
+        def adapter(values):
+            return {'p%d' % param.id: param.eval(values) for param in params}
+    else:
+        def adapter(values):
+            return tuple(param.eval(values) for param in params)
+    return adapter
+
+def make_adapter(paramstyle, params):
+    if paramstyle in ('qmark', 'format', 'numeric'): named = False
+    elif paramstyle in ('named', 'pyformat'): named = True
+    else: throw(NotImplementedError, paramstyle)
+    if len(params) > MAX_GENERATED_ADAPTER_PARAMS: return make_generic_adapter(named, params)
+    namespace = {}
+    lines = [ 'def adapter(values):' ]
+    varnames = {}
+    items = []
+    evaluated = {}
+    for param in params:
+        name = evaluated.get(param.id)
+        if name is not None:
+            if not named: items.append(name)
+            continue
+        name = 'a%d' % len(evaluated)
+        evaluated[param.id] = name
+        items.append("'p%d': %s" % (param.id, name) if named else name)
+        paramkey = param.paramkey
+        if type(param) is not Param or type(paramkey) is not tuple or len(paramkey) != 3:
+            namespace['eval_' + name] = param.eval
+            lines.append('    %s = eval_%s(values)' % (name, name))
+            continue
+        varkey, i, j = paramkey
+        varname = varnames.get(varkey)
+        if varname is None:
+            varname = varnames[varkey] = 'v%d' % len(varnames)
+            namespace['key_' + varname] = varkey
+            lines.append('    %s = values[key_%s]' % (varname, varname))
+        expr = varname
+        if i is not None:
+            lines.append('    %s = %s[%d] if type(%s) is tuple else %s.values[%d]' % (name, expr, i, expr, expr, i))
+            expr = name
+        if j is not None:
+            lines.append('    %s = %s._get_raw_pkval_()[%d]' % (name, expr, j))
+            expr = name
+        converter = param.converter
+        if converter is not None:
+            if not param.optimistic and overrides(converter, 'val2dbval'):
+                namespace['val2dbval_' + name] = converter.val2dbval
+                expr = 'val2dbval_%s(%s)' % (name, expr)
+            if overrides(converter, 'py2sql'):
+                namespace['py2sql_' + name] = converter.py2sql
+                expr = 'py2sql_%s(%s)' % (name, expr)
+            if expr != name and expr != varname:
+                source = name if i is not None or j is not None else varname
+                lines.append('    %s = %s if %s is not None else None' % (name, expr, source))
+                continue
+        if expr != name: lines.append('    %s = %s' % (name, expr))
+    if named: lines.append('    return {%s}' % ', '.join(items))
+    else: lines.append('    return (%s)' % ''.join(item + ', ' for item in items))
+    exec(compile('\n'.join(lines), '<adapter>', 'exec'), namespace)
+    return namespace['adapter']
+
 def flat(tree):
     stack = [ tree ]
     result = []
@@ -100,6 +183,16 @@ def flat(tree):
             except TypeError: result_append(x)
     return result
 
+def get_sql_ast_tables(sql_ast):
+    result = set()
+    stack = [ sql_ast ]
+    while stack:
+        x = stack.pop()
+        if type(x) is not list: continue
+        if len(x) >= 3 and x[1] == 'TABLE': result.add(x[2])
+        stack.extend(x)
+    return result
+
 def flat_conditions(conditions):
     result = []
     for condition in conditions:
@@ -160,6 +253,7 @@ class SQLBuilder(object):
     dialect = None
     param_class = Param
     composite_param_class = CompositeParam
+    array_param_class = ArrayParam
     value_class = Value
     indent_spaces = " " * 4
     def __init__(builder, provider, ast):
@@ -179,18 +273,8 @@ class SQLBuilder(object):
             layout.append(param.paramkey)
         builder.layout = layout
         builder.sql = u''.join(imap(unicode, builder.result)).rstrip('\n')
-        if paramstyle in ('qmark', 'format'):
-            def adapter(values):
-                return tuple(param.eval(values) for param in params)
-        elif paramstyle == 'numeric':
-            def adapter(values):
-                return tuple(param.eval(values) for param in params)
-        elif paramstyle in ('named', 'pyformat'):
-            def adapter(values):
-                return {'p%d' % param.id: param.eval(values) for param in params}
-        else: throw(NotImplementedError, paramstyle)
         builder.params = params
-        builder.adapter = adapter
+        builder.adapter = make_adapter(paramstyle, params)
     def __call__(builder, ast):
         if isinstance(ast, basestring):
             throw(AstError, 'An SQL AST list was expected. Got string: %r' % ast)
@@ -215,12 +299,35 @@ class SQLBuilder(object):
         return [ 'INSERT INTO ', builder.quote_name(table_name), ' (',
                  join(', ', [builder.quote_name(column) for column in columns ]),
                  ') VALUES (', join(', ', [builder(value) for value in values]), ')' ]
+    def INSERT_MANY(builder, table_name, columns, rows, returning=None):
+        result = [ 'INSERT INTO ', builder.quote_name(table_name), ' (',
+                   join(', ', [builder.quote_name(column) for column in columns ]), ') VALUES ',
+                   join(', ', [ ('(', join(', ', [builder(value) for value in row]), ')') for row in rows ]) ]
+        if returning is not None:
+            result.extend([ ' RETURNING ', join(', ', [ builder.quote_name(column) for column in returning ]) ])
+        return result
+    def UPSERT(builder, table_name, columns, rows, key_columns, update_columns, returning=None):
+        quote_name = builder.quote_name
+        result = builder.INSERT_MANY(table_name, columns, rows)
+        result.extend([ ' ON CONFLICT (', join(', ', [ quote_name(column) for column in key_columns ]),
+                        ') DO UPDATE SET ' ])
+        # the row is updated even without new values, so it is always returned
+        if not update_columns: update_columns = key_columns[:1]
+        result.extend(join(', ', [ (quote_name(column), ' = excluded.', quote_name(column))
+                                   for column in update_columns ]))
+        if returning is not None:
+            result.extend([ ' RETURNING ', join(', ', [ quote_name(column) for column in returning ]) ])
+        return result
     def DEFAULT(builder):
         return 'DEFAULT'
     def UPDATE(builder, table_name, pairs, where=None):
         return [ 'UPDATE ', builder.quote_name(table_name), '\nSET ',
                  join(', ', [ (builder.quote_name(name), ' = ', builder(param)) for name, param in pairs]),
                  where and [ '\n', builder(where) ] or [] ]
+    def BULK_UPDATE(builder, table_name, pairs, where=None):
+        builder.indent += 1
+        builder.suppress_aliases = True
+        return builder.UPDATE(table_name, pairs, where)
     def DELETE(builder, alias, from_ast, where=None):
         builder.indent += 1
         if alias is not None:
@@ -373,6 +480,8 @@ class SQLBuilder(object):
         return param
     def make_composite_param(builder, paramkey, items, func):
         return builder.make_param(builder.composite_param_class, paramkey, items, func)
+    def ARRAY_PARAM(builder, paramkey, converter=None, optimistic=False):
+        return builder.make_param(builder.array_param_class, paramkey, converter, optimistic)
     def ROW(builder, *items):
         return '(', join(', ', imap(builder, items)), ')'
     def VALUE(builder, value):
@@ -432,6 +541,10 @@ class SQLBuilder(object):
             return builder(expr1), ' NOT IN ', builder(x)
         expr_list = [ builder(expr) for expr in x ]
         return builder(expr1), ' NOT IN (', join(', ', expr_list), ')'
+    def IN_ARRAY(builder, expr1, param):
+        throw(NotImplementedError)
+    def NOT_IN_ARRAY(builder, expr1, param):
+        throw(NotImplementedError)
     def COUNT(builder, kind, *expr_list):
         if kind == 'ALL':
             if not expr_list: return ['COUNT(*)']
@@ -15,7 +15,7 @@ from pony import options, utils
 from pony.utils import is_ident, throw, reraise, concat
 from pony.orm.asttranslation import ASTTranslator, ast2src, TranslationError
 from pony.orm.ormtypes import \
-    numeric_types, comparable_types, SetType, FuncType, MethodType, RawSQLType, \
+    numeric_types, comparable_types, SetType, ArrayParamType, FuncType, MethodType, RawSQLType, \
     get_normalized_type_of, normalize_type, coerce_types, are_comparable_types, \
     Json
 from pony.orm import core
@@ -60,8 +60,21 @@ def join_tables(alias1, alias2, columns1, columns2):
     assert len(columns1) == len(columns2)
     return sqland([ [ 'EQ', [ 'COLUMN', alias1, c1 ], [ 'COLUMN', alias2, c2 ] ] for c1, c2 in izip(columns1, columns2) ])
 
+subquery_nodes = 'SELECT', 'EXISTS', 'NOT_EXISTS'
+
+def contains_subquery(sql_ast):
+    if type(sql_ast) is not list or not sql_ast: return False
+    if sql_ast[0] in subquery_nodes: return True
+    return any(contains_subquery(item) for item in sql_ast[1:])
+
+def check_update_expr(sql_ast, alias):
+    if type(sql_ast) is not list or not sql_ast: return
+    if sql_ast[0] in subquery_nodes or sql_ast[0] == 'COLUMN' and sql_ast[1] not in (None, alias):
+        throw(TranslationError, 'Assigned expressions of bulk update can refer only to attributes of updated entity')
+    for item in sql_ast[1:]: check_update_expr(item, alias)
+
 def type2str(t):
-    if type(t) is tuple: return 'list'
+    if type(t) is tuple or type(t) is ArrayParamType: return 'list'
     if type(t) is SetType: return 'Set of ' + type2str(t.item_type)
     try: return t.__name__
     except: return str(t)
@@ -113,6 +126,8 @@ class SQLTranslator(ASTTranslator):
                 param = translator.ParamMonad.new(translator, item_type, (varkey, i, None))
                 params.append(param)
             monad = translator.ListMonad(translator, params)
+        elif tt is ArrayParamType:
+            monad = translator.ArrayParamMonad(translator, t, varkey)
         elif isinstance(t, RawSQLType):
             monad = translator.RawSQLMonad(translator, t, varkey)
         else:
@@ -513,22 +528,53 @@ class SQLTranslator(ASTTranslator):
                 sql_ast.append([ 'WHERE' ] + translator.conditions)
         else:
             delete_from_ast = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
-            if len(entity._pk_columns_) == 1:
-                inner_expr = expr_monad.getsql()
-                outer_expr = [ 'COLUMN', None, entity._pk_columns_[0] ]
-            elif translator.rowid_support:
-                inner_expr = [ [ 'COLUMN', tableref.alias, 'ROWID' ] ]
-                outer_expr = [ 'COLUMN', None, 'ROWID' ]
-            elif translator.row_value_syntax:
-                inner_expr = expr_monad.getsql()
-                outer_expr = [ 'ROW' ] + [ [ 'COLUMN', None, column_name ] for column_name in entity._pk_columns_ ]
-            else: throw(NotImplementedError)
-            subquery_ast = [ 'SELECT', [ 'ALL' ] + inner_expr, from_ast ]
+            sql_ast = [ 'DELETE', None, delete_from_ast, translator.construct_subquery_where_ast() ]
+        return sql_ast
+    def construct_update_sql_ast(translator, pairs):
+        entity = translator.expr_type
+        expr_monad = translator.tree.expr.monad
+        if not isinstance(entity, EntityMeta): throw(TranslationError,
+            'Update query should be applied to a single entity. Got: %s' % ast2src(translator.tree.expr))
+        if translator.groupby_monads: throw(TranslationError,
+            'Update query cannot contains GROUP BY section or aggregate functions')
+        assert not translator.having_conditions
+        tableref = expr_monad.tableref
+        for column, expr in pairs:
+            check_update_expr(expr, tableref.alias)
+        from_ast = translator.subquery.from_ast
+        assert from_ast[0] == 'FROM'
+        if len(from_ast) == 2 and not translator.subquery.used_from_subquery \
+                and not any(contains_subquery(cond) for cond in translator.conditions):
+            sql_ast = [ 'BULK_UPDATE', entity._table_, pairs ]
+            if translator.conditions:
+                sql_ast.append([ 'WHERE' ] + translator.conditions)
+        elif translator.dialect == 'MySQL':
+            # MySQL does not allow to select from the table being updated in a subquery
+            pairs = [ ([ 'COLUMN', tableref.alias, column ], expr) for column, expr in pairs ]
+            sql_ast = [ 'UPDATE_JOIN', from_ast, pairs ]
             if translator.conditions:
-                subquery_ast.append([ 'WHERE' ] + translator.conditions)
-            delete_where_ast = [ 'WHERE', [ 'IN', outer_expr, subquery_ast ] ]
-            sql_ast = [ 'DELETE', None, delete_from_ast, delete_where_ast ]
+                sql_ast.append([ 'WHERE' ] + translator.conditions)
+        else: sql_ast = [ 'BULK_UPDATE', entity._table_, pairs, translator.construct_subquery_where_ast() ]
         return sql_ast
+    def construct_subquery_where_ast(translator):
+        entity = translator.expr_type
+        expr_monad = translator.tree.expr.monad
+        tableref = expr_monad.tableref
+        from_ast = translator.subquery.from_ast
+        if len(entity._pk_columns_) == 1:
+            inner_expr = expr_monad.getsql()
+            outer_expr = [ 'COLUMN', None, entity._pk_columns_[0] ]
+        elif translator.rowid_support:
+            inner_expr = [ [ 'COLUMN', tableref.alias, 'ROWID' ] ]
+            outer_expr = [ 'COLUMN', None, 'ROWID' ]
+        elif translator.row_value_syntax:
+            inner_expr = expr_monad.getsql()
+            outer_expr = [ 'ROW' ] + [ [ 'COLUMN', None, column_name ] for column_name in entity._pk_columns_ ]
+        else: throw(NotImplementedError)
+        subquery_ast = [ 'SELECT', [ 'ALL' ] + inner_expr, from_ast ]
+        if translator.conditions:
+            subquery_ast.append([ 'WHERE' ] + translator.conditions)
+        return [ 'WHERE', [ 'IN', outer_expr, subquery_ast ] ]
     def get_used_attrs(translator):
         if isinstance(translator.expr_type, EntityMeta) and not translator.aggregated and not translator.optimize:
             return translator.tableref.used_attrs
@@ -581,6 +627,27 @@ class SQLTranslator(ASTTranslator):
                 new_order.append(desc_wrapper([ 'COLUMN', alias, column]))
         order[:0] = new_order
         return translator
+    def apply_seek(translator, seek):
+        translator = deepcopy(translator)
+        alias = translator.alias
+        order = translator.order = translator.order[:]
+        ordered_columns = set(item[1][2] if item[0] == 'DESC' else item[2] for item in order)
+        columns, params, ops = [], [], []
+        for column, is_desc, id, converter in seek:
+            column_ast = [ 'COLUMN', alias, column ]
+            if column not in ordered_columns: order.append(column_ast)  # primary key as a tie-breaker
+            columns.append(column_ast)
+            params.append([ 'PARAM', (id, None, None), converter ])
+            ops.append('LT' if is_desc else 'GT')
+        if len(columns) == 1: condition = [ ops[0], columns[0], params[0] ]
+        elif translator.row_value_syntax and len(set(ops)) == 1:
+            condition = [ ops[0], [ 'ROW' ] + columns, [ 'ROW' ] + params ]
+        else:
+            condition = [ 'OR' ] + [ [ 'AND' ] + [ [ 'EQ', columns[j], params[j] ] for j in xrange(i) ]
+                                             + [ [ ops[i], columns[i], params[i] ] ]
+                                     for i in xrange(len(columns)) ]
+        translator.conditions.append(condition)
+        return translator
     def apply_kwfilters(translator, filterattrs):
         entity = translator.expr_type
         if not isinstance(entity, EntityMeta):
@@ -618,6 +685,7 @@ class SQLTranslator(ASTTranslator):
                                             % (t, ast2src(node)))
                 new_order.extend(node.monad.getsql())
             translator.order[:0] = new_order
+            translator.new_order_types = tuple(node.monad.type for node in nodes)  # used by query.update()
         else:
             for node in nodes:
                 monad = node.monad
@@ -1204,6 +1272,9 @@ class ListMonad(Monad):
         if len(left_sql) == 1:
             if not_in: sql = [ 'NOT_IN', left_sql[0], [ item.getsql()[0] for item in monad.items ] ]
             else: sql = [ 'IN', left_sql[0], [ item.getsql()[0] for item in monad.items ] ]
+        elif translator.row_value_syntax and monad.items:
+            row = [ 'ROW' ] + left_sql
+            sql = [ 'NOT_IN' if not_in else 'IN', row, [ [ 'ROW' ] + item.getsql() for item in monad.items ] ]
         elif not_in:
             sql = sqland([ sqlor([ [ 'NE', a, b ]  for a, b in izip(left_sql, item.getsql()) ]) for item in monad.items ])
         else:
@@ -1212,6 +1283,20 @@ class ListMonad(Monad):
     def getsql(monad, subquery=None):
         return [ [ 'ROW' ] + [ item.getsql()[0] for item in monad.items ] ]
 
+class ArrayParamMonad(Monad):
+    def __init__(monad, translator, t, varkey):
+        Monad.__init__(monad, translator, t)
+        monad.item = translator.ParamMonad.new(translator, t.item_type, (varkey, None, None))
+    def contains(monad, x, not_in=False):
+        translator = monad.translator
+        if isinstance(x.type, SetType): throw(TypeError,
+            "Type of `%s` is '%s'. Expression `{EXPR}` is not supported" % (ast2src(x.node), type2str(x.type)))
+        check_comparable(x, monad.item)
+        left_sql = x.getsql()
+        if len(left_sql) != 1: throw(NotImplementedError)
+        param_sql = [ 'ARRAY_PARAM' ] + monad.item.getsql()[0][1:]
+        return translator.BoolExprMonad(translator, [ 'NOT_IN_ARRAY' if not_in else 'IN_ARRAY', left_sql[0], param_sql ])
+
 class BufferMixin(MonadMixin):
     pass
 
@@ -0,0 +1,143 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    major = Optional(str)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str, unique=True)
+    gpa = Optional(float)
+    group = Required(Group)
+    mentor = Optional('Student', reverse='mentees')
+    mentees = Set('Student', reverse='mentor')
+
+class Note(db.Entity):
+    text = Required(str)
+    code = Optional(str, unique=True, nullable=True)
+
+db.generate_mapping(create_tables=True)
+
+def insert_count():
+    return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('INSERT'))
+
+class TestBatchInsert(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Student.select().delete(bulk=True)
+            Group.select().delete(bulk=True)
+            Note.select().delete(bulk=True)
+        db.merge_local_stats()
+    def test_auto_pk(self):
+        with db_session:
+            g = Group(number=1)
+            flush()
+            students = [ Student(name='S%d' % i, group=g) for i in range(100) ]
+            flush()
+            ids = [ s.id for s in students ]
+            self.assertEqual(len(set(ids)), 100)
+            self.assertEqual(ids, sorted(ids))
+            self.assertTrue(Student[ids[10]] is students[10])
+            if db.provider.insert_returning_syntax: self.assertTrue(insert_count() < 10)
+        with db_session:
+            self.assertEqual(Student[ids[10]].name, 'S10')
+    def test_unordered_returning(self):
+        exec_sql = db._exec_sql
+        class ReversedCursor(object):
+            def __init__(self, cursor): self.cursor = cursor
+            def fetchall(self): return self.cursor.fetchall()[::-1]
+        def reversed_exec_sql(sql, *args, **kwargs):
+            cursor = exec_sql(sql, *args, **kwargs)
+            return ReversedCursor(cursor) if 'RETURNING' in sql else cursor
+        db._exec_sql = reversed_exec_sql
+        try:
+            with db_session:
+                g = Group(number=1)
+                flush()
+                students = [ Student(name='S%d' % i, group=g) for i in range(10) ]
+                flush()
+                ids = dict((s.name, s.id) for s in students)
+        finally: del db._exec_sql
+        with db_session:
+            self.assertEqual(dict(select((s.name, s.id) for s in Student)), ids)
+    def test_without_unique_key(self):
+        with db_session:
+            notes = [ Note(text='N%d' % i) for i in range(5) ]
+            flush()
+            self.assertEqual(insert_count(), 5)
+            ids = dict((n.text, n.id) for n in notes)
+        with db_session:
+            self.assertEqual(dict(select((n.text, n.id) for n in Note)), ids)
+    def test_null_unique_key(self):
+        with db_session:
+            notes = [ Note(text='A', code='a'), Note(text='B', code=None), Note(text='C', code='c') ]
+            flush()
+            self.assertEqual(insert_count(), 3)
+            ids = dict((n.text, n.id) for n in notes)
+        with db_session:
+            self.assertEqual(dict(select((n.text, n.id) for n in Note)), ids)
+    def test_explicit_pk(self):
+        with db_session:
+            for i in range(50): Group(number=i, major='Math')
+            flush()
+            self.assertEqual(insert_count(), 1)
+        with db_session:
+            self.assertEqual(count(g for g in Group if g.major == 'Math'), 50)
+    def test_different_attributes(self):
+        with db_session:
+            g = Group(number=1)
+        db.merge_local_stats()
+        with db_session:
+            g = Group[1]
+            for i in range(4): Student(name='S%d' % i, group=g, gpa=4.0 if i >= 2 else None)
+        if db.provider.insert_returning_syntax: self.assertEqual(insert_count(), 2)
+        with db_session:
+            self.assertEqual(select(s.name for s in Student if s.gpa is None).order_by(1)[:], [ 'S0', 'S1' ])
+    def test_creation_order(self):
+        with db_session:
+            g = Group(number=1)
+            flush()
+            students = [ Student(name='S%d' % i, group=g, gpa=None if i % 2 or i < 3 else float(i))
+                         for i in range(6) ]
+            flush()
+            ids = [ s.id for s in students ]
+            self.assertEqual(ids, sorted(ids))
+            notes = [ Note(text='N%d' % i, code=None if i % 2 else 'c%d' % i) for i in range(6) ]
+            flush()
+            ids = [ n.id for n in notes ]
+            self.assertEqual(ids, sorted(ids))
+    def test_dependencies(self):
+        with db_session:
+            g1 = Group(number=1)
+            s1 = Student(name='A', group=g1)
+            s2 = Student(name='B', group=g1, mentor=s1)
+            g2 = Group(number=2)
+            Student(name='C', group=g2, mentor=s2)
+            Student(name='D', group=g2, mentor=s1)
+        with db_session:
+            self.assertEqual(select((s.name, s.group.number, s.mentor.name) for s in Student).order_by(1)[:],
+                             [ ('B', 1, 'A'), ('C', 2, 'B'), ('D', 2, 'A') ])
+    def test_after_insert_hooks(self):
+        inserted = []
+        Group.after_insert = lambda group: inserted.append(group.number)
+        try:
+            with db_session:
+                for i in range(3): Group(number=i)
+        finally: del Group.after_insert
+        self.assertEqual(sorted(inserted), [ 0, 1, 2 ])
+    def test_integrity_error(self):
+        with db_session:
+            g = Group(number=1)
+            Student(name='A', group=g)
+        with self.assertRaises(TransactionIntegrityError):
+            with db_session:
+                for name in 'BCA': Student(name=name, group=Group[1])
+
+if __name__ == '__main__':
+    unittest.main()
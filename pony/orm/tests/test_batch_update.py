@@ -0,0 +1,77 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str)
+    gpa = Optional(float)
+    group = Optional(Group)
+
+db.generate_mapping(create_tables=True)
+
+def statements_count(prefix):
+    return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith(prefix))
+
+class TestBatchUpdate(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Student.select().delete(bulk=True)
+            Group.select().delete(bulk=True)
+            g = Group(number=1)
+            for i in range(1, 21): Student(id=i, name='S%d' % i, group=g)
+        db.merge_local_stats()
+    def test_update(self):
+        with db_session:
+            for s in Student.select(): s.gpa = s.id / 10.0
+        self.assertEqual(statements_count('UPDATE'), 1)
+        with db_session:
+            self.assertEqual(Student[7].gpa, 0.7)
+    def test_update_different_columns(self):
+        with db_session:
+            students = Student.select().order_by(Student.id)[:]
+            for s in students[:5]: s.gpa = 1.0
+            for s in students[5:8]: s.name += 'x'
+        self.assertEqual(statements_count('UPDATE'), 2)
+        with db_session:
+            self.assertEqual(count(s for s in Student if s.gpa == 1.0), 5)
+            self.assertEqual(Student[6].name, 'S6x')
+    def test_optimistic_check(self):
+        with self.assertRaises(OptimisticCheckError):
+            with db_session:
+                students = Student.select()[:]
+                for s in students:
+                    s.name
+                    s.gpa = 2.0
+                students[3]._dbvals_[Student.name] = 'changed by another transaction'
+        with db_session:
+            self.assertEqual(count(s for s in Student if s.gpa == 2.0), 0)
+    def test_delete(self):
+        with db_session:
+            for s in Student.select(lambda s: s.id > 5): s.delete()
+        self.assertEqual(statements_count('DELETE'), 1)
+        with db_session:
+            self.assertEqual(select(s.id for s in Student).order_by(1)[:], [ 1, 2, 3, 4, 5 ])
+            self.assertTrue(Student.get(id=10) is None)
+    def test_delete_optimistic(self):
+        with db_session:
+            for s in Student.select(lambda s: s.id > 10):
+                s.name
+                s.delete()
+        with db_session:
+            self.assertEqual(Student.select().count(), 10)
+    def test_delete_with_dependent_updates(self):
+        with db_session:
+            Group[1].delete()
+        with db_session:
+            self.assertEqual(count(s for s in Student if s.group is None), 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str, unique=True)
+    processed = Required(bool, default=False)
+    group = Required(Group)
+
+db.generate_mapping(create_tables=True)
+
+class TestBatches(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Student.select().delete(bulk=True)
+            Group.select().delete(bulk=True)
+            g1 = Group(number=1)
+            g2 = Group(number=2)
+            for i in range(1, 24):
+                Student(id=i, name='S%02d' % i, group=g1 if i % 2 else g2)
+    def test_batches(self):
+        with db_session:
+            batches = list(Student.select().order_by(desc(Student.name)).batches(10))
+            self.assertEqual([ len(batch) for batch in batches ], [ 10, 10, 3 ])
+            self.assertEqual([ s.id for batch in batches for s in batch ], list(range(1, 24)))
+    def test_filtered(self):
+        with db_session:
+            ids = [ s.id for batch in select(s for s in Student if s.group.number == 2).batches(4) for s in batch ]
+            self.assertEqual(ids, list(range(2, 24, 2)))
+    def test_commit(self):
+        with db_session:
+            for batch in Student.select().batches(5):
+                for s in batch: s.processed = True
+            rollback()
+        with db_session:
+            self.assertEqual(count(s for s in Student if s.processed), 23)
+    def test_no_commit(self):
+        with db_session:
+            for batch in Student.select().batches(5, commit=False):
+                batch[0].processed = True
+            rollback()
+        with db_session:
+            self.assertEqual(count(s for s in Student if s.processed), 0)
+    def test_deleting_objects(self):
+        with db_session:
+            for batch in Student.select().batches(5):
+                for s in batch: s.delete()
+        with db_session:
+            self.assertEqual(Student.select().count(), 0)
+    def test_collections_after_eviction(self):
+        with db_session:
+            g1 = Group[1]
+            self.assertEqual(len(g1.students), 12)
+            for batch in Student.select().batches(5): pass
+            self.assertEqual(len(g1.students), 12)
+            self.assertEqual(set(s.id for s in g1.students), set(range(1, 24, 2)))
+    def test_eviction(self):
+        with db_session:
+            cache = db._get_cache()
+            for batch in Student.select().batches(5):
+                # unmodified objects of previous batches are evicted
+                self.assertEqual(len([ obj for obj in cache.objects if isinstance(obj, Student) ]), len(batch))
+    def test_eviction_keeps_updated_objects(self):
+        with db_session:
+            cache = db._get_cache()
+            updated = []
+            for batch in Student.select().batches(5):
+                batch[0].processed = True
+                updated.append(batch[0])
+            students = set(obj for obj in cache.objects if isinstance(obj, Student))
+            self.assertEqual(students, set(updated))
+            self.assertTrue(all(Student[s.id] is s for s in updated))
+    def test_eviction_keeps_inserted_objects(self):
+        with db_session:
+            s = Student(id=100, name='S100', group=Group[1])
+            for batch in Student.select().batches(5): pass
+            self.assertTrue(Student[100] is s)
+    def test_eviction_keeps_previously_loaded_objects(self):
+        with db_session:
+            s1 = Student[1]
+            s2 = Student.get(name='S02')
+            for batch in Student.select().batches(5): pass
+            self.assertTrue(Student[1] is s1)
+            self.assertTrue(Student.get(name='S02') is s2)
+            self.assertEqual(len([ obj for obj in db._get_cache().objects if isinstance(obj, Student) ]), 2)
+    def test_no_eviction(self):
+        with db_session:
+            for batch in Student.select().batches(5, evict=False): pass
+            self.assertEqual(len([ obj for obj in db._get_cache().objects if isinstance(obj, Student) ]), 23)
+    def test_invalid_arguments(self):
+        with db_session:
+            self.assertRaises(ValueError, Student.select().batches, 0)
+            self.assertRaises(TypeError, select(s.name for s in Student).batches, 10)
+
+if __name__ == '__main__':
+    unittest.main()
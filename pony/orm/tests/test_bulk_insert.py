@@ -0,0 +1,91 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from datetime import date
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str)
+    birth_date = Optional(date)
+    gpa = Optional(float)
+    group = Required(Group)
+    marks = Set('Mark')
+
+class Mark(db.Entity):
+    student = Required(Student)
+    subject = Required(str)
+    value = Required(int)
+    PrimaryKey(student, subject)
+
+db.generate_mapping(create_tables=True)
+
+class TestBulkInsert(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Mark.select().delete(bulk=True)
+            Student.select().delete(bulk=True)
+            Group.select().delete(bulk=True)
+            Group(number=1)
+    def test_insert(self):
+        with db_session:
+            count = Student.bulk_insert({ 'name': 'S%d' % i, 'group': 1 } for i in range(25))
+            self.assertEqual(count, 25)
+            self.assertEqual(len(db._get_cache().objects), 0)
+            self.assertEqual(Student.select().count(), 25)
+            self.assertEqual(Group[1].students.count(), 25)
+    def test_return_ids(self):
+        with db_session:
+            rows = [ { 'name': 'S%d' % i, 'group': Group[1], 'gpa': i % 2 or None } for i in range(25) ]
+            ids = Student.bulk_insert(rows, batch_size=10, return_ids=True)
+            self.assertEqual(len(set(ids)), 25)
+            self.assertEqual([ Student[id].name for id in ids ], [ row['name'] for row in rows ])
+            self.assertEqual(Student[ids[1]].gpa, 1.0)
+    def test_composite_pk(self):
+        with db_session:
+            s = Student(name='A', group=1)
+        with db_session:
+            ids = Mark.bulk_insert([ dict(student=s.id, subject='Math', value=5),
+                                     dict(student=s.id, subject='Art', value=4) ], return_ids=True)
+            self.assertEqual(ids, [ (s.id, 'Math'), (s.id, 'Art') ])
+            self.assertEqual(Mark[s.id, 'Art'].value, 4)
+    def test_conversion(self):
+        with db_session:
+            Student.bulk_insert([ dict(name='A', group='1', birth_date='2000-01-02', gpa='3.5') ])
+            s = Student.get(name='A')
+            self.assertEqual((s.group.number, s.birth_date, s.gpa), (1, date(2000, 1, 2), 3.5))
+    def test_validation(self):
+        with db_session:
+            self.assertRaises(ValueError, Student.bulk_insert, [ dict(group=1) ])
+            self.assertRaises(ValueError, Student.bulk_insert, [ dict(name='A') ])
+            self.assertRaises(TypeError, Student.bulk_insert, [ dict(name='A', group=1, age=20) ])
+            self.assertRaises(TypeError, Student.bulk_insert, [ dict(name='A', group=1, marks=[]) ])
+            self.assertRaises(TypeError, Student.bulk_insert, [ dict(name='A', group=1, gpa='high') ])
+            self.assertRaises(ValueError, Student.bulk_insert, [], batch_size=0)
+            self.assertEqual(Student.select().count(), 0)
+    def test_integrity_error(self):
+        with self.assertRaises(TransactionIntegrityError):
+            with db_session:
+                Group.bulk_insert([ dict(number=2), dict(number=1) ])
+    def test_pending_changes_are_flushed(self):
+        with db_session:
+            Group(number=2)
+            Student.bulk_insert([ dict(name='A', group=2) ])
+            self.assertEqual(Group[2].students.count(), 1)
+    def test_rollback(self):
+        with db_session:
+            Student.bulk_insert([ dict(name='A', group=1) ])
+            rollback()
+            self.assertEqual(Student.select().count(), 0)
+    def test_readonly_db_session(self):
+        with db_session(readonly=True):
+            self.assertRaises(TransactionError, Student.bulk_insert, [ dict(name='A', group=1) ])
+
+if __name__ == '__main__':
+    unittest.main()
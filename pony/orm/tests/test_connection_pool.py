@@ -0,0 +1,130 @@
+from __future__ import absolute_import, print_function, division
+
+import os, sqlite3, tempfile, threading, unittest
+
+from pony.orm.core import *
+from pony.orm.dbapiprovider import SharedPool
+
+class DummyConnection(object):
+    def __init__(con):
+        con.closed = False
+    def rollback(con):
+        pass
+    def close(con):
+        con.closed = True
+
+class DummyFactory(object):
+    def _connect(factory):
+        return DummyConnection()
+    def _reset(factory, con):
+        con.rollback()
+
+class TestSharedPool(unittest.TestCase):
+    def test_reuse(self):
+        pool = SharedPool(DummyFactory(), max_size=2)
+        con = pool.connect()
+        pool.release(con)
+        self.assertTrue(pool.connect() is con)
+        stats = pool.get_stats()
+        self.assertEqual((stats.created, stats.checkouts, stats.in_use, stats.idle), (1, 2, 1, 0))
+    def test_max_size(self):
+        pool = SharedPool(DummyFactory(), max_size=2, timeout=0.05)
+        con1 = pool.connect()
+        con2 = pool.connect()
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        stats = pool.get_stats()
+        self.assertEqual((stats.size, stats.waits, stats.timeouts), (2, 1, 1))
+        pool.release(con1)
+        self.assertTrue(pool.connect() is con1)
+    def test_waiting_for_release(self):
+        pool = SharedPool(DummyFactory(), max_size=1, timeout=5)
+        con = pool.connect()
+        timer = threading.Timer(0.05, pool.release, [ con ])
+        timer.start()
+        self.assertTrue(pool.connect() is con)
+        timer.join()
+        self.assertTrue(pool.get_stats().max_wait_time > 0)
+    def test_drop(self):
+        pool = SharedPool(DummyFactory(), max_size=1)
+        con = pool.connect()
+        pool.drop(con)
+        self.assertTrue(con.closed)
+        con2 = pool.connect()
+        self.assertTrue(con2 is not con)
+        stats = pool.get_stats()
+        self.assertEqual((stats.created, stats.dropped, stats.size), (2, 1, 1))
+    def test_max_lifetime(self):
+        pool = SharedPool(DummyFactory(), max_lifetime=0)
+        con = pool.connect()
+        pool.release(con)
+        self.assertTrue(con.closed)
+        self.assertEqual(pool.get_stats().idle, 0)
+    def test_max_idle(self):
+        pool = SharedPool(DummyFactory(), max_idle=0)
+        con = pool.connect()
+        pool.release(con)
+        self.assertFalse(con.closed)
+        con2 = pool.connect()
+        self.assertTrue(con.closed)
+        self.assertTrue(con2 is not con)
+    def test_min_size(self):
+        pool = SharedPool(DummyFactory(), min_size=2, max_idle=0)
+        pool.fill()
+        self.assertEqual(pool.get_stats().idle, 2)
+        con = pool.connect()
+        self.assertFalse(con.closed)
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, SharedPool, DummyFactory(), max_size=0)
+        self.assertRaises(ValueError, SharedPool, DummyFactory(), max_size=2, min_size=3)
+
+class TestDatabaseWithSharedPool(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.db = db = Database('sqlite', self.filename, pool_max_size=2, pool_min_size=1)
+        class Person(db.Entity):
+            name = Required(str)
+        db.generate_mapping(create_tables=True)
+        self.Person = Person
+    def tearDown(self):
+        self.db.disconnect()
+        os.remove(self.filename)
+    def test_threads(self):
+        Person = self.Person
+        errors = []
+        @db_session
+        def worker(i):
+            Person(name='Person %d' % i)
+        def run(i):
+            try: worker(i)
+            except Exception as e: errors.append(e)
+        threads = [ threading.Thread(target=run, args=(i,)) for i in range(5) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(errors, [])
+        with db_session:
+            self.assertEqual(count(p for p in Person), 5)
+        stats = self.db.pool_stats
+        self.assertTrue(stats.size <= 2)
+        self.assertEqual(stats.size, stats.created - stats.dropped)
+        self.assertEqual(stats.in_use, 0)
+    def test_memory_database(self):
+        self.assertRaises(TypeError, Database, 'sqlite', ':memory:', pool_max_size=2)
+
+class TestThreadLocalPool(unittest.TestCase):
+    def test_connection_is_bound_to_thread(self):
+        db = Database('sqlite', ':memory:')
+        errors = []
+        with db_session:
+            con = db.get_connection()
+            def run():
+                try: con.execute('select 1')
+                except Exception as e: errors.append(e)
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], sqlite3.ProgrammingError))
+
+if __name__ == '__main__':
+    unittest.main()
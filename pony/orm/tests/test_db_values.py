@@ -0,0 +1,108 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.core import SetData
+
+db = Database('sqlite', ':memory:')
+
+class Person(db.Entity):
+    name = Required(str, unique=True)
+    age = Required(int)
+    data = Optional(Json)
+    pets = Set('Pet')
+    passport = Optional('Passport')
+
+class Pet(db.Entity):
+    name = Required(str)
+    owner = Optional(Person)
+
+class Passport(db.Entity):
+    number = Required(str)
+    person = Optional(Person)
+
+db.generate_mapping(create_tables=True)
+
+class TestDbValues(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Pet.select().delete(bulk=True)
+            Passport.select().delete(bulk=True)
+            Person.select().delete(bulk=True)
+            Person(id=1, name='John', age=20)
+            Person(id=2, name='Mary', age=30, data={'x': 1})
+            Pet(id=1, name='Rex')
+            Passport(id=1, number='123')
+    def test_shared_after_load(self):
+        with db_session:
+            p = Person[1]
+            p.age
+            self.assertTrue(p._dbvals_ is p._vals_)
+    def test_converted_values(self):
+        with db_session:
+            p = Person[2]
+            self.assertFalse(p._dbvals_ is p._vals_)
+            p.data['x'] = 2
+        with db_session:
+            self.assertEqual(Person[2].data, {'x': 2})
+    def test_copy_on_write(self):
+        with db_session:
+            p = Person[1]
+            p.age = 21
+            self.assertFalse(p._dbvals_ is p._vals_)
+            self.assertEqual(p._dbvals_[Person.age], 20)
+            self.assertEqual(p._vals_[Person.age], 21)
+            p.set(name='Jack')
+            self.assertEqual(p._dbvals_[Person.name], 'John')
+        with db_session:
+            p = Person[1]
+            self.assertEqual((p.name, p.age), ('Jack', 21))
+    def test_optimistic_check(self):
+        with self.assertRaises(OptimisticCheckError):
+            with db_session:
+                p = Person[1]
+                p.age
+                db.execute('update Person set age = 25 where id = 1')
+                p.name = 'Jack'
+        with db_session:
+            self.assertEqual(Person[1].name, 'John')
+    def test_reload_updates_indexes(self):
+        with db_session:
+            p = Person[1]
+            db.execute("update Person set name = 'Jack' where id = 1")
+            select(p for p in Person)[:]
+            self.assertEqual(p.name, 'Jack')
+            self.assertTrue(p._dbvals_ is p._vals_)
+            self.assertTrue(Person.get(name='Jack') is p)
+            self.assertTrue(Person.get(name='John') is None)
+    def check_optimistic_update(self, p):
+        self.assertFalse(p._dbvals_ is p._vals_)
+        self.assertEqual(p._dbvals_, {Person.id: 1, Person.name: 'John', Person.age: 20, Person.data: None})
+        p.age = 21
+        flush()
+        self.assertEqual(db.last_sql, 'UPDATE "Person"\n'
+                                      'SET "age" = ?\n'
+                                      'WHERE "id" = ?\n  AND "name" = ?')
+    def test_collection_change(self):
+        with db_session:
+            p = Person[1]
+            self.assertEqual(p.name, 'John')
+            p.pets.add(Pet[1])
+            self.assertTrue(isinstance(p._vals_[Person.pets], SetData))
+            self.check_optimistic_update(p)
+        with db_session:
+            self.assertEqual(Pet[1].owner.age, 21)
+    def test_one_to_one_reverse_change(self):
+        with db_session:
+            p = Person[1]
+            self.assertEqual(p.name, 'John')
+            self.assertTrue(p.passport is None)
+            Passport[1].person = p
+            self.assertTrue(p._vals_[Person.passport] is Passport[1])
+            self.check_optimistic_update(p)
+        with db_session:
+            self.assertEqual(Passport[1].person.age, 21)
+
+if __name__ == '__main__':
+    unittest.main()
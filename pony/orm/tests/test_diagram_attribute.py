@@ -670,6 +670,28 @@ class TestAttribute(unittest.TestCase):
         class Foo(db.Entity):
             x = Required(str, sql_default='')
 
+    @raises_exception(TypeError, "'nplus1_threshold' option can be set only for lazy attributes, "
+                                 "relationships and collections")
+    def test_nplus1_threshold_1(self):
+        db = Database('sqlite', ':memory:')
+        class Foo(db.Entity):
+            x = Required(str, nplus1_threshold=2)
+
+    @raises_exception(TypeError, "'nplus1_threshold' option value must be non-negative integer or None. Got: -1")
+    def test_nplus1_threshold_2(self):
+        db = Database('sqlite', ':memory:')
+        class Foo(db.Entity):
+            x = Required(str, lazy=True, nplus1_threshold=-1)
+
+    def test_nplus1_threshold_3(self):
+        db = Database('sqlite', ':memory:')
+        class Foo(db.Entity):
+            x = Required(str, lazy=True, nplus1_threshold=None)
+            bars = Set('Bar', nplus1_threshold=3)
+        class Bar(db.Entity):
+            foo = Required(Foo, nplus1_threshold=0)
+        db.generate_mapping(create_tables=True)
+        self.assertEqual((Foo.x.nplus1_threshold, Foo.bars.nplus1_threshold, Bar.foo.nplus1_threshold), (None, 3, 0))
 
 if __name__ == '__main__':
     unittest.main()
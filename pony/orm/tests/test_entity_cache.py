@@ -0,0 +1,168 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.sharedcache import LocalCache
+
+db = Database('sqlite', ':memory:')
+
+class Country(db.Entity):
+    _cache_ = True
+    code = Required(str, unique=True)
+    name = Required(str)
+    cities = Set('City')
+
+class City(db.Entity):
+    name = Required(str)
+    country = Required(Country)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    us = Country(id=1, code='US', name='United States')
+    fr = Country(id=2, code='FR', name='France')
+    City(id=1, name='New York', country=us)
+    City(id=2, name='Paris', country=fr)
+
+def queries_count():
+    return sum(stat.db_count for stat in db.local_stats.values())
+
+class TestEntityCache(unittest.TestCase):
+    def setUp(self):
+        Country._cache_backend_.clear()
+    def test_get_by_pk(self):
+        with db_session:
+            Country[1]
+        n = queries_count()
+        with db_session:
+            country = Country[1]
+            self.assertEqual(country.name, 'United States')
+        self.assertEqual(queries_count(), n)
+    def test_get_by_unique_key(self):
+        with db_session:
+            select(c for c in Country)[:]
+        n = queries_count()
+        with db_session:
+            self.assertEqual(Country.get(code='FR').id, 2)
+            self.assertEqual(Country.get(code='FR', name='France').id, 2)
+        self.assertEqual(queries_count(), n)
+        with db_session:
+            self.assertTrue(Country.get(code='FR', name='Germany') is None)
+        self.assertEqual(queries_count(), n + 1)
+    def test_load_reference(self):
+        with db_session:
+            Country[2]
+        with db_session:
+            city = City[2]
+            n = queries_count()
+            self.assertEqual(city.country.name, 'France')
+            self.assertEqual(queries_count(), n)
+    def test_update_invalidates(self):
+        with db_session:
+            Country[1].name = 'USA'
+        with db_session:
+            self.assertEqual(Country[1].name, 'USA')
+            Country[1].name = 'United States'
+        with db_session:
+            self.assertEqual(Country[1].name, 'United States')
+    def test_rollback(self):
+        with db_session:
+            Country[1].name = 'USA'
+            flush()
+            self.assertEqual(Country.get(code='US').name, 'USA')
+            self.assertEqual(select(c for c in Country if c.id == 1)[:][0].name, 'USA')
+            rollback()
+        with db_session:
+            self.assertEqual(Country[1].name, 'United States')
+    def test_delete_invalidates(self):
+        with db_session:
+            Country(id=3, code='DE', name='Germany')
+        with db_session:
+            self.assertEqual(Country[3].name, 'Germany')
+        with db_session:
+            Country[3].delete()
+        with db_session:
+            self.assertTrue(Country.get(id=3) is None)
+    def test_bulk_delete_clears_cache(self):
+        with db_session:
+            Country(id=4, code='IT', name='Italy')
+        with db_session:
+            Country[4]
+        with db_session:
+            delete(c for c in Country if c.id == 4)
+        with db_session:
+            self.assertTrue(Country.get(id=4) is None)
+    def test_stale_rows_are_not_stored(self):
+        with db_session:
+            City[1]
+            # another session commits a change after the start of the current transaction
+            Country._cache_backend_.set((db.cache_namespace, 'Country'), 'new generation')
+            Country[1]
+        n = queries_count()
+        with db_session:
+            Country[1]
+        self.assertEqual(queries_count(), n + 1)
+        with db_session:
+            Country[1]
+        self.assertEqual(queries_count(), n + 1)
+    def test_concurrent_invalidation(self):
+        class InvalidatingCache(LocalCache):
+            def set(backend, key, value, ttl=None):
+                LocalCache.set(backend, key, value, ttl)
+                if len(key) == 3:  # simulates invalidation by another session during the store
+                    LocalCache.set(backend, key[:2], 'new generation')
+        backend = InvalidatingCache()
+        db2 = Database('sqlite', ':memory:')
+        class Currency(db2.Entity):
+            _cache_ = backend
+            code = Required(str, unique=True)
+        db2.generate_mapping(create_tables=True)
+        with db_session:
+            Currency(id=1, code='USD')
+        with db_session:
+            Currency[1]
+        self.assertEqual(backend.get((db2.cache_namespace, 'Currency', 1)), None)
+        self.assertEqual(backend.get((db2.cache_namespace, 'Currency', 'code', 'USD')), None)
+    def test_shared_backend(self):
+        backend = LocalCache()
+        db2, db3 = Database('sqlite', ':memory:'), Database('sqlite', ':memory:')
+        for database, name in ((db2, 'Spain'), (db3, 'Mexico')):
+            class Country(database.Entity):
+                _cache_ = backend
+                name = Required(str)
+            database.generate_mapping(create_tables=True)
+            with db_session:
+                Country(id=1, name=name)
+            with db_session:
+                Country[1]
+        self.assertNotEqual(db2.cache_namespace, db3.cache_namespace)
+        with db_session:
+            self.assertEqual(db2.Country[1].name, 'Spain')
+            self.assertEqual(db3.Country[1].name, 'Mexico')
+    def test_cache_namespace_option(self):
+        self.assertEqual(Database('sqlite', ':memory:', cache_namespace='main').cache_namespace, 'main')
+    def test_local_cache_ttl(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set(('a',), 1)
+        cache.set(('b',), 2, ttl=-1)
+        self.assertEqual(cache.get(('a',)), 1)
+        self.assertEqual(cache.get(('b',)), None)
+        cache.set(('c',), 3)
+        cache.set(('d',), 4)
+        self.assertEqual(cache.get(('a',)), None)
+        cache.delete(('c',))
+        self.assertEqual(cache.get(('c',)), None)
+    def test_invalid_options(self):
+        db2 = Database()
+        with self.assertRaises(TypeError):
+            class Foo(db2.Entity):
+                _cache_ = 'yes'
+        class Bar(db2.Entity):
+            _cache_ = True
+        with self.assertRaises(ERDiagramError):
+            class Baz(Bar):
+                _cache_ = True
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.dbproviders.sqlite import SQLiteProvider, SQLiteTranslator
+
+db = Database('sqlite', ':memory:')
+
+class Product(db.Entity):
+    name = Required(str)
+    price = Required(int)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    for i in range(1, 11):
+        Product(id=i, name='P%d' % i, price=i * 10)
+
+class RowValueTranslator(SQLiteTranslator):
+    row_value_syntax = True
+
+class RowValueProvider(SQLiteProvider):
+    translator_cls = RowValueTranslator
+
+db2 = Database(RowValueProvider, ':memory:')
+
+class Pair(db2.Entity):
+    a = Required(int)
+    b = Required(int)
+    PrimaryKey(a, b)
+
+db2.generate_mapping(create_tables=True)
+
+with db_session:
+    for i in range(1, 6):
+        Pair(a=i, b=i * 2)
+
+class TestInLists(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_padding(self):
+        ids = [1, 2, 3]
+        q = select(p.id for p in Product if p.id in ids)
+        self.assertEqual(set(q), {1, 2, 3})
+        sql = q.get_sql()
+        self.assertEqual(sql.count('?'), 4)
+        ids = [5, 6, 7, 8]
+        q2 = select(p.id for p in Product if p.id in ids)
+        self.assertEqual(q2.get_sql(), sql)
+        self.assertEqual(set(q2), {5, 6, 7, 8})
+    def test_not_in(self):
+        ids = [1, 2, 3, 4, 5]
+        q = select(p.id for p in Product if p.id not in ids)
+        self.assertEqual(q.get_sql().count('?'), 8)
+        self.assertEqual(set(q), {6, 7, 8, 9, 10})
+    def test_single_item(self):
+        ids = [3]
+        self.assertEqual(set(select(p.id for p in Product if p.id in ids)), {3})
+    def test_empty(self):
+        ids = []
+        self.assertEqual(set(select(p.id for p in Product if p.id in ids)), set())
+    def test_heterogeneous_types(self):
+        prices = [10, 20.0, 30]
+        q = select(p.id for p in Product if p.price in prices)
+        self.assertEqual(q.get_sql().count('?'), 3)
+        self.assertEqual(set(q), {1, 2, 3})
+    def test_entities(self):
+        products = [ Product[1], Product[2], Product[3] ]
+        q = select(p.id for p in Product if p in products)
+        self.assertEqual(q.get_sql().count('?'), 4)
+        self.assertEqual(set(q), {1, 2, 3})
+    def test_filter(self):
+        ids = [1, 2, 3]
+        q = Product.select().filter(lambda p: p.id in ids)
+        self.assertEqual(q.get_sql().count('?'), 4)
+        self.assertEqual(set(p.id for p in q), {1, 2, 3})
+    def test_prepared(self):
+        q = db.prepare(lambda ids: select(p.id for p in Product if p.id in ids))
+        self.assertEqual(set(q([1, 2, 3])), {1, 2, 3})
+        self.assertEqual(set(q([4, 5, 6, 7])), {4, 5, 6, 7})
+        self.assertEqual(set(q([8, 9, 10])), {8, 9, 10})
+        self.assertEqual(len(q.templates), 1)
+    def test_padding_limit(self):
+        limit = db.provider.max_in_list_padding
+        ids = list(range(1, limit))
+        q = select(p.id for p in Product if p.id in ids)
+        self.assertEqual(q.get_sql().count('?'), limit)
+        self.assertEqual(set(q), set(range(1, 11)))
+        ids = list(range(1, limit + 2))
+        q = select(p.id for p in Product if p.id in ids)
+        self.assertEqual(q.get_sql().count('?'), limit + 1)
+        self.assertEqual(set(q), set(range(1, 11)))
+    def test_long_list(self):
+        ids = list(range(1, 20001))
+        q = select(p.id for p in Product if p.id not in ids)
+        self.assertEqual(q.get_sql().count('?'), 20000)
+        self.assertEqual(set(q), set())
+
+class TestRowValueInLists(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_in(self):
+        pairs = [ Pair[1, 2], Pair[2, 4], Pair[3, 6] ]
+        q = select(p for p in Pair if p in pairs)
+        sql = q.get_sql()
+        self.assertIn('("p"."a", "p"."b") IN ((?, ?), (?, ?), (?, ?), (?, ?))', sql)
+        self.assertEqual(set(q), set(pairs))
+        pairs = [ Pair[2, 4], Pair[3, 6], Pair[4, 8], Pair[5, 10] ]
+        q2 = select(p for p in Pair if p in pairs)
+        self.assertEqual(q2.get_sql(), sql)
+        self.assertEqual(set(q2), set(pairs))
+    def test_not_in(self):
+        pairs = [ Pair[1, 2], Pair[2, 4], Pair[3, 6] ]
+        q = select(p for p in Pair if p not in pairs)
+        self.assertIn('("p"."a", "p"."b") NOT IN ((?, ?), (?, ?), (?, ?), (?, ?))', q.get_sql())
+        self.assertEqual(set(q), { Pair[4, 8], Pair[5, 10] })
+    def test_padding_limit(self):
+        limit = db2.provider.max_in_list_padding
+        pairs = [ Pair[1, 2] ] * (limit // 2 - 1)
+        q = select(p for p in Pair if p in pairs)
+        self.assertEqual(q.get_sql().count('?'), limit)
+        pairs.append(Pair[2, 4])
+        pairs.append(Pair[3, 6])
+        q = select(p for p in Pair if p in pairs)
+        self.assertEqual(q.get_sql().count('?'), limit + 2)
+        self.assertEqual(set(q), { Pair[1, 2], Pair[2, 4], Pair[3, 6] })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from datetime import date
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str)
+    gpa = Required(float)
+    dob = Required(date)
+    group = Required(Group)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    g1 = Group(number=1)
+    g2 = Group(number=2)
+    for i in range(1, 21):
+        Student(id=i, name='S%02d' % i, gpa=float(i % 4), dob=date(2000, 1, i), group=g1 if i % 2 else g2)
+
+class TestKeysetPagination(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def walk(self, query, pagesize):
+        result = []
+        page = query.page_after(None, pagesize)
+        while page:
+            result.extend(page)
+            page = query.page_after(page[-1], pagesize)
+        return result
+    def test_by_pk(self):
+        query = Student.select()
+        self.assertEqual([ s.id for s in self.walk(query, 6) ], list(range(1, 21)))
+    def test_tie_breaker(self):
+        query = Student.select().order_by(Student.gpa)
+        expected = [ s.id for s in Student.select().order_by(Student.gpa, Student.id) ]
+        self.assertEqual([ s.id for s in self.walk(query, 3) ], expected)
+    def test_mixed_directions(self):
+        query = Student.select().order_by(desc(Student.gpa), Student.name)
+        expected = [ s.id for s in query.order_by(desc(Student.gpa), Student.name)[:] ]
+        self.assertEqual([ s.id for s in self.walk(query, 4) ], expected)
+    def test_reference_attribute(self):
+        query = Student.select().order_by(Student.group)
+        expected = [ s.id for s in Student.select().order_by(Student.group, Student.id) ]
+        self.assertEqual([ s.id for s in self.walk(query, 7) ], expected)
+    def test_cursor(self):
+        query = Student.select().order_by(Student.dob)
+        page = query.page_after(None, 5)
+        cursor = query.get_page_cursor(page[-1])
+        self.assertEqual([ s.id for s in query.page_after(cursor, 5) ], [6, 7, 8, 9, 10])
+        self.assertEqual([ s.id for s in query.page_after((date(2000, 1, 10), 10), 2) ], [11, 12])
+    def test_invalid_cursor(self):
+        query = Student.select()
+        self.assertRaises(ValueError, query.page_after, 'garbage', 5)
+        self.assertRaises(ValueError, query.page_after, (1, 2), 5)
+    def test_not_entity_query(self):
+        query = select(s.name for s in Student)
+        self.assertRaises(TypeError, query.page_after, 'S01', 5)
+    def test_complex_order(self):
+        query = Student.select().order_by(lambda s: len(s.name))
+        self.assertRaises(TypeError, query.page_after, 1, 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,3 +62,34 @@ class TestLazy(unittest.TestCase):
         for x in result:
             self.assertFalse(X._bits_[X.b] & x._rbits_)
             self.assertTrue(X.b not in x._vals_)
+
+    @db_session
+    def test_lazy_batch_loading_default(self):
+        X = self.X
+        x1, x2, x3 = select(x for x in X).order_by(X.a)[:]
+        queries_count = lambda: sum(stat.db_count for stat in self.db.local_stats.values())
+        n = queries_count()
+        self.assertEqual(x1.b, 'first')
+        self.assertEqual(x2.b, 'second')
+        self.assertEqual(queries_count(), n + 2)
+        self.assertTrue(X.b not in x3._vals_)
+
+    def test_lazy_batch_loading(self):
+        db = Database('sqlite', ':memory:')
+        class Y(db.Entity):
+            a = Required(int)
+            b = Required(unicode, lazy=True, nplus1_threshold=1)
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            for i in range(3): Y(a=i, b=str(i))
+        with db_session:
+            y1, y2, y3 = select(y for y in Y).order_by(Y.a)[:]
+            queries_count = lambda: sum(stat.db_count for stat in db.local_stats.values())
+            n = queries_count()
+            self.assertEqual(y1.b, '0')
+            self.assertEqual(queries_count(), n + 1)
+            self.assertEqual(y2.b, '1')  # y2 and y3 are loaded by a single query
+            self.assertEqual(queries_count(), n + 2)
+            self.assertTrue(Y.b in y3._vals_)
+            self.assertEqual(y3.b, '2')
+            self.assertEqual(queries_count(), n + 2)
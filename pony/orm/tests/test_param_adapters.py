@@ -0,0 +1,73 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.ormtypes import RawSQL
+from pony.orm.dbapiprovider import Converter
+from pony.orm.sqlbuilding import Param, CompositeParam, make_adapter
+
+class UpperConverter(Converter):
+    def val2dbval(converter, val, obj=None):
+        return val.strip()
+    def py2sql(converter, val):
+        return val.upper()
+
+def make_params(*params):
+    for i, param in enumerate(params): param.id = i + 1
+    return params
+
+class TestParamAdapters(unittest.TestCase):
+    def setUp(self):
+        self.converter = UpperConverter(None, str)
+    def test_plain(self):
+        params = make_params(Param('qmark', ('x', None, None)), Param('qmark', ('y', None, None)))
+        adapter = make_adapter('qmark', params)
+        self.assertEqual(adapter({'x': 1, 'y': 2}), (1, 2))
+    def test_repeated(self):
+        param1 = Param('qmark', ('x', None, None))
+        param2 = Param('qmark', ('y', None, None))
+        adapter = make_adapter('qmark', make_params(param1, param2) + (param1, param2))
+        self.assertEqual(adapter({'x': 1, 'y': 2}), (1, 2, 1, 2))
+    def test_converter(self):
+        params = make_params(Param('qmark', ('x', None, None), self.converter),
+                                      Param('qmark', ('y', None, None), self.converter, optimistic=True))
+        adapter = make_adapter('qmark', params)
+        self.assertEqual(adapter({'x': ' a ', 'y': ' b '}), ('A', ' B '))
+        self.assertEqual(adapter({'x': None, 'y': None}), (None, None))
+    def test_base_converter_is_skipped(self):
+        params = make_params(Param('qmark', ('x', None, None), Converter(None, int)))
+        adapter = make_adapter('qmark', params)
+        self.assertEqual(adapter({'x': 5}), (5,))
+    def test_tuple_items(self):
+        params = make_params(Param('qmark', ('x', 0, None), self.converter),
+                                      Param('qmark', ('x', 1, None)))
+        adapter = make_adapter('qmark', params)
+        self.assertEqual(adapter({'x': ('a', 'b')}), ('A', 'b'))
+        raw = RawSQL('x', {}, {})
+        raw.values = ('c', 'd')
+        self.assertEqual(adapter({'x': raw}), ('C', 'd'))
+    def test_named(self):
+        param1 = Param('pyformat', ('x', None, None))
+        param2 = Param('pyformat', ('y', None, None), self.converter)
+        params = make_params(param1, param2) + (param1,)
+        adapter = make_adapter('pyformat', params)
+        self.assertEqual(adapter({'x': 1, 'y': 'b'}), {'p1': 1, 'p2': 'B'})
+    def test_composite(self):
+        items = [ Param('qmark', ('x', None, None)), Param('qmark', ('y', None, None)) ]
+        param = CompositeParam('qmark', None, items, sum)
+        adapter = make_adapter('qmark', make_params(param))
+        self.assertEqual(adapter({'x': 1, 'y': 2}), (3,))
+    def test_very_many_params(self):
+        count = 70000
+        values = { 'x': tuple(range(count)) }
+        params = make_params(*[ Param('qmark', ('x', i, None)) for i in range(count) ])
+        adapter = make_adapter('qmark', params + params[:1])
+        self.assertEqual(adapter(values), values['x'] + (0,))
+        params = make_params(*[ Param('pyformat', ('x', i, None), self.converter) for i in range(count) ])
+        adapter = make_adapter('pyformat', params)
+        result = adapter({ 'x': tuple(' a%d ' % i for i in range(count)) })
+        self.assertEqual(len(result), count)
+        self.assertEqual(result['p%d' % count], 'A%d' % (count - 1))
+
+if __name__ == '__main__':
+    unittest.main()
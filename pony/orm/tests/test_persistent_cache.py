@@ -0,0 +1,118 @@
+from __future__ import absolute_import, print_function, division
+
+import os, json, sqlite3, tempfile, unittest
+
+from pony.orm.core import *
+from pony.orm.persistentcache import entry_format
+
+def define_database(db_filename, cache_filename):
+    db = Database('sqlite', db_filename)
+    class Person(db.Entity):
+        name = Required(str)
+        age = Required(int)
+    db.generate_mapping(create_tables=True, translation_cache=cache_filename)
+    return db
+
+def find_adults(db, min_age):
+    Person = db.Person
+    return select(p for p in Person if p.age >= min_age).order_by(Person.name)[:]
+
+def all_persons(db):
+    return select(p for p in db.Person if p.age > 0)
+
+class TestPersistentCache(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        fd, self.cache_filename = tempfile.mkstemp(suffix='.cache')
+        os.close(fd)
+        self.databases = []
+        self.db = db = self.define_database()
+        with db_session:
+            db.Person(name='John', age=20)
+            db.Person(name='Mike', age=15)
+            db.Person(name='Kate', age=30)
+    def define_database(self):
+        db = define_database(self.db_filename, self.cache_filename)
+        self.databases.append(db)
+        return db
+    def tearDown(self):
+        for db in self.databases:
+            db._persistent_sql_cache.close()
+            db.disconnect()
+        os.remove(self.db_filename)
+        os.remove(self.cache_filename)
+    def stored_count(self):
+        con = sqlite3.connect(self.cache_filename)
+        try: return con.execute('select count(*) from pony_sql_cache').fetchone()[0]
+        finally: con.close()
+    def replace_stored_values(self, value):
+        con = sqlite3.connect(self.cache_filename)
+        try:
+            con.execute('update pony_sql_cache set value = ?', (value,))
+            con.commit()
+        finally: con.close()
+    def test_reload(self):
+        with db_session:
+            names = [ p.name for p in find_adults(self.db, 18) ]
+        self.assertEqual(names, ['John', 'Kate'])
+        db2 = self.define_database()
+        persistent_cache = db2._persistent_sql_cache
+        self.assertTrue(persistent_cache.loaded > 0)
+        with db_session:
+            names = [ p.name for p in find_adults(db2, 25) ]
+        self.assertEqual(names, ['Kate'])
+        self.assertEqual(persistent_cache.hits, 1)
+        self.assertEqual(len(persistent_cache.entries), persistent_cache.loaded)
+    def test_derived_queries(self):
+        with db_session:
+            all_persons(self.db)[:]
+        db2 = self.define_database()
+        with db_session:
+            query = all_persons(db2)
+            self.assertEqual(len(query[:]), 3)
+            self.assertEqual(db2._persistent_sql_cache.hits, 1)
+            self.assertEqual(query.filter(lambda p: p.name.startswith('K')).count(), 1)
+            self.assertEqual(set(p.name for p in query.order_by(db2.Person.age)), set(['John', 'Mike', 'Kate']))
+    def test_write_through(self):
+        persistent_cache = self.db._persistent_sql_cache
+        with db_session:
+            find_adults(self.db, 18)
+        self.assertEqual(self.stored_count(), len(persistent_cache.entries))
+        self.assertTrue(self.stored_count() > 0)
+    def test_plain_data(self):
+        with db_session:
+            find_adults(self.db, 18)
+        con = sqlite3.connect(self.cache_filename)
+        try: values = [ value for value, in con.execute('select value from pony_sql_cache') ]
+        finally: con.close()
+        for value in values:
+            entry = json.loads(value)
+            self.assertEqual(entry[0], entry_format)
+    def test_invalid_entries(self):
+        with db_session:
+            find_adults(self.db, 18)
+        for value in [ "cos\nsystem\n(S'echo'\ntR.", '[1, 2]', '[%d, 1, [], null]' % (entry_format + 1),
+                       '[%d, "SELECT 1", [[1, ["type", "os.system"], false, 1]], null]' % entry_format ]:
+            self.replace_stored_values(value)
+            db2 = self.define_database()
+            persistent_cache = db2._persistent_sql_cache
+            self.assertTrue(persistent_cache.loaded > 0)
+            with db_session:
+                names = [ p.name for p in find_adults(db2, 25) ]
+            self.assertEqual(names, ['Kate'])
+            self.assertEqual(persistent_cache.hits, 0)
+    def test_schema_change(self):
+        with db_session:
+            find_adults(self.db, 18)
+        db2 = Database('sqlite', self.db_filename)
+        class Person(db2.Entity):
+            name = Required(str)
+            age = Required(int)
+            email = Optional(str)
+        db2.generate_mapping(check_tables=False, translation_cache=self.cache_filename)
+        self.databases.append(db2)
+        self.assertEqual(db2._persistent_sql_cache.loaded, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+from __future__ import absolute_import, print_function, division
+
+from pony.py23compat import buffer
+
+import unittest
+from datetime import timedelta
+
+from pony.orm.core import *
+from pony.orm.dbproviders.pgutils import affects_session_state, must_discard_session_state, \
+     make_prepared_statement, preparable_re, deallocate_re, copy_text, PreparedStatements
+
+class DummyCache(object):
+    def __init__(cache, session_state_changed=False, db_session=None):
+        cache.session_state_changed = session_state_changed
+        cache.db_session = db_session
+
+class TestSessionState(unittest.TestCase):
+    def test_statements_which_change_session_state(self):
+        for sql in [ "SET search_path TO myschema", " set statement_timeout = 100", "RESET ALL",
+                     "SET SESSION AUTHORIZATION 'john'", "CREATE TEMP TABLE t (x int)",
+                     "CREATE GLOBAL TEMPORARY TABLE t (x int)", "create local temp table t (x int)",
+                     "PREPARE p AS SELECT 1", "DEALLOCATE p", "DECLARE c CURSOR WITH HOLD FOR SELECT 1",
+                     "LISTEN channel", "UNLISTEN *", "LOAD 'plugin'",
+                     "SELECT set_config('app.user', 'john', false)", "SELECT pg_advisory_lock(1)",
+                     "select pg_advisory_lock_shared (1)" ]:
+            self.assertTrue(affects_session_state(sql), sql)
+    def test_statements_which_do_not_change_session_state(self):
+        for sql in [ "SELECT * FROM person", "SET LOCAL statement_timeout = 100",
+                     "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE", "SET CONSTRAINTS ALL DEFERRED",
+                     "CREATE TABLE temperature (x int)", "UPDATE settings SET value = 1",
+                     "INSERT INTO listen (x) VALUES (1)", "SELECT pg_advisory_xact_lock(1)",
+                     "SELECT preset FROM t" ]:
+            self.assertFalse(affects_session_state(sql), sql)
+    def test_auto(self):
+        self.assertFalse(must_discard_session_state('auto', DummyCache()))
+        self.assertTrue(must_discard_session_state('auto', DummyCache(session_state_changed=True)))
+        self.assertFalse(must_discard_session_state('auto', None))
+    def test_discard(self):
+        self.assertTrue(must_discard_session_state('discard', DummyCache()))
+        self.assertTrue(must_discard_session_state('discard', None))
+    def test_rollback(self):
+        self.assertFalse(must_discard_session_state('rollback', DummyCache(session_state_changed=True)))
+    def test_ddl_session(self):
+        cache = DummyCache(session_state_changed=True, db_session=db_session(ddl=True))
+        self.assertFalse(must_discard_session_state('auto', cache))
+        self.assertFalse(must_discard_session_state('discard', cache))
+        cache = DummyCache(session_state_changed=True, db_session=db_session)
+        self.assertTrue(must_discard_session_state('auto', cache))
+
+class TestPreparedStatements(unittest.TestCase):
+    def test_parameters(self):
+        sql = 'SELECT "p"."id" FROM "person" "p" WHERE "p"."age" > %(p1)s AND "p"."name" = %(p2)s'
+        self.assertEqual(make_prepared_statement('pony_1', sql), (
+            'PREPARE pony_1 AS SELECT "p"."id" FROM "person" "p" WHERE "p"."age" > $1 AND "p"."name" = $2',
+            'EXECUTE pony_1(%(p1)s, %(p2)s)'))
+    def test_repeated_parameters(self):
+        sql = 'SELECT * FROM t WHERE a = %(p2)s OR b = %(p1)s OR c = %(p2)s'
+        self.assertEqual(make_prepared_statement('pony_2', sql), (
+            'PREPARE pony_2 AS SELECT * FROM t WHERE a = $1 OR b = $2 OR c = $1',
+            'EXECUTE pony_2(%(p2)s, %(p1)s)'))
+    def test_percent_signs(self):
+        sql = "SELECT * FROM t WHERE a LIKE '%%(x)s%%' AND b = %(p1)s AND c = 10 %% 3"
+        self.assertEqual(make_prepared_statement('pony_3', sql), (
+            "PREPARE pony_3 AS SELECT * FROM t WHERE a LIKE '%(x)s%' AND b = $1 AND c = 10 % 3",
+            'EXECUTE pony_3(%(p1)s)'))
+    def test_without_parameters(self):
+        self.assertEqual(make_prepared_statement('pony_4', "SELECT 'a%%b'"),
+                         ("PREPARE pony_4 AS SELECT 'a%b'", 'EXECUTE pony_4'))
+    def test_statement_kinds(self):
+        for sql in [ 'SELECT 1', ' select 1', 'INSERT INTO t VALUES (1)', 'update t set a = 1',
+                     'DELETE FROM t', 'WITH x AS (SELECT 1) SELECT * FROM x' ]:
+            self.assertTrue(preparable_re.match(sql), sql)
+        for sql in [ 'CREATE TABLE t (a int)', 'SET search_path TO s', 'EXECUTE pony_1', 'SELECTED' ]:
+            self.assertFalse(preparable_re.match(sql), sql)
+        self.assertEqual(deallocate_re.match('DEALLOCATE ALL').groups(), (None, None))
+        self.assertEqual(deallocate_re.match('discard  all').groups(), (None, None))
+        self.assertEqual(deallocate_re.match('DEALLOCATE pony_3').groups(), (None, 'pony_3'))
+        self.assertEqual(deallocate_re.match('deallocate prepare "P 1"').groups(), ('P 1', None))
+        self.assertEqual(deallocate_re.match('DEALLOCATE allowed').groups(), (None, 'allowed'))
+        self.assertFalse(deallocate_re.match('DISCARD TEMP'))
+
+class FakeError(Exception): pass
+
+class FakeConnection(object):
+    def __init__(self):
+        self.prepared = set()
+        self.executed = []
+        self.autocommit = False
+        self.in_transaction = False
+        self.rollbacks = 0
+    def rollback(self):
+        self.rollbacks += 1
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+    def execute(self, sql):
+        con = self.connection
+        con.executed.append(sql)
+        if sql.startswith('PREPARE '):
+            name = sql.split()[1]
+            if name in con.prepared or 'unknown' in sql: raise FakeError('cannot prepare %s' % name)
+            con.prepared.add(name)
+
+class FakePreparedStatements(PreparedStatements):
+    error_class = FakeError
+    def in_transaction(statements, connection):
+        return connection.in_transaction
+
+class TestPreparedStatementRegistry(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.cursor = FakeCursor(self.connection)
+        self.statements = FakePreparedStatements()
+    def get_sql(self, sql, arguments={}):
+        sql = self.statements.get_sql(self.cursor, sql, arguments, 1, 3)
+        deallocated = deallocate_re.match(sql)
+        if deallocated:
+            quoted_name, name = deallocated.groups()
+            if quoted_name or name: self.connection.prepared.discard(quoted_name or name.lower())
+            else: self.connection.prepared.clear()
+        return sql
+    def test_threshold(self):
+        sql = 'SELECT * FROM t WHERE a = %(p1)s'
+        self.assertEqual(self.get_sql(sql), sql)
+        self.assertEqual(self.get_sql(sql), 'EXECUTE pony_1(%(p1)s)')
+        self.assertEqual(self.get_sql(sql), 'EXECUTE pony_1(%(p1)s)')
+        self.assertEqual(self.connection.executed, [ 'PREPARE pony_1 AS SELECT * FROM t WHERE a = $1' ])
+    def test_not_preparable(self):
+        for i in range(3):
+            self.assertEqual(self.get_sql('SELECT 1', None), 'SELECT 1')
+            self.assertEqual(self.get_sql('SET search_path TO s', {}), 'SET search_path TO s')
+        self.assertEqual(self.connection.executed, [])
+    def test_max_count(self):
+        for i in range(5):
+            sql = 'SELECT %d FROM t WHERE a = %%(p1)s' % i
+            self.get_sql(sql)
+            self.get_sql(sql)
+        self.assertEqual(sorted(self.statements.names), [ 'pony_1', 'pony_2', 'pony_3' ])
+    def test_deallocate_by_name(self):
+        queries = [ 'SELECT %d FROM t WHERE a = %%(p1)s' % i for i in range(3) ]
+        for sql in queries * 2: self.get_sql(sql)
+        self.get_sql('DEALLOCATE pony_2')
+        self.assertEqual(sorted(self.statements.names), [ 'pony_1', 'pony_3' ])
+        self.assertEqual(self.get_sql(queries[0]), 'EXECUTE pony_1(%(p1)s)')
+        self.get_sql(queries[1])
+        self.assertEqual(self.get_sql(queries[1]), 'EXECUTE pony_4(%(p1)s)')
+        self.get_sql('DEALLOCATE PREPARE "pony_1"')
+        self.assertEqual(sorted(self.statements.names), [ 'pony_3', 'pony_4' ])
+    def test_deallocate_all(self):
+        queries = [ 'SELECT %d FROM t WHERE a = %%(p1)s' % i for i in range(2) ]
+        for sql in queries * 2: self.get_sql(sql)
+        for sql in [ 'DEALLOCATE ALL', 'discard all' ]:
+            self.get_sql(sql)
+            self.assertEqual(self.statements.names, {})
+            for sql in queries * 2: self.get_sql(sql)
+        self.assertEqual(self.get_sql(queries[1]), 'EXECUTE pony_6(%(p1)s)')
+        self.assertEqual(self.statements.sql_cache, dict(zip(queries, [ 'EXECUTE pony_5(%(p1)s)',
+                                                                        'EXECUTE pony_6(%(p1)s)' ])))
+    def test_names_are_not_reused(self):
+        queries = [ 'SELECT %d FROM t WHERE a = %%(p1)s' % i for i in range(3) ]
+        for sql in queries[:2] * 2: self.get_sql(sql)
+        self.statements.deallocate('pony_1')  # e.g. DEALLOCATE pony_1 was not seen, the statement still exists
+        self.connection.prepared.add('pony_1')
+        for sql in queries[2:] * 2: self.get_sql(sql)
+        self.assertEqual(self.get_sql(queries[2]), 'EXECUTE pony_3(%(p1)s)')
+    def test_prepare_error(self):
+        sql = 'SELECT * FROM unknown WHERE a = %(p1)s'
+        self.get_sql(sql)
+        self.assertEqual(self.get_sql(sql), sql)
+        self.assertEqual(self.connection.rollbacks, 1)
+        self.assertEqual(self.get_sql(sql), sql)
+        self.assertEqual(len(self.connection.executed), 1)
+    def test_prepare_in_transaction(self):
+        self.connection.in_transaction = True
+        sql = 'SELECT * FROM unknown WHERE a = %(p1)s'
+        self.get_sql(sql)
+        self.get_sql(sql)
+        self.assertEqual(self.connection.executed[0], 'SAVEPOINT pony_prepare')
+        self.assertEqual(self.connection.executed[2], 'ROLLBACK TO SAVEPOINT pony_prepare')
+        self.assertEqual(self.connection.rollbacks, 0)
+
+class TestCopyText(unittest.TestCase):
+    def test_null(self):
+        self.assertEqual(copy_text(None), '\\N')
+        self.assertEqual(copy_text(u'\\N'), '\\\\N')
+    def test_bool(self):
+        self.assertEqual(copy_text(True), 't')
+        self.assertEqual(copy_text(False), 'f')
+    def test_numbers(self):
+        self.assertEqual(copy_text(10), '10')
+        self.assertEqual(copy_text(0.1), '0.1')
+    def test_bytea(self):
+        self.assertEqual(copy_text(buffer(b'\x00ab\xff')), '\\\\x006162ff')
+    def test_escaping(self):
+        self.assertEqual(copy_text(u'a\tb\nc\rd\\e'), 'a\\tb\\nc\\rd\\\\e')
+        self.assertEqual(copy_text(u'\u0444'), u'\u0444')
+    def test_interval(self):
+        self.assertEqual(copy_text(timedelta(days=1, hours=2, seconds=3)), '26:0:3')
+        self.assertEqual(copy_text(timedelta(microseconds=500)), '0:0:0.000500')
+
+class TestSessionStateTracking(unittest.TestCase):
+    def setUp(self):
+        self.db = db = Database('sqlite', ':memory:')
+        class Person(db.Entity):
+            name = Required(str)
+        db.generate_mapping(create_tables=True)
+    def test_insert_into_mapped_table(self):
+        db = self.db
+        with db_session:
+            db.insert('Person', name='John')
+            self.assertFalse(db._get_cache().session_state_changed)
+    def test_insert_into_unmapped_table(self):
+        db = self.db
+        with db_session:
+            db.execute('create temp table tmp (x integer)')
+            cache = db._get_cache()
+            cache.session_state_changed = False
+            db.insert('tmp', x=1)
+            self.assertTrue(cache.session_state_changed)
+    def test_get_connection(self):
+        db = self.db
+        with db_session:
+            db.get_connection()
+            self.assertTrue(db._get_cache().session_state_changed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Product(db.Entity):
+    name = Required(str)
+    price = Required(int)
+    category = Optional(str)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    Product(id=1, name='Apple', price=10, category='fruit')
+    Product(id=2, name='Banana', price=20, category='fruit')
+    Product(id=3, name='Carrot', price=30)
+
+min_price_limit = 0
+
+class TestPreparedQueries(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_simple(self):
+        q = db.prepare(lambda min_price: select(p.name for p in Product if p.price > min_price))
+        self.assertEqual(set(q(15)), {'Banana', 'Carrot'})
+        self.assertEqual(set(q(25)), {'Carrot'})
+        self.assertEqual(set(q(min_price=5)), {'Apple', 'Banana', 'Carrot'})
+        self.assertEqual(len(q.templates), 1)
+    def test_vartype_change(self):
+        q = db.prepare(lambda category: select(p.id for p in Product if p.category == category))
+        self.assertEqual(set(q('fruit')), {1, 2})
+        self.assertEqual(set(q(None)), set())
+        self.assertEqual(set(q('')), {3})
+        self.assertEqual(set(q('fruit')), {1, 2})
+        self.assertEqual(len(q.templates), 2)
+    def test_collection_argument(self):
+        q = db.prepare(lambda ids: select(p.name for p in Product if p.id in ids))
+        self.assertEqual(set(q([1, 2])), {'Apple', 'Banana'})
+        self.assertEqual(set(q([3, 2])), {'Banana', 'Carrot'})
+    def test_expression_and_filter(self):
+        q = db.prepare(lambda x, y: Product.select(lambda p: p.price >= x * 10)
+                                           .filter(lambda p: p.price <= y).order_by(Product.id))
+        self.assertEqual([ p.id for p in q(2, 30) ], [2, 3])
+        self.assertEqual([ p.id for p in q(1, 20) ], [1, 2])
+    def test_default_argument(self):
+        q = db.prepare(lambda min_price=min_price_limit: select(p.id for p in Product if p.price > min_price))
+        self.assertEqual(set(q()), {1, 2, 3})
+        self.assertEqual(set(q(10)), {2, 3})
+    def test_query_methods(self):
+        q = db.prepare(lambda min_price: select(p for p in Product if p.price > min_price))
+        self.assertEqual(q(15).count(), 2)
+        self.assertEqual(q(15).order_by(Product.price).first().id, 2)
+    def test_not_a_query(self):
+        q = db.prepare(lambda: Product.select().count())
+        self.assertRaises(TypeError, q)
+    def test_global_change(self):
+        global min_price_limit
+        q = db.prepare(lambda: select(p.id for p in Product if p.price > min_price_limit))
+        self.assertEqual(set(q()), {1, 2, 3})
+        min_price_limit = 15
+        try: self.assertEqual(set(q()), {2, 3})
+        finally: min_price_limit = 0
+    def test_closure_change(self):
+        limit = 0
+        q = db.prepare(lambda: select(p.id for p in Product if p.price > limit))
+        self.assertEqual(set(q()), {1, 2, 3})
+        limit = 25
+        self.assertEqual(set(q()), {3})
+    def test_function_with_local_variables(self):
+        def f(x):
+            limit = x * 10
+            return select(p.id for p in Product if p.price > limit)
+        self.assertRaises(TypeError, db.prepare, f)
+    def test_function_with_branches(self):
+        def f(x, all):
+            if all: return select(p.id for p in Product)
+            return select(p.id for p in Product if p.price > x)
+        self.assertRaises(TypeError, db.prepare, f)
+        self.assertRaises(TypeError, db.prepare, lambda x, all: select(p.id for p in Product)
+                                                                if all else select(p.id for p in Product if p.price > x))
+    def test_arguments_outside_of_query(self):
+        self.assertRaises(TypeError, db.prepare, lambda n: select(p for p in Product).order_by(n))
+        self.assertRaises(TypeError, db.prepare, lambda n: select(p for p in Product)[:n])
+        self.assertRaises(TypeError, db.prepare, lambda q: q.filter(lambda p: p.price > 10))
+        self.assertRaises(TypeError, db.prepare, lambda x: x + 1)
+    def test_keyword_filter(self):
+        self.assertRaises(TypeError, db.prepare, lambda name: Product.select().filter(name=name))
+    def test_not_a_function(self):
+        self.assertRaises(TypeError, db.prepare, select(p for p in Product))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Department(db.Entity):
+    name = Required(str)
+    employees = Set('Employee')
+
+class Employee(db.Entity):
+    name = Required(str)
+    salary = Required(int)
+    department = Required(Department)
+    projects = Set('Project')
+
+class Project(db.Entity):
+    title = Required(str)
+    employees = Set(Employee)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    d1 = Department(id=1, name='Sales')
+    d2 = Department(id=2, name='IT')
+    e1 = Employee(id=1, name='John', salary=1000, department=d1)
+    e2 = Employee(id=2, name='Mary', salary=2000, department=d2)
+    e3 = Employee(id=3, name='Kate', salary=3000, department=d2)
+    Project(id=1, title='Site', employees=[ e2, e3 ])
+
+def queries_count():
+    return sum(stat.db_count for stat in db.local_stats.values())
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        db._query_result_cache.clear()
+    def test_objects(self):
+        query = lambda: select(e for e in Employee if e.salary > 1500).order_by(Employee.id).cached()
+        with db_session:
+            names = [ e.name for e in query() ]
+        n = queries_count()
+        with db_session:
+            result = query()[:]
+            self.assertEqual([ e.name for e in result ], names)
+            self.assertEqual(result[0].department.name, 'IT')  # department is loaded by additional query
+        self.assertEqual(queries_count(), n + 1)
+    def test_different_arguments(self):
+        query = lambda salary: select(e for e in Employee if e.salary > salary).cached()
+        with db_session:
+            for salary in (1500, 2500):
+                query(salary)[:]
+        n = queries_count()
+        with db_session:
+            self.assertEqual(len(query(2500)), 1)
+            self.assertEqual(len(query(1500)), 2)
+        self.assertEqual(queries_count(), n)
+    def test_aggregates(self):
+        count_query = lambda: select(e for e in Employee).cached().count()
+        sum_query = lambda: select(e.salary for e in Employee).cached().sum()
+        with db_session:
+            self.assertEqual(count_query(), 3)
+            self.assertEqual(sum_query(), 6000)
+        n = queries_count()
+        with db_session:
+            self.assertEqual(count_query(), 3)
+            self.assertEqual(sum_query(), 6000)
+        self.assertEqual(queries_count(), n)
+    def test_invalidation_by_commit(self):
+        query = lambda: select(e.salary for e in Employee if e.department.name == 'IT').cached().sum()
+        with db_session:
+            self.assertEqual(query(), 5000)
+        with db_session:
+            Department[2].name = 'R&D'
+        with db_session:
+            self.assertEqual(query(), 0)
+            Department[2].name = 'IT'
+        with db_session:
+            self.assertEqual(query(), 5000)
+    def test_unrelated_tables(self):
+        query = lambda: select(d.name for d in Department).cached()[:]
+        with db_session:
+            query()
+        with db_session:
+            Project[1].title = 'Portal'
+        n = queries_count()
+        with db_session:
+            query()
+        self.assertEqual(queries_count(), n)
+    def test_m2m_invalidation(self):
+        query = lambda: select(p.title for p in Project for e in p.employees if e.name == 'John').cached()[:]
+        with db_session:
+            self.assertEqual(query(), [])
+        with db_session:
+            Project[1].employees.add(Employee[1])
+        with db_session:
+            self.assertEqual(query(), [ 'Site' ])
+            Project[1].employees.remove(Employee[1])
+        with db_session:
+            self.assertEqual(query(), [])
+    def test_own_changes(self):
+        query = lambda: select(e for e in Employee).cached().count()
+        with db_session:
+            self.assertEqual(query(), 3)
+            Employee(name='Bob', salary=500, department=Department[1])
+            flush()
+            self.assertEqual(query(), 4)
+            rollback()
+        with db_session:
+            self.assertEqual(query(), 3)
+    def test_raw_sql_execute(self):
+        query = lambda: select(e.name for e in Employee).cached()[:]
+        with db_session:
+            query()
+        n = queries_count()
+        with db_session:
+            query()
+        self.assertEqual(queries_count(), n)
+        with db_session:
+            db.execute('update Employee set name = name')
+        n = queries_count()
+        with db_session:
+            query()
+        self.assertEqual(queries_count(), n + 1)
+    def test_raw_insert(self):
+        query = lambda: select(d.name for d in Department).cached()[:]
+        with db_session:
+            self.assertEqual(set(query()), {'Sales', 'IT'})
+            db.insert(Department, id=3, name='HR')
+        with db_session:
+            self.assertEqual(set(query()), {'Sales', 'IT', 'HR'})
+            Department[3].delete()
+    def test_stats(self):
+        query = lambda: select(e.name for e in Employee).cached()[:]
+        prev_stats = db.query_cache_stats['result']
+        with db_session:
+            query()
+        with db_session:
+            query()
+        stats = db.query_cache_stats['result']
+        self.assertEqual(stats['hits'] - prev_stats['hits'], 1)
+        self.assertEqual(stats['size'], 1)
+    def test_invalid_ttl(self):
+        with db_session:
+            self.assertRaises(ValueError, select(e for e in Employee).cached, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.decompiling import get_code_key
+from pony.utils import LRUCache
+
+db = Database('sqlite', ':memory:')
+
+class Person(db.Entity):
+    name = Required(str)
+    age = Required(int)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    Person(name='John', age=20)
+    Person(name='Mike', age=30)
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertEqual(sorted(cache.data), [ 'a', 'c' ])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get_stats(), dict(size=2, maxsize=2, hits=1, misses=1, evictions=1))
+    def test_getitem(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+    def test_replace(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(sorted(cache.data), [ 'a', 'c' ])
+        self.assertEqual(cache['a'], 3)
+    def test_resize(self):
+        cache = LRUCache(3)
+        for i in range(3): cache[i] = i
+        cache.resize(1)
+        self.assertEqual(list(cache.data), [ 2 ])
+        self.assertRaises(ValueError, cache.resize, 0)
+
+class TestCodeKey(unittest.TestCase):
+    def test_equality(self):
+        f1 = lambda x: x + 1
+        f2 = lambda x: x + 1
+        key = get_code_key(f1.__code__)
+        self.assertEqual(key, get_code_key(f1.__code__))
+        self.assertEqual(hash(key), hash(get_code_key(f1.__code__)))
+        self.assertNotEqual(key, get_code_key(f2.__code__))
+        self.assertTrue(key.code is f1.__code__)
+
+class TestQueryCaches(unittest.TestCase):
+    def setUp(self):
+        self.prev_stats = db.query_cache_stats
+    def tearDown(self):
+        db.resize_query_caches(None)
+    def test_hits(self):
+        for i in range(3):
+            with db_session:
+                select(p for p in Person if p.age > i)[:]
+        stats = db.query_cache_stats
+        self.assertEqual(stats['translator']['misses'] - self.prev_stats['translator']['misses'], 1)
+        self.assertEqual(stats['translator']['hits'] - self.prev_stats['translator']['hits'], 2)
+    def test_bounded(self):
+        db.resize_query_caches(2, ['translator', 'constructed_sql'])
+        with db_session:
+            self.assertEqual(len(select(p for p in Person if p.age > 10)), 2)
+            self.assertEqual(len(select(p for p in Person if p.age > 25)), 1)
+            self.assertEqual(len(select(p for p in Person if p.name == 'John')), 1)
+            self.assertEqual(len(select(p for p in Person if p.age > 10)), 2)
+        stats = db.query_cache_stats['translator']
+        self.assertEqual(stats['size'], 2)
+        self.assertTrue(stats['evictions'] > 0)
+    def test_unknown_cache(self):
+        self.assertRaises(ValueError, db.resize_query_caches, 10, ['foo'])
+
+if __name__ == '__main__':
+    unittest.main()
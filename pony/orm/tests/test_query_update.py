@@ -0,0 +1,141 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from decimal import Decimal
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Category(db.Entity):
+    name = Required(str)
+    products = Set('Product')
+
+class Product(db.Entity):
+    name = Required(str, unique=True)
+    price = Required(Decimal)
+    status = Required(str, default='active')
+    category = Optional(Category)
+    description = Optional(LongStr)
+
+class Tag(db.Entity):
+    product_name = Required(str)
+    value = Required(str)
+    weight = Optional(int)
+    PrimaryKey(product_name, value)
+
+db.generate_mapping(create_tables=True)
+
+def update_count():
+    return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('UPDATE'))
+
+class TestQueryUpdate(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            Tag.select().delete(bulk=True)
+            Product.select().delete(bulk=True)
+            Category.select().delete(bulk=True)
+            c1 = Category(id=1, name='Books')
+            c2 = Category(id=2, name='Games')
+            Product(id=1, name='A', price=Decimal('10'), category=c1)
+            Product(id=2, name='B', price=Decimal('20'), category=c1)
+            Product(id=3, name='C', price=Decimal('30'), category=c2)
+            Tag(product_name='A', value='new')
+            Tag(product_name='C', value='new')
+        db.merge_local_stats()
+    def test_values(self):
+        with db_session:
+            self.assertEqual(select(p for p in Product if p.price > 15).update(status='archived'), 2)
+        self.assertEqual(update_count(), 1)
+        with db_session:
+            self.assertEqual(select(p.name for p in Product if p.status == 'archived').order_by(1)[:], [ 'B', 'C' ])
+    def test_lambda(self):
+        factor = Decimal('1.5')
+        with db_session:
+            Product.select().update(price=lambda p: p.price * factor, status='repriced')
+        with db_session:
+            self.assertEqual(select(p.price for p in Product).order_by(1)[:], [ 15, 30, 45 ])
+            self.assertEqual(Product[1].status, 'repriced')
+    def test_relation(self):
+        with db_session:
+            select(p for p in Product if p.category.name == 'Books').update(category=Category[2])
+        with db_session:
+            self.assertEqual(Category[2].products.count(), 3)
+            select(p for p in Product if p.id == 3).update(category=None)
+        with db_session:
+            self.assertTrue(Product[3].category is None)
+    def test_joined_condition(self):
+        with db_session:
+            n = select(p for p in Product if p.category.name == 'Games').update(price=lambda p: p.price + 1)
+            self.assertEqual(n, 1)
+        with db_session:
+            self.assertEqual(Product[3].price, 31)
+    def test_subquery_condition(self):
+        with db_session:
+            select(c for c in Category if exists(p for p in c.products if p.price < 15)).update(name=lambda c: c.name + '!')
+        with db_session:
+            self.assertEqual(select(c.name for c in Category).order_by(1)[:], [ 'Books!', 'Games' ])
+    def test_composite_pk(self):
+        with db_session:
+            select(t for t in Tag if t.product_name == 'A').update(weight=5)
+        with db_session:
+            self.assertEqual(Tag['A', 'new'].weight, 5)
+            self.assertTrue(Tag['C', 'new'].weight is None)
+    def test_objects_in_session_cache(self):
+        with db_session:
+            p1, p3 = Product[1], Product[3]
+            self.assertEqual(p1.description, '')
+            c1 = Category[1]
+            self.assertEqual(c1.products.count(), 2)
+            select(p for p in Product if p.id in (1, 3)).update(
+                price=lambda p: p.price * 2, category=c1, description='Updated')
+            self.assertEqual((p1.price, p3.price), (20, 60))
+            self.assertEqual(p3.category, c1)
+            self.assertEqual(p1.description, 'Updated')
+            self.assertEqual(c1.products.count(), 3)
+            p1.name = 'A1'
+        with db_session:
+            self.assertEqual(Product[1].name, 'A1')
+    def test_bulk_delete_invalidates_collections(self):
+        with db_session:
+            c1 = Category[1]
+            self.assertEqual(len(c1.products), 2)
+            select(p for p in Product if p.id == 2).delete(bulk=True)
+            self.assertEqual(c1.products.count(), 1)
+    def test_pending_changes_are_flushed(self):
+        with db_session:
+            Product[1].price = Decimal('100')
+            select(p for p in Product if p.price > 50).update(status='expensive')
+            self.assertEqual(Product[1].status, 'expensive')
+    def test_errors(self):
+        with db_session:
+            query = Product.select()
+            self.assertRaises(TypeError, query.update)
+            self.assertRaises(TypeError, query.update, weight=1)
+            self.assertRaises(TypeError, query.update, id=10)
+            self.assertRaises(TypeError, Category.select().update, products=[])
+            self.assertRaises(ValueError, query.update, name=None)
+            self.assertRaises(TypeError, select(p.name for p in Product).update, name='X')
+            self.assertRaises(TranslationError, query.update, name=lambda p: p.category.name)
+            self.assertRaises(TypeError, query.update, price=lambda p: (p.price, p.price))
+            self.assertRaises(TypeError, query.update, price=lambda p: p.name)
+            self.assertRaises(TypeError, query.update, category=lambda p: p.price)
+            self.assertRaises(TypeError, Tag.select().update, weight=lambda t: t.value)
+    def test_compatible_types(self):
+        with db_session:
+            Product.select().update(price=lambda p: p.price + 1, name=lambda p: p.name + '!',
+                                    category=lambda p: p.category)
+            Tag.select().update(weight=lambda t: len(t.value))
+        with db_session:
+            self.assertEqual(Product[1].price, 11)
+            self.assertEqual(Product[1].name, 'A!')
+            self.assertEqual(Tag['A', 'new'].weight, 3)
+    def test_update_sql(self):
+        where = [ 'WHERE', [ 'EQ', [ 'COLUMN', 't', 'id' ], [ 'VALUE', 1 ] ] ]
+        sql, adapter = db.provider.ast2sql([ 'UPDATE', 'Tag', [ ('weight', [ 'VALUE', 1 ]) ], where ])
+        self.assertEqual(sql, 'UPDATE "Tag"\nSET "weight" = 1\nWHERE "t"."id" = 1')
+        sql, adapter = db.provider.ast2sql([ 'BULK_UPDATE', 'Tag', [ ('weight', [ 'VALUE', 1 ]) ], where ])
+        self.assertEqual(sql, 'UPDATE "Tag"\nSET "weight" = 1\nWHERE "id" = 1')
+
+if __name__ == '__main__':
+    unittest.main()
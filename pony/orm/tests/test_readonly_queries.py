@@ -0,0 +1,93 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.core import ReadOnlyRecord
+
+db = Database('sqlite', ':memory:')
+
+class Department(db.Entity):
+    name = Required(str)
+    employees = Set('Employee', reverse='department')
+    head = Optional('Employee', reverse='headed')
+
+class Employee(db.Entity):
+    name = Required(str)
+    bio = Optional(LongStr, lazy=True)
+    info = Optional(Json)
+    department = Required(Department)
+    headed = Optional(Department)
+
+class Manager(Employee):
+    level = Required(int)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    d1 = Department(id=1, name='Sales')
+    e1 = Employee(id=1, name='John', bio='Long story', info={'tags': ['a', 'b']}, department=d1)
+    Manager(id=2, name='Mary', level=3, department=d1)
+    commit()
+    d1.head = e1
+
+def queries_count():
+    return sum(stat.db_count for stat in db.local_stats.values())
+
+class TestReadOnlyQueries(unittest.TestCase):
+    def test_attributes(self):
+        with db_session:
+            records = select(e for e in Employee).order_by(Employee.id).readonly()[:]
+            self.assertEqual([ type(r) for r in records ], [ ReadOnlyRecord, ReadOnlyRecord ])
+            self.assertEqual([ r.name for r in records ], [ 'John', 'Mary' ])
+            self.assertEqual(records[0].info, {'tags': ['a', 'b']})
+            self.assertEqual(records[1].level, 3)
+            self.assertTrue(records[1]._entity_ is Manager)
+            self.assertEqual(repr(records[1]), 'Manager[2]')
+    def test_not_tracked(self):
+        with db_session:
+            select(e for e in Employee).readonly()[:]
+            cache = db._get_cache()
+            self.assertEqual(len(cache.objects), 0)
+            self.assertEqual(len(cache.query_results), 0)
+    def test_relation_by_pk(self):
+        with db_session:
+            record = select(e for e in Employee if e.id == 1).readonly().get()
+            n = queries_count()
+            self.assertEqual(record.department.id, 1)
+            self.assertEqual(queries_count(), n)
+            self.assertEqual(record.department.name, 'Sales')
+            self.assertEqual(queries_count(), n + 1)
+            self.assertEqual(record.headed.name, 'Sales')
+            self.assertEqual(record.department.head, record)
+    def test_lazy_attribute(self):
+        with db_session:
+            record = select(e for e in Employee if e.id == 1).readonly().first()
+            self.assertEqual(record.bio, 'Long story')
+    def test_immutable(self):
+        with db_session:
+            record = select(e for e in Employee).readonly().first()
+            with self.assertRaises(TypeError):
+                record.name = 'Kate'
+            with self.assertRaises(TypeError):
+                record.department.employees
+            with self.assertRaises(AttributeError):
+                record.salary
+    def test_readonly_db_session(self):
+        # records are returned only by queries with readonly(), as in a regular db_session
+        with db_session(readonly=True):
+            departments = select(d for d in Department)[:]
+            self.assertTrue(isinstance(departments[0], Department))
+            self.assertTrue(departments[0] is Department[1])
+            records = select(d for d in Department).readonly()[:]
+            self.assertTrue(isinstance(records[0], ReadOnlyRecord))
+            self.assertEqual(select(e.name for e in Employee).count(), 2)
+    def test_invalid_combinations(self):
+        with db_session:
+            query = select(e for e in Employee)
+            self.assertRaises(TypeError, query.for_update().readonly)
+            self.assertRaises(TypeError, query.readonly().for_update)
+            self.assertRaises(TypeError, query.readonly().prefetch, Department)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -153,6 +153,14 @@ class TestOneToOne(unittest.TestCase):
         d = f.to_dict()
         self.assertEqual(d, dict(id=3, name='F3', husband=None))
 
+    @db_session
+    def test_batch_loading(self):
+        females = select(f for f in Female).order_by(Female.id)[:]
+        db.merge_local_stats()
+        self.assertEqual(females[0].husband, Male[1])
+        self.assertEqual([ f.husband for f in females ], [ Male[1], Male[2], None ])
+        self.assertEqual(sum(stat.db_count for stat in db.local_stats.values()), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, tempfile, unittest
+
+from pony.orm.core import *
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        primary = os.path.join(self.dirname, 'primary.sqlite')
+        self.replica_files = [ os.path.join(self.dirname, 'replica%d.sqlite' % i) for i in (1, 2) ]
+        db = Database('sqlite', primary, create_db=True)
+        class Person(db.Entity):
+            name = Required(str)
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(id=1, name='John')
+        db.disconnect()
+        for i, filename in enumerate(self.replica_files):
+            shutil.copy(primary, filename)
+        self.db = db = Database()
+        class Person(db.Entity):
+            name = Required(str)
+        self.Person = Person
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.dirname)
+    def bind(self, **kwargs):
+        db = self.db
+        db.bind('sqlite', os.path.join(self.dirname, 'primary.sqlite'), replicas=self.replica_files, **kwargs)
+        db.generate_mapping()
+        with db_session:
+            self.Person[1].name = 'Mike'
+    def test_readonly_session_uses_replica(self):
+        self.bind()
+        with db_session(readonly=True):
+            self.assertEqual(self.Person[1].name, 'John')
+        with db_session:
+            self.assertEqual(self.Person[1].name, 'Mike')
+    def test_queries_use_replica_provider(self):
+        self.bind()
+        executed = []
+        def record(provider):
+            execute = provider.execute
+            def recording_execute(cursor, sql, *args):
+                executed.append((provider, sql))
+                return execute(cursor, sql, *args)
+            provider.execute = recording_execute
+        for provider in [ self.db.provider ] + self.db.replicas: record(provider)
+        with db_session(readonly=True):
+            self.Person[1]
+            replica = db_session_provider(self.db)
+        self.assertTrue(replica in self.db.replicas)
+        self.assertEqual(len(executed), 1)
+        self.assertTrue(executed[0][0] is replica)
+    def test_write_in_readonly_session(self):
+        self.bind()
+        with db_session(readonly=True):
+            self.Person[1].name = 'Kate'
+            self.assertRaises(TransactionError, flush)
+            rollback()
+    def test_readonly_with_immediate(self):
+        self.assertRaises(TypeError, db_session, readonly=True, immediate=True)
+    def test_auto_routing(self):
+        self.bind(replica_auto_routing=True)
+        with db_session:
+            p = self.Person[1]
+            self.assertEqual(p.name, 'John')
+            self.assertTrue(db_session_provider(self.db) in self.db.replicas)
+            self.Person(name='Kate')
+            flush()
+            self.assertTrue(db_session_provider(self.db) is self.db.provider)
+            self.assertEqual(set(select(p.name for p in self.Person)), set([ 'Mike', 'Kate' ]))
+        self.assertEqual(list(self.db._replica_sessions.values()), [ 0, 0 ])
+    def test_round_robin(self):
+        self.bind()
+        providers = []
+        for i in range(4):
+            with db_session(readonly=True):
+                self.Person[1]
+                providers.append(db_session_provider(self.db))
+        replicas = self.db.replicas
+        self.assertEqual(providers[:2], providers[2:])
+        self.assertEqual(set(providers), set(replicas))
+    def test_least_busy(self):
+        self.bind(replica_selection='least_busy')
+        replicas = self.db.replicas
+        self.db._replica_sessions[replicas[0]] += 1
+        with db_session(readonly=True):
+            self.Person[1]
+            self.assertTrue(db_session_provider(self.db) is replicas[1])
+        self.db._replica_sessions[replicas[0]] -= 1
+
+def db_session_provider(db):
+    return db._get_cache().provider
+
+if __name__ == '__main__':
+    unittest.main()
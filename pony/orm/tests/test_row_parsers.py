@@ -0,0 +1,73 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from datetime import date
+from decimal import Decimal
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Person(db.Entity):
+    name = Required(str)
+    birth_date = Optional(date)
+    dept = Optional('Department')
+
+class Student(Person):
+    gpa = Optional(Decimal)
+
+class Department(db.Entity):
+    number = PrimaryKey(int)
+    people = Set(Person)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    d1 = Department(number=1)
+    Person(id=1, name='John', birth_date=date(1990, 1, 1), dept=d1)
+    Student(id=2, name='Mary', gpa=Decimal('4.5'))
+
+class TestRowParsers(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_same_result(self):
+        sql = 'select "id", "classtype", "name", "birth_date", "dept", "gpa" from "Person" order by "id"'
+        rows = db.select(sql)
+        attr_offsets = { Person.id: [0], Person.classtype: [1], Person.name: [2], Person.birth_date: [3],
+                         Person.dept: [4], Student.gpa: [5] }
+        parser = Person._get_row_parser_(attr_offsets)
+        for row in rows:
+            self.assertEqual(parser(row), Person._parse_row_(row, attr_offsets))
+        self.assertTrue(Person._get_row_parser_(dict(attr_offsets)) is parser)
+    def test_objects(self):
+        people = select(p for p in Person).order_by(Person.id)[:]
+        self.assertEqual([ type(p) for p in people ], [ Person, Student ])
+        self.assertEqual(people[0].birth_date, date(1990, 1, 1))
+        self.assertEqual(people[0].dept, Department[1])
+        self.assertEqual(people[1].gpa, Decimal('4.5'))
+    def test_required_empty(self):
+        db.execute("update Person set name = '' where id = 1")
+        with self.assertRaises(ValueError) as cm:
+            select(p for p in Person if p.id == 1)[:]
+        self.assertEqual(str(cm.exception), 'Attribute Person.name is required')
+
+class TestTrustedDriverTypes(unittest.TestCase):
+    def test_trusted(self):
+        db2 = Database('sqlite', ':memory:', trusted_driver_types=True)
+        class Item(db2.Entity):
+            name = Required(str)
+            price = Required(float)
+            count = Required(int)
+        db2.generate_mapping(create_tables=True)
+        with db_session:
+            Item(id=1, name='Book', price=9.5, count=3)
+        with db_session:
+            item = Item[1]
+            self.assertEqual((item.name, item.price, item.count), ('Book', 9.5, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+from __future__ import absolute_import, print_function, division
+
+import os, tempfile, unittest
+
+from pony.orm.core import *
+
+class TestSQLitePragmas(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.filename + suffix): os.remove(self.filename + suffix)
+    def test_pragmas(self):
+        db = Database('sqlite', self.filename, journal_mode='wal', busy_timeout=1500,
+                      synchronous='normal', cache_size=-4000, mmap_size=0)
+        with db_session:
+            con = db.get_connection()
+            self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0].upper(), 'WAL')
+            self.assertEqual(con.execute('PRAGMA busy_timeout').fetchone()[0], 1500)
+            self.assertEqual(con.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(con.execute('PRAGMA cache_size').fetchone()[0], -4000)
+        db.disconnect()
+    def test_invalid_journal_mode(self):
+        self.assertRaises(ValueError, Database, 'sqlite', self.filename, journal_mode='fast')
+    def test_invalid_synchronous(self):
+        self.assertRaises(ValueError, Database, 'sqlite', self.filename, synchronous=5)
+    def test_invalid_cache_size(self):
+        self.assertRaises(TypeError, Database, 'sqlite', self.filename, cache_size='big')
+    def test_unknown_option(self):
+        self.assertRaises(TypeError, Database, 'sqlite', self.filename, page_size=4096)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.dbproviders.sqlite import SQLiteProvider
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(str, unique=True)
+    group = Required(Group)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    g1 = Group(number=1)
+    g2 = Group(number=2)
+    for i in range(1, 26):
+        Student(id=i, name='S%02d' % i, group=g1 if i % 2 else g2)
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_chunks(self):
+        chunks = list(select(s for s in Student).order_by(Student.id).iter_chunks(10))
+        self.assertEqual([ len(chunk) for chunk in chunks ], [ 10, 10, 5 ])
+        self.assertEqual([ s.name for s in chunks[2] ], [ 'S21', 'S22', 'S23', 'S24', 'S25' ])
+    def test_stream(self):
+        names = [ s.name for s in select(s for s in Student if s.group.number == 1).order_by(Student.id).stream(4) ]
+        self.assertEqual(names, [ 'S%02d' % i for i in range(1, 26, 2) ])
+    def test_stream_tuples(self):
+        result = list(select((s.name, s.group) for s in Student if s.id < 4).order_by(1).stream(2))
+        self.assertEqual(result, [ ('S01', Group[1]), ('S02', Group[2]), ('S03', Group[1]) ])
+    def test_stream_scalars(self):
+        result = list(select(s.id for s in Student).order_by(1).stream(7))
+        self.assertEqual(result, list(range(1, 26)))
+    def test_eviction(self):
+        cache = db._get_cache()
+        sizes = []
+        for chunk in select(s for s in Student).order_by(Student.id).iter_chunks(5, evict=True):
+            sizes.append(len(cache.objects))
+        # two groups and a single chunk of students are kept in the session
+        self.assertEqual(sizes, [ 7 ] * 5)
+        self.assertEqual(len(cache.indexes[Student.name]), 0)
+        self.assertFalse(any(isinstance(obj, Student) for obj in cache.seeds[Student._pk_attrs_]))
+    def test_eviction_keeps_modified_objects(self):
+        cache = db._get_cache()
+        for chunk in select(s for s in Student).order_by(Student.id).iter_chunks(5, evict=True):
+            chunk[0].name += 'x'
+        self.assertEqual(len([ obj for obj in cache.objects if isinstance(obj, Student) ]), 5)
+        flush()
+        self.assertEqual(count(s for s in Student if s.name.endswith('x')), 5)
+    def test_eviction_keeps_previously_loaded_objects(self):
+        s1 = Student[1]
+        for chunk in select(s for s in Student).iter_chunks(10, evict=True): pass
+        self.assertTrue(Student[1] is s1)
+    def test_no_eviction(self):
+        cache = db._get_cache()
+        for chunk in select(s for s in Student).iter_chunks(10): pass
+        self.assertEqual(len(cache.objects), 27)
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, select(s for s in Student).iter_chunks, 0)
+        self.assertRaises(TypeError, select(s for s in Student).iter_chunks, '10')
+
+class BlockingStreamProvider(SQLiteProvider):
+    streaming_blocks_connection = True  # like unbuffered cursors of MySQL
+
+db2 = Database(BlockingStreamProvider, ':memory:')
+
+class Item(db2.Entity):
+    name = Required(str)
+    parent = Optional('Item', reverse='children')
+    children = Set('Item', reverse='parent')
+
+db2.generate_mapping(create_tables=True)
+
+with db_session:
+    root = Item(name='root')
+    for i in range(1, 6):
+        Item(name='I%d' % i, parent=root)
+
+class TestBlockingStreams(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+    def test_stream(self):
+        names = [ item.name for item in select(i for i in Item).order_by(Item.id).stream(2) ]
+        self.assertEqual(names, [ 'root', 'I1', 'I2', 'I3', 'I4', 'I5' ])
+        self.assertEqual(count(i for i in Item), 6)
+    def test_query_during_iteration(self):
+        chunks = select(i for i in Item if i.parent).order_by(Item.id).iter_chunks(2)
+        item = next(chunks)[0]
+        self.assertRaises(TransactionError, getattr, item.parent, 'name')
+        chunks.close()
+        self.assertEqual(item.parent.name, 'root')
+    def test_prefetch(self):
+        query = select(i for i in Item).prefetch(Item.parent)
+        self.assertRaises(TypeError, query.iter_chunks, 2)
+
+if __name__ == '__main__':
+    unittest.main()
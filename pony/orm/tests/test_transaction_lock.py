@@ -50,3 +50,18 @@ class TransactionLockTestCase(unittest.TestCase):
         cache = db._get_cache()
         self.assertEqual(cache.immediate, True)
         self.assertEqual(cache.in_transaction, True)
+
+    def test_read_after_commit(self):
+        p = TestPost[post.id]
+        p.name = 'Trash'
+        commit()
+        select(p for p in TestPost)[:]
+        cache = db._get_cache()
+        self.assertEqual(cache.immediate, False)
+        self.assertEqual(cache.in_transaction, False)
+        lock = db.provider.transaction_lock
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+        p.name = 'Noname'
+        flush()
+        self.assertEqual(cache.in_transaction, True)
@@ -0,0 +1,114 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+
+db = Database('sqlite', ':memory:')
+
+class Country(db.Entity):
+    code = PrimaryKey(str)
+    name = Required(str)
+    cities = Set('City')
+
+class City(db.Entity):
+    name = Required(str)
+    country = Required(Country)
+    population = Optional(int)
+    mayor = Optional(str, nullable=True)
+    composite_key(name, country)
+
+class Product(db.Entity):
+    sku = Required(str, unique=True)
+    title = Required(str)
+    price = Optional(float)
+
+db.generate_mapping(create_tables=True)
+
+def queries_count():
+    return sum(stat.db_count for stat in db.local_stats.values())
+
+class TestUpsert(unittest.TestCase):
+    def setUp(self):
+        with db_session:
+            City.select().delete(bulk=True)
+            Country.select().delete(bulk=True)
+            Product.select().delete(bulk=True)
+            Country(code='FR', name='France')
+            Product(id=1, sku='A-1', title='Chair', price=10.0)
+        db.merge_local_stats()
+    def test_insert(self):
+        with db_session:
+            country = Country.upsert('code', code='DE', name='Germany')
+            self.assertEqual((country.code, country.name), ('DE', 'Germany'))
+            self.assertTrue(Country['DE'] is country)
+        with db_session:
+            self.assertEqual(Country['DE'].name, 'Germany')
+    def test_update(self):
+        with db_session:
+            product = Product.upsert('sku', sku='A-1', title='Armchair')
+            self.assertEqual((product.id, product.title, product.price), (1, 'Armchair', 10.0))
+        with db_session:
+            self.assertEqual(Product[1].title, 'Armchair')
+            self.assertEqual(Product.select().count(), 1)
+    def test_single_statement(self):
+        if not db.provider.insert_returning_syntax: return
+        with db_session:
+            n = queries_count()
+            Product.upsert('sku', sku='B-1', title='Table')
+            self.assertEqual(queries_count(), n + 1)
+    def test_object_in_session_cache(self):
+        with db_session:
+            product = Product[1]
+            self.assertEqual(product.title, 'Chair')
+            self.assertTrue(Product.upsert(Product.sku, sku='A-1', title='Stool', price=None) is product)
+            self.assertEqual((product.title, product.price), ('Stool', None))
+            product.price = 5.0
+        with db_session:
+            self.assertEqual((Product[1].title, Product[1].price), ('Stool', 5.0))
+    def test_composite_key(self):
+        with db_session:
+            city = City.upsert(('name', 'country'), name='Paris', country='FR', population=2)
+            self.assertTrue(city in Country['FR'].cities)
+            city2 = City.upsert(('country', 'name'), name='Paris', country=Country['FR'], population=3)
+            self.assertTrue(city2 is city)
+            self.assertEqual(city.population, 3)
+        with db_session:
+            self.assertEqual(City.get(name='Paris').population, 3)
+    def test_only_key_values(self):
+        with db_session:
+            self.assertEqual(Country.upsert('code', code='FR', name='France').name, 'France')
+            self.assertEqual(Product.upsert('sku', sku='A-1', title='Chair').price, 10.0)
+    def test_upsert_many(self):
+        with db_session:
+            rows = [ dict(sku='A-1', title='Armchair'), dict(sku='B-1', title='Table', price=20.0),
+                     dict(sku='C-1', title='Lamp'), dict(sku='B-1', title='Desk') ]
+            products = Product.upsert_many('sku', rows)
+            self.assertEqual([ p.sku for p in products ], [ 'A-1', 'B-1', 'C-1', 'B-1' ])
+            self.assertTrue(products[1] is products[3])
+            self.assertEqual(products[1].title, 'Desk')
+        with db_session:
+            self.assertEqual(select((p.sku, p.title, p.price) for p in Product).order_by(1)[:],
+                             [ ('A-1', 'Armchair', 10.0), ('B-1', 'Desk', 20.0), ('C-1', 'Lamp', None) ])
+    def test_without_returning(self):
+        provider = db.provider
+        provider.insert_returning_syntax = False
+        try:
+            with db_session:
+                products = Product.upsert_many('sku', [ dict(sku='A-1', title='Armchair'), dict(sku='B-1', title='Table') ])
+                self.assertEqual([ p.title for p in products ], [ 'Armchair', 'Table' ])
+                city = City.upsert(('name', 'country'), name='Lyon', country='FR')
+                self.assertEqual(city.country.code, 'FR')
+        finally: del provider.insert_returning_syntax
+        with db_session:
+            self.assertEqual(Product.get(sku='B-1').title, 'Table')
+    def test_errors(self):
+        with db_session:
+            self.assertRaises(TypeError, Product.upsert, 'title', sku='A-1', title='Chair')
+            self.assertRaises(TypeError, Product.upsert, 'color', sku='A-1', title='Chair')
+            self.assertRaises(ValueError, Product.upsert, 'sku', title='Chair')
+            self.assertRaises(ValueError, Product.upsert, 'sku', sku='D-1')
+            self.assertRaises(TypeError, City.upsert, 'name', name='Nice', country='FR')
+
+if __name__ == '__main__':
+    unittest.main()
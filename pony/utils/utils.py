@@ -28,6 +28,8 @@ from pony.thirdparty.decorator import decorator as _decorator
 if pony.MODE.startswith('GAE-'): localbase = object
 else: from threading import local as localbase
 
+from threading import Lock
+
 
 class PonyDeprecationWarning(DeprecationWarning):
     pass
@@ -106,11 +108,99 @@ def throw(exc_type, *args, **kwargs):
             raise exc  # Set "pony.options.CUT_TRACEBACK = False" to see full traceback
     finally: del exc
 
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+_missing = object()
+
+class LRUCache(object):
+    def __init__(cache, maxsize=None):
+        cache._maxsize = maxsize  # None means options.QUERY_CACHE_SIZE
+        cache.lock = Lock()
+        cache.data = {}  # key -> [prev_link, next_link, key, value]
+        root = cache.root = []  # the most recently used link is root[_PREV]
+        root[:] = [ root, root, None, None ]
+        cache.hits = cache.misses = cache.evictions = 0
+    @property
+    def maxsize(cache):
+        maxsize = cache._maxsize
+        return maxsize if maxsize is not None else options.QUERY_CACHE_SIZE
+    def resize(cache, maxsize):
+        if maxsize is not None and maxsize < 1: throw(ValueError, 'Cache size must be positive. Got: %r' % maxsize)
+        with cache.lock:
+            cache._maxsize = maxsize
+            cache._shrink()
+    def get(cache, key, default=None):
+        with cache.lock:
+            link = cache.data.get(key)
+            if link is None:
+                cache.misses += 1
+                return default
+            cache.hits += 1
+            link_prev, link_next = link[_PREV], link[_NEXT]
+            link_prev[_NEXT] = link_next
+            link_next[_PREV] = link_prev
+            root = cache.root
+            last = root[_PREV]
+            last[_NEXT] = root[_PREV] = link
+            link[_PREV] = last
+            link[_NEXT] = root
+            return link[_VALUE]
+    def __getitem__(cache, key):
+        result = cache.get(key, _missing)
+        if result is _missing: raise KeyError(key)
+        return result
+    def __contains__(cache, key):
+        return key in cache.data
+    def __len__(cache):
+        return len(cache.data)
+    def __setitem__(cache, key, value):
+        with cache.lock:
+            data = cache.data
+            root = cache.root
+            link = data.get(key)
+            if link is not None:
+                link_prev, link_next = link[_PREV], link[_NEXT]
+                link_prev[_NEXT] = link_next
+                link_next[_PREV] = link_prev
+            last = root[_PREV]
+            link = [ last, root, key, value ]
+            last[_NEXT] = root[_PREV] = data[key] = link
+            cache._shrink()
+    def pop(cache, key, default=None):
+        with cache.lock:
+            link = cache.data.pop(key, None)
+            if link is None: return default
+            link_prev, link_next = link[_PREV], link[_NEXT]
+            link_prev[_NEXT] = link_next
+            link_next[_PREV] = link_prev
+            value = link[_VALUE]
+            del link[:]
+            return value
+    def _shrink(cache):
+        data = cache.data
+        root = cache.root
+        maxsize = cache.maxsize
+        while len(data) > maxsize:
+            oldest = root[_NEXT]
+            root[_NEXT] = oldest_next = oldest[_NEXT]
+            oldest_next[_PREV] = root
+            del data[oldest[_KEY]]
+            del oldest[:]  # break reference cycle
+            cache.evictions += 1
+    def clear(cache):
+        with cache.lock:
+            cache.data.clear()
+            root = cache.root
+            root[:] = [ root, root, None, None ]
+    def get_stats(cache):
+        with cache.lock:
+            return dict(size=len(cache.data), maxsize=cache.maxsize,
+                        hits=cache.hits, misses=cache.misses, evictions=cache.evictions)
+
 def truncate_repr(s, max_len=100):
     s = repr(s)
     return s if len(s) <= max_len else s[:max_len-3] + '...'
 
-lambda_args_cache = {}
+lambda_args_cache = LRUCache()
 
 def get_lambda_args(func):
     names = lambda_args_cache.get(func)